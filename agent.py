@@ -1,30 +1,44 @@
-import os
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
 
+from llm_registry import get_chat_model
 from main_mix import generate_code, generate_tests, repair_code, run_pytest, validate_code
+from workspace import Workspace, create_workspace
 
 # Load env
 load_dotenv()
 
+MODULE_NAME = "generated_code_A"
+CODE_FILENAME = f"{MODULE_NAME}.py"
+TEST_FILENAME = f"tests/test_{MODULE_NAME}.py"
+
+# Private workspace for this run (created on first use, see get_workspace)
+_workspace: Workspace | None = None
+
+
+def get_workspace() -> Workspace:
+    """Return this run's workspace, so concurrent runs never share files."""
+    global _workspace
+    if _workspace is None:
+        _workspace = create_workspace(MODULE_NAME)
+    return _workspace
+
 
 # === Tools ===
 
 @tool
 def GenerateCodeTool(task: str) -> str:
     """Generate Python code for the given task."""
-    llm_code = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm_code = get_chat_model("gpt-5-mini")
     code = generate_code(task, llm_code)
-    with open("generated_code_A.py", "w", encoding="utf-8") as f:
-        f.write(code)
+    get_workspace().write_code(code)
     return code
 
 
 @tool
 def GenerateTestsTool(code: str) -> str:
     """Generate pytest test suite for the given code (only for public functions)."""
-    llm_tests = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm_tests = get_chat_model("gpt-5-mini")
 
     # More restrictive prompt for test generation
     constrained_prompt = f"""
@@ -41,17 +55,15 @@ def GenerateTestsTool(code: str) -> str:
     {code}
     """
 
-    tests = generate_tests(constrained_prompt, llm_tests)
-    os.makedirs("tests", exist_ok=True)
-    with open("tests/test_generated_code_A.py", "w", encoding="utf-8") as f:
-        f.write(tests)
+    tests = generate_tests(constrained_prompt, llm_tests, module_name=MODULE_NAME)
+    get_workspace().write_tests(tests)
     return tests
 
 
 @tool
 def RunPytestTool(_: str = "") -> str:
     """Run pytest on the generated code and return the output."""
-    success, output = run_pytest()
+    success, output = run_pytest(get_workspace())
     return output
 
 
@@ -59,10 +71,9 @@ def RunPytestTool(_: str = "") -> str:
 def RepairCodeTool(args: dict) -> str:
     """Repair the generated code using pytest output.
     Args must contain 'code', 'tests', and 'errors'."""
-    llm_repair = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm_repair = get_chat_model("gpt-5-mini")
     fixed_code = repair_code(args["code"], args["tests"], args["errors"], llm_repair)
-    with open("generated_code_A.py", "w", encoding="utf-8") as f:
-        f.write(fixed_code)
+    get_workspace().write_code(fixed_code)
     return fixed_code
 
 
@@ -74,7 +85,7 @@ def main():
 
     # Step 1: Generate code
     code = GenerateCodeTool.run(task)
-    print("\n✅ Code generated and saved to generated_code_A.py")
+    print(f"\n✅ Code generated and saved to {get_workspace().path}/{CODE_FILENAME}")
 
     # Step 2: Validate code
     if not validate_code(code):
@@ -83,15 +94,15 @@ def main():
 
     # Step 3: Generate tests
     tests = GenerateTestsTool.run(code)
-    print("✅ Tests generated and saved to tests/test_generated_code_A.py")
+    print(f"✅ Tests generated and saved to {get_workspace().path}/{TEST_FILENAME}")
 
     # Step 4: Run pytest
     print("\n=== Running pytest ===")
-    output = RunPytestTool.run("")
+    success, output = run_pytest(get_workspace())
     print(output)
 
     # Step 5: If tests fail, repair
-    if "FAILED" in output or "Error" in output:
+    if not success:
         print("⚠️ Tests failed. Attempting repair...")
         fixed_code = RepairCodeTool.invoke({
             "args": {
@@ -100,19 +111,22 @@ def main():
                 "errors": output
             }
         })
-        print("\n✅ Fixed code saved to generated_code_A.py")
+        print(f"\n✅ Fixed code saved to {get_workspace().path}/{CODE_FILENAME}")
 
         # Run pytest again
         print("\n=== Running pytest after repair ===")
-        output2 = RunPytestTool.run("")
+        success, output2 = run_pytest(get_workspace())
         print(output2)
-        if "FAILED" not in output2:
+        if success:
             print("🎉 All tests passed after repair!")
         else:
             print("❌ Tests still failing. Manual review needed.")
     else:
         print("🎉 All tests passed on first run!")
 
+    get_workspace().publish()
+    print(f"📄 Results copied to {CODE_FILENAME} and {TEST_FILENAME}")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
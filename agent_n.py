@@ -1,15 +1,34 @@
 # -*- coding: utf-8 -*-
-import os
-import subprocess
 from dotenv import load_dotenv
-# Import ChatOpenAI and tool decorator from LangChain
-from langchain_openai import ChatOpenAI
+# Import tool decorator from LangChain
 from langchain_core.tools import tool
 
+from llm_registry import get_chat_model
+from prompt_budget import build_repair_inputs, merge_code
+from scheduler import submit
+from tracing import traced
+from workspace import Workspace, create_workspace
+
 # Load environment variables (e.g., API keys from .env file)
 load_dotenv()
 
+MODULE_NAME = "generated_code_A_mix"
+CODE_FILENAME = f"{MODULE_NAME}.py"
+TEST_FILENAME = f"tests/test_{MODULE_NAME}.py"
+
+# Private workspace for this run (created on first use, see get_workspace)
+_workspace: Workspace | None = None
+
+
+def get_workspace() -> Workspace:
+    """Return this run's workspace, so concurrent runs never share files."""
+    global _workspace
+    if _workspace is None:
+        _workspace = create_workspace(MODULE_NAME)
+    return _workspace
+
 # Utility functions for code generation, testing, and repair
+@traced("generate_code")
 def generate_code(task: str, llm) -> str:
     """Use the LLM to generate Python code for the given task description."""
     prompt = (
@@ -22,47 +41,51 @@ def generate_code(task: str, llm) -> str:
         "- Do not include any explanation or commentary, only output the code."
     )
     # Get response from the language model
-    response = llm.predict(prompt)
+    response = submit(llm, prompt, lambda: llm.predict(prompt))
     return response.strip()
 
+@traced("generate_tests")
 def generate_tests(prompt: str, llm) -> str:
     """Use the LLM to generate a pytest test suite based on the given prompt."""
     # Get response from the language model for test generation
-    response = llm.predict(prompt)
+    response = submit(llm, prompt, lambda: llm.predict(prompt))
     return response.strip()
 
+REPAIR_INSTRUCTIONS = (
+    "You are an expert Python developer and code fixer.\n"
+    "The Python code below has failing tests; its tests and their results follow it.\n"
+    "Please analyze the failures and modify the code to fix the issues.\n"
+    "Do not alter the tests. Output only the corrected code, without any additional commentary.\n\n"
+)
+
+@traced("repair_code")
 def repair_code(code: str, tests: str, errors: str, llm) -> str:
     """Use the LLM to repair the code based on test failures and error output."""
+    # Keep the prompt within the token budget (failing tests, relevant functions only)
+    inputs, stats = build_repair_inputs(code, tests, errors, model=llm.model_name)
+    # Fixed instructions first, so every repair prompt shares them as a cacheable prefix
     prompt = (
-        "You are an expert Python developer and code fixer.\n"
-        "The following Python code has failing tests.\n\n"
-        "Code:\n" + code + "\n\n"
-        "Tests:\n" + tests + "\n\n"
-        "Test results (failures and errors):\n" + errors + "\n\n"
-        "Please analyze the failures and modify the code to fix the issues.\n"
-        "Do not alter the tests. Output only the corrected code, without any additional commentary."
+        REPAIR_INSTRUCTIONS
+        + "Code:\n" + inputs["code"] + "\n\n"
+        "Tests:\n" + inputs["tests"] + "\n\n"
+        "Test results (failures and errors):\n" + inputs["errors"]
     )
     # Get the fixed code from the language model
-    response = llm.predict(prompt)
-    return response.strip()
+    response = submit(llm, prompt, lambda: llm.predict(prompt)).strip()
+    return merge_code(code, response) if stats.code_partial else response
 
 def run_pytest():
-    """Run pytest on the generated code and capture the result.
-    Returns a tuple (success: bool, output: str)."""
-    try:
-        # Run pytest quietly (no detailed output except summary and errors)
-        result = subprocess.run(["pytest", "-q"], capture_output=True, text=True)
-    except Exception as e:
-        return False, f"Pytest execution failed: {e}"
-    output = result.stdout + result.stderr
-    # success is True if return code is 0 (all tests passed)
-    success = (result.returncode == 0)
-    return success, output
+    """Run pytest on the generated tests and capture the result.
+    Returns a tuple (success: bool, report: str) where the report only
+    describes the failing tests."""
+    # Run pytest quietly, collecting only this run's test file
+    result = get_workspace().run_tests()
+    return result.success, result.failure_report()
 
 def validate_code(code: str) -> bool:
     """Check if the generated code is syntactically valid (compilable)."""
     try:
-        compile(code, "generated_code_A_mix.py", "exec")
+        compile(code, CODE_FILENAME, "exec")
         return True
     except Exception:
         return False
@@ -73,18 +96,17 @@ def validate_code(code: str) -> bool:
 def GenerateCodeTool(task: str) -> str:
     """Generate Python code for the given task."""
     # Initialize LLM for code generation (deterministic output)
-    llm_code = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm_code = get_chat_model("gpt-5-mini")
     code = generate_code(task, llm_code)
-    # Save the generated code to file
-    with open("generated_code_A_mix.py", "w", encoding="utf-8") as f:
-        f.write(code)
+    # Save the generated code to the workspace
+    get_workspace().write_code(code)
     return code
 
 @tool
 def GenerateTestsTool(code: str) -> str:
     """Generate pytest test suite for the given code (only for public functions)."""
     # Initialize LLM for test generation
-    llm_tests = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm_tests = get_chat_model("gpt-5-mini")
     # Construct a prompt with constraints for test generation
     constrained_prompt = f"""You are an expert Python developer.
 Write a pytest test suite for the following code.
@@ -102,10 +124,8 @@ Code under test:
 {code}
 """
     tests = generate_tests(constrained_prompt, llm_tests)
-    # Ensure the tests directory exists and save the tests to a file
-    os.makedirs("tests", exist_ok=True)
-    with open("tests/test_generated_code_A_mix.py", "w", encoding="utf-8") as f:
-        f.write(tests)
+    # Save the tests to the workspace
+    get_workspace().write_tests(tests)
     return tests
 
 @tool
@@ -119,16 +139,15 @@ def RepairCodeTool(input_data: dict) -> str:
     """Repair the generated code using pytest output.
     Input must contain 'code', 'tests', and 'errors'."""
     # Initialize LLM for code repair
-    llm_repair = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm_repair = get_chat_model("gpt-5-mini")
     fixed_code = repair_code(
         input_data.get("code", ""),
         input_data.get("tests", ""),
         input_data.get("errors", ""),
         llm_repair
     )
-    # Save the repaired code back to the code file
-    with open("generated_code_A_mix.py", "w", encoding="utf-8") as f:
-        f.write(fixed_code)
+    # Save the repaired code back to the workspace
+    get_workspace().write_code(fixed_code)
     return fixed_code
 
 # === Pipeline ===
@@ -139,7 +158,7 @@ def main():
 
     # Step 1: Generate code
     code = GenerateCodeTool.run(task)
-    print("\n✅ Code generated and saved to generated_code_A_mix.py")
+    print(f"\n✅ Code generated and saved to {get_workspace().path}/{CODE_FILENAME}")
 
     # Step 2: Validate code
     if not validate_code(code):
@@ -148,15 +167,15 @@ def main():
 
     # Step 3: Generate tests
     tests = GenerateTestsTool.run(code)
-    print("✅ Tests generated and saved to tests/test_generated_code_A_mix.py")
+    print(f"✅ Tests generated and saved to {get_workspace().path}/{TEST_FILENAME}")
 
     # Step 4: Run pytest
     print("\n=== Running pytest ===")
-    output = RunPytestTool.run("")
+    success, output = run_pytest()
     print(output)
 
     # Step 5: If tests fail, attempt repair
-    if "FAILED" in output or "Error" in output:
+    if not success:
         print("⚠️ Tests failed. Attempting repair...")
         fixed_code = RepairCodeTool.invoke({
             "args": {
@@ -165,18 +184,21 @@ def main():
                 "errors": output
             }
         })
-        print("\n✅ Fixed code saved to generated_code_A_mix.py")
+        print(f"\n✅ Fixed code saved to {get_workspace().path}/{CODE_FILENAME}")
 
         # Run tests again after repair
         print("\n=== Running pytest after repair ===")
-        output2 = RunPytestTool.run("")
+        success, output2 = run_pytest()
         print(output2)
-        if "FAILED" not in output2 and "Error" not in output2:
+        if success:
             print("🎉 All tests passed after repair!")
         else:
             print("❌ Tests still failing. Manual review needed.")
     else:
         print("🎉 All tests passed on first run!")
 
+    get_workspace().publish()
+    print(f"📄 Results copied to {CODE_FILENAME} and {TEST_FILENAME}")
+
 if __name__ == "__main__":
     main()
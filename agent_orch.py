@@ -1,15 +1,32 @@
+import contextvars
 import os
 import re
-import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from llm_registry import get_chat_model
 from main import generate_code, generate_tests, validate_code
+from model_router import get_router
+from prompt_budget import compact_errors
+from pytest_service import RunResult, configure_workers
+from scheduler import submit
 from style_knowledge_base import add_documents, retrieve_style
+from tracing import span, trace_config, traced
+from workspace import Workspace, create_workspace
 
 # ---------- Constants ----------
-CODE_FILENAME = "generated_code_agent.py"
+MODULE_NAME = "generated_code_agent"
+CODE_FILENAME = f"{MODULE_NAME}.py"
 TESTS_DIR = "tests"
-TEST_FILENAME = os.path.join(TESTS_DIR, "test_generated_code_agent.py")
+TEST_FILENAME = os.path.join(TESTS_DIR, f"test_{MODULE_NAME}.py")
+PYTEST_ARGS = ("-v", "--maxfail=1", "--disable-warnings")
+
+# Repair candidates fired concurrently in parallel mode, as "model:temperature" pairs
+REPAIR_CANDIDATES = os.getenv("REPAIR_CANDIDATES", "gpt-4o-mini:0,gpt-4o-mini:0.7,gpt-5-mini:1")
+PARALLEL_REPAIR = os.getenv("PARALLEL_REPAIR", "0") == "1"
 
 # ---------- Helpers ----------
 
@@ -21,33 +38,146 @@ def clean_code(text: str) -> str:
     return text.strip()
 
 
-def save_file(filename: str, content: str) -> None:
-    """Save text to a file, ensuring directory exists if needed."""
-    dirpath = os.path.dirname(filename)
-    if dirpath:
-        os.makedirs(dirpath, exist_ok=True)
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(content)
+def run_pytest(workspace: Workspace) -> tuple[bool, str]:
+    """Run pytest on the workspace's test file and return success flag and failure report."""
+    result = workspace.run_tests(args=PYTEST_ARGS)
+    return result.success, result.failure_report()
+
+
+# ---------- Repair ----------
+
+# Fixed instructions lead the prompt, so repair requests share a prefix.
+# It is still below CACHEABLE_PREFIX_TOKENS: format_prefix_report() measures it, nothing is cached yet.
+REPAIR_INSTRUCTIONS = """
+The Python code and tests below failed pytest.
+Fix the code and/or tests so that pytest passes.
+Return only valid Python code for the fixed code first,
+then below a marker line '### TESTS ###',
+return valid pytest tests.
+"""
+
+
+def build_repair_prompt(code: str, tests: str, output: str, model: str) -> str:
+    """Prompt asking for fixed code and tests separated by a marker line."""
+    return f"""{REPAIR_INSTRUCTIONS}
+--- CODE ---
+{code}
+
+--- TESTS ---
+{tests}
+
+--- PYTEST OUTPUT ---
+{compact_errors(output, model)}
+"""
+
+
+def parse_repair(repaired: str) -> tuple[str, str] | None:
+    """Split a repair answer into (code, tests), or None if the marker is missing."""
+    if "### TESTS ###" not in repaired:
+        return None
+    new_code, new_tests = repaired.split("### TESTS ###", 1)
+    tests = clean_code(new_tests).replace("from generated_code import", f"from {MODULE_NAME} import")
+    return clean_code(new_code), tests
+
 
+def repair_candidates(spec: str = REPAIR_CANDIDATES) -> list[ChatOpenAI]:
+    """Build the candidate models from a "model:temperature,..." spec."""
+    llms = []
+    for item in spec.split(","):
+        model, _, temperature = item.strip().partition(":")
+        llms.append(get_chat_model(model, float(temperature or 0)))
+    return llms
 
-def run_pytest(test_file: str) -> tuple[bool, str]:
-    """Run pytest on the given test file and return success flag and output."""
-    result = subprocess.run(
-        ["pytest", test_file, "-v", "--maxfail=1", "--disable-warnings"],
-        capture_output=True,
-        text=True,
-    )
-    return result.returncode == 0, result.stdout + result.stderr
+
+@dataclass
+class RepairCandidate:
+    """One repair attempt and its test outcome in a sandbox."""
+
+    model: str
+    temperature: float
+    code: str
+    tests: str
+    result: RunResult
+
+
+def _test_in_sandbox(code: str, tests: str) -> RunResult:
+    """Run the suite against `code` in a throwaway workspace."""
+    with create_workspace(MODULE_NAME, prefix="repair-") as sandbox:
+        sandbox.write_code(code)
+        sandbox.write_tests(tests)
+        return sandbox.run_tests(args=PYTEST_ARGS)
+
+
+def _run_candidate(llm: ChatOpenAI, prompt: str, cancelled: threading.Event) -> RepairCandidate | None:
+    start = time.perf_counter()
+    with span("repair_candidate", model=llm.model_name, temperature=llm.temperature):
+        repaired = submit(llm, prompt, lambda: llm.invoke(prompt, config=trace_config())).content
+    latency = time.perf_counter() - start
+    parsed = parse_repair(repaired)
+    if parsed is None:
+        get_router().record("repair", llm.model_name, latency, False)
+    if parsed is None or cancelled.is_set():
+        return None
+    code, tests = parsed
+    candidate = RepairCandidate(llm.model_name, llm.temperature, code, tests, _test_in_sandbox(code, tests))
+    get_router().record("repair", llm.model_name, latency, candidate.result.success)
+    return candidate
+
+
+def parallel_repair(code: str, tests: str, output: str, llms: list[ChatOpenAI]) -> tuple[RepairCandidate | None, bool]:
+    """Fire one repair per model concurrently; the first candidate whose tests pass wins.
+
+    Returns (candidate, passed). When no candidate passes, the one with the
+    fewest failing tests is returned so the next round can build on it.
+    Remaining candidates are cancelled as soon as one passes: queued ones never
+    start and in-flight ones skip their test run.
+    """
+    cancelled = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=len(llms))
+    pending = {
+        # Each candidate runs in a copy of this context, so its spans join the current trace
+        pool.submit(
+            contextvars.copy_context().run,
+            _run_candidate, llm, build_repair_prompt(code, tests, output, llm.model_name), cancelled,
+        )
+        for llm in llms
+    }
+    best: RepairCandidate | None = None
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    candidate = future.result()
+                except Exception as e:
+                    print(f"⚠️ Repair candidate failed: {e}")
+                    continue
+                if candidate is None:
+                    continue
+                if candidate.result.success:
+                    return candidate, True
+                if best is None or len(candidate.result.failures) < len(best.result.failures):
+                    best = candidate
+        return best, False
+    finally:
+        cancelled.set()
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 # ---------- Workflow ----------
 
-def auto_generate_and_test(task: str) -> None:
-    """End-to-end pipeline: generate code, generate tests, run pytest, repair if needed."""
+@traced("task")
+def auto_generate_and_test(task: str, parallel: bool = PARALLEL_REPAIR) -> None:
+    """End-to-end pipeline: generate code, generate tests, run pytest, repair if needed.
 
-    llm_code = ChatOpenAI(model="gpt-5-mini", temperature=0)
-    llm_tests = ChatOpenAI(model="gpt-5-mini", temperature=0)
-    llm_repair = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    With `parallel`, each repair round races several candidate models
+    (REPAIR_CANDIDATES) in sandboxes instead of trying one repair at a time.
+    """
+
+    router = get_router()
+    llms = repair_candidates() if parallel else []
+    if parallel:
+        configure_workers(len(llms))  # one warm pytest worker per candidate
 
     # 1. Generate code (with RAG style guidance)
     print("📝 Generating code...")
@@ -55,68 +185,82 @@ def auto_generate_and_test(task: str) -> None:
     style_guidelines = retrieve_style(task)
     style_text = "\n".join([doc.page_content for doc in style_guidelines])
 
-    code = generate_code(task, llm_code)
-    code = clean_code(code)
+    code = router.run("code", lambda llm: clean_code(generate_code(task, llm)), validate_code)
     if not validate_code(code):
         print("❌ Generated code is invalid Python. Aborting.")
         return
 
-    save_file(CODE_FILENAME, code)
-    print(f"✅ Code saved to {CODE_FILENAME}")
-
-    # 2. Generate tests
-    print("🧪 Generating tests...")
-    raw_tests = generate_tests(code, llm_tests)
-    tests = clean_code(raw_tests)
-    tests = tests.replace("from generated_code import", "from generated_code_agent import")
-    save_file(TEST_FILENAME, tests)
-    print(f"✅ Tests saved to {TEST_FILENAME}")
-
-    # 3. Run pytest loop with auto-repair
-    max_rounds = 3
-    for round_no in range(1, max_rounds + 1):
-        print(f"\n🚀 Running pytest (round {round_no})...")
-        success, output = run_pytest(TEST_FILENAME)
-
-        if success:
-            print("🎉 All tests passed successfully!\n")
-            print(output)  # pokaż pełny wynik pytest
-            return
-        else:
-            print("❌ Tests failed. Sending to LLM for repair...")
-            # 4. Repair code and tests
-            repair_prompt = f"""
-The following Python code and tests failed pytest.
+    # Work in a private workspace so concurrent runs cannot clobber each other
+    with create_workspace(MODULE_NAME) as workspace:
+        workspace.write_code(code)
+        print(f"✅ Code saved to {workspace.path}/{CODE_FILENAME}")
 
---- CODE ---
-{code}
+        # 2. Generate tests
+        print("🧪 Generating tests...")
+        raw_tests = generate_tests(code, router.llm_for("tests"))
+        tests = clean_code(raw_tests)
+        tests = tests.replace("from generated_code import", f"from {MODULE_NAME} import")
+        workspace.write_tests(tests)
+        print(f"✅ Tests saved to {workspace.path}/{TEST_FILENAME}")
 
---- TESTS ---
-{tests}
+        # 3. Run pytest loop with auto-repair
+        pending_repair: tuple[str, float] | None = None  # (model, latency) judged by the next pytest run
+        try:
+            max_rounds = 3
+            for round_no in range(1, max_rounds + 1):
+                print(f"\n🚀 Running pytest (round {round_no})...")
+                success, output = run_pytest(workspace)
+                if pending_repair is not None:
+                    router.record("repair", *pending_repair, success)
+                    pending_repair = None
 
---- PYTEST OUTPUT ---
-{output}
+                if success:
+                    print("🎉 All tests passed successfully!\n")
+                    print(output)  # pokaż pełny wynik pytest
+                    return
+                else:
+                    print("❌ Tests failed. Sending to LLM for repair...")
+                    # 4. Repair code and tests
+                    if parallel:
+                        with span("repair_code", candidates=len(llms)):
+                            candidate, passed = parallel_repair(code, tests, output, llms)
+                        if candidate is None:
+                            print("⚠️ No repair candidate produced code/tests.")
+                            continue
+                        code, tests = candidate.code, candidate.tests
+                        workspace.write_code(code)
+                        workspace.write_tests(tests)
+                        print(f"🔧 Repair from {candidate.model} (temperature={candidate.temperature}) written: "
+                              f"{candidate.result.summary()}")
+                        if passed:
+                            print("🎉 All tests passed successfully!\n")
+                            print(candidate.result.failure_report())
+                            return
+                        continue
 
-Fix the code and/or tests so that pytest passes.
-Return only valid Python code for the fixed code first,
-then below a marker line '### TESTS ###',
-return valid pytest tests.
-"""
-            repaired = llm_repair.invoke(repair_prompt).content
-            # Split code and tests
-            if "### TESTS ###" in repaired:
-                new_code, new_tests = repaired.split("### TESTS ###", 1)
-                code = clean_code(new_code)
-                tests = clean_code(new_tests)
-                tests = tests.replace("from generated_code import", "from generated_code_agent import")
-                save_file(CODE_FILENAME, code)
-                save_file(TEST_FILENAME, tests)
-                print("🔧 Repaired code and tests written.")
-            else:
-                print("⚠️ Repair step failed to produce code/tests.")
-                break
-
-    print("🚨 Could not fix code/tests after retries.")
+                    # Each round escalates along the router's repair ladder
+                    llm_repair = router.llm_for("repair", round_no - 1)
+                    start = time.perf_counter()
+                    with span("repair_code"):
+                        prompt = build_repair_prompt(code, tests, output, llm_repair.model_name)
+                        response = submit(llm_repair, prompt, lambda: llm_repair.invoke(prompt, config=trace_config()))
+                        repaired = response.content
+                    latency = time.perf_counter() - start
+                    parsed = parse_repair(repaired)
+                    if parsed is None:
+                        router.record("repair", llm_repair.model_name, latency, False)
+                        print("⚠️ Repair step failed to produce code/tests.")
+                        break
+                    pending_repair = (llm_repair.model_name, latency)
+                    code, tests = parsed
+                    workspace.write_code(code)
+                    workspace.write_tests(tests)
+                    print("🔧 Repaired code and tests written.")
+
+            print("🚨 Could not fix code/tests after retries.")
+        finally:
+            workspace.publish()
+            print(f"📄 Results copied to {CODE_FILENAME} and {TEST_FILENAME}")
 
 
 def main():
@@ -0,0 +1,537 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+from code_analysis import analyze
+from incremental import rerun_after_repair
+from main import agenerate_code, agenerate_tests, generate_code, generate_tests, validate_code
+from main_mix import arepair_code, repair_code
+from model_router import ModelRouter, get_router, pinned_router
+from preflight import preflight_stats, run_checked
+from prompt_budget import compaction_totals
+from prompt_prefix import format_prefix_report
+from pytest_service import configure_workers
+from run_store import get_run_store
+from scheduler import get_scheduler
+from solution_cache import Solution, astore_solution, find_reusable, reuse_if_passing, store_solution
+from speculative import agenerate_code_and_tests, generate_code_and_tests
+from streaming import agenerate_code_streaming, generate_code_streaming
+from style_knowledge_base import warm_up
+from tracing import current_span, print_summary, traced
+
+# ---------- Constants ----------
+DEFAULT_OUT_DIR = "batch_output"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_REPAIRS = 1
+DEFAULT_MODEL = "gpt-5-mini"  # every stage's model when routing is off
+
+
+@dataclass
+class BatchTask:
+    """One line of the tasks JSONL file."""
+
+    name: str
+    task: str
+
+
+@dataclass
+class BatchOptions:
+    """Pipeline switches shared by every task of a batch."""
+
+    max_repairs: int = DEFAULT_MAX_REPAIRS
+    speculative: bool = False  # draft tests while the code is generated
+    stream: bool = False  # stream code generation, aborting doomed generations (not with speculative)
+    route: bool = True  # cheapest model first, escalating on failure (see model_router)
+    resume: bool = False  # skip tasks an earlier run already solved (see run_store)
+
+
+@dataclass
+class BatchResult:
+    """Outcome of the generate -> test -> repair pipeline for one task."""
+
+    name: str
+    task: str
+    status: str  # "passed", "failed", "invalid" or "error"
+    repairs: int = 0
+    speculative_hit: bool = False
+    solution_reused: bool = False  # a cached solution to a near-duplicate task passed its tests
+    resumed: bool = False  # solved by an earlier run: its code and tests were written back as they were
+    duration: float = 0.0
+    code_file: str = ""
+    test_file: str = ""
+    error: str = ""
+    trace_id: str = ""  # groups this task's spans in the trace file
+
+
+# ---------- Helpers ----------
+
+def module_name_for(name: str) -> str:
+    """Turn a task name into a valid, importable module name."""
+    slug = re.sub(r"\W+", "_", name).strip("_").lower() or "task"
+    if slug[0].isdigit():
+        slug = f"task_{slug}"
+    return slug
+
+
+def load_tasks(path: str) -> list[BatchTask]:
+    """Read tasks from JSONL: {"task": "...", "name": "optional_module_name"}."""
+    tasks: list[BatchTask] = []
+    seen: set[str] = set()
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "task" not in entry:
+                raise ValueError(f"{path}:{line_no}: missing 'task' field")
+            name = module_name_for(entry.get("name") or f"task_{line_no:04d}")
+            if name in seen:
+                raise ValueError(f"{path}:{line_no}: duplicate task name '{name}'")
+            seen.add(name)
+            tasks.append(BatchTask(name=name, task=entry["task"]))
+    return tasks
+
+
+def save_file(filename: str, content: str) -> None:
+    """Save text to a file, ensuring directory exists if needed."""
+    dirpath = os.path.dirname(filename)
+    if dirpath:
+        os.makedirs(dirpath, exist_ok=True)
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def run_pytest(test_file: str, cwd: str) -> tuple[bool, str]:
+    """Run pytest on a single test file from the batch output directory (after the pre-flight checks)."""
+    result = run_checked(test_file, cwd)
+    return result.success, result.failure_report()
+
+
+async def arun_pytest(test_file: str, cwd: str) -> tuple[bool, str]:
+    """Async variant of run_pytest (the warm worker does the work, the loop stays free)."""
+    return await asyncio.to_thread(run_pytest, test_file, cwd)
+
+
+def rerun_pytest(test_file: str, cwd: str, tests: str, old_code: str, new_code: str, errors: str) -> tuple[bool, str]:
+    """Rerun after a repair: failing and affected tests first, then the whole file."""
+    result = rerun_after_repair(test_file, cwd, tests, old_code, new_code, errors)
+    return result.success, result.failure_report()
+
+
+async def arerun_pytest(test_file: str, cwd: str, tests: str, old_code: str, new_code: str, errors: str) -> tuple[bool, str]:
+    """Async variant of rerun_pytest."""
+    return await asyncio.to_thread(rerun_pytest, test_file, cwd, tests, old_code, new_code, errors)
+
+
+def reuse_cached_solution(item: BatchTask, out_dir: str, test_rel: str) -> tuple[str, str] | None:
+    """Write and re-test the stored solution of a near-duplicate task; (code, tests) when it passes."""
+    solution = find_reusable(item.task)
+    if solution is None:
+        return None
+
+    def run(code: str, tests: str) -> bool:
+        save_file(os.path.join(out_dir, f"{item.name}.py"), code)
+        save_file(os.path.join(out_dir, test_rel), tests)
+        return run_pytest(test_rel, out_dir)[0]
+
+    return reuse_if_passing(solution, item.name, run)
+
+
+def resume_solved(item: BatchTask, code_file: str, test_file: str) -> bool:
+    """Write the code and tests with which an earlier run solved exactly this task, if any."""
+    solved = get_run_store().solved(item.task)
+    if solved is None:
+        return False
+    save_file(code_file, solved.code)
+    save_file(test_file, Solution(solved.task, solved.code, solved.tests, solved.name).tests_for(item.name))
+    return True
+
+
+def cache_solution(item: BatchTask, code: str, tests: str) -> None:
+    """Remember a passing solution for near-duplicate tasks; failing to do so does not fail the task."""
+    try:
+        store_solution(item.task, code, tests, item.name)
+    except Exception as e:
+        print(f"⚠️ {item.name}: solution not cached ({type(e).__name__}: {e})")
+
+
+async def acache_solution(item: BatchTask, code: str, tests: str) -> None:
+    """Async variant of cache_solution."""
+    try:
+        await astore_solution(item.task, code, tests, item.name)
+    except Exception as e:
+        print(f"⚠️ {item.name}: solution not cached ({type(e).__name__}: {e})")
+
+
+def generate_draft(item: BatchTask, llm_code: ChatOpenAI, router: ModelRouter, options: BatchOptions):
+    """Generate the code for a task (and its tests, when speculative): (code, tests, speculative_hit)."""
+    if options.speculative:
+        return generate_code_and_tests(item.task, llm_code, router.llm_for("tests"), module_name=item.name)
+    if options.stream:
+        return generate_code_streaming(item.task, llm_code), "", False
+    return generate_code(item.task, llm_code), "", False
+
+
+async def agenerate_draft(item: BatchTask, llm_code: ChatOpenAI, router: ModelRouter, options: BatchOptions):
+    """Async variant of generate_draft."""
+    if options.speculative:
+        return await agenerate_code_and_tests(item.task, llm_code, router.llm_for("tests"), module_name=item.name)
+    if options.stream:
+        return await agenerate_code_streaming(item.task, llm_code), "", False
+    return await agenerate_code(item.task, llm_code), "", False
+
+
+def _valid_tests(tests: str) -> bool:
+    return analyze(tests).valid
+
+
+# ---------- Pipeline ----------
+
+class _TaskAttempt:
+    """Bookkeeping of one task shared by process_task and aprocess_task.
+
+    Owns the result, the files, the run-store rounds and the repair
+    accounting; the two pipelines only make the (awaited or not) calls.
+    """
+
+    def __init__(self, item: BatchTask, out_dir: str, router: ModelRouter, options: BatchOptions,
+                 run_id: str | None) -> None:
+        self.item = item
+        self.out_dir = out_dir
+        self.router = router
+        self.options = options
+        self.run_id = run_id
+        self.start = time.perf_counter()
+        self.code_file = os.path.join(out_dir, f"{item.name}.py")
+        self.test_rel = os.path.join("tests", f"test_{item.name}.py")
+        self.result = BatchResult(
+            name=item.name,
+            task=item.task,
+            status="error",
+            code_file=self.code_file,
+            test_file=os.path.join(out_dir, self.test_rel),
+            trace_id=current_span().trace_id,
+        )
+        self.run_store = get_run_store()
+        self.task_run = None
+        self.code = self.tests = self.output = ""
+        self.success = False
+        self.solution: tuple[str, str] | None = None  # cached once the task is recorded as passed
+        self._repair_llm: ChatOpenAI | None = None
+        self._repair_start = self._repair_latency = 0.0
+
+    def resume(self) -> bool:
+        """Restore an earlier run's solution when resuming; otherwise start recording this attempt."""
+        if self.options.resume and resume_solved(self.item, self.code_file, self.result.test_file):
+            self.result.status, self.result.resumed = "passed", True
+            return True
+        self.task_run = self.run_store.start_task(self.run_id, self.item.task, self.item.name)
+        return False
+
+    def reused(self, solution: tuple[str, str] | None) -> bool:
+        """Record a passing cached solution of a near-duplicate task, if there is one."""
+        if solution is None:
+            return False
+        self.result.status, self.result.solution_reused = "passed", True
+        self.run_store.record_round(self.task_run, 0, *solution, True, "", time.perf_counter() - self.start)
+        return True
+
+    def drafted(self, code: str, tests: str, speculative_hit: bool) -> bool:
+        """Save the generated code; False (task invalid) when it is not valid Python."""
+        self.result.speculative_hit = speculative_hit
+        if not validate_code(code):
+            self.result.status = "invalid"
+            return False
+        self.code, self.tests = code, tests
+        save_file(self.code_file, code)
+        return True
+
+    def save_tests(self, tests: str) -> None:
+        self.tests = tests
+        save_file(self.result.test_file, tests)
+
+    def tested(self, success: bool, output: str) -> None:
+        """Record the first pytest run (round 0)."""
+        self.success, self.output = success, output
+        self.run_store.record_round(
+            self.task_run, 0, self.code, self.tests, success, output, time.perf_counter() - self.start
+        )
+
+    def next_repair(self) -> ChatOpenAI | None:
+        """Model for the next repair round (escalating each round), or None when done."""
+        if self.success or self.result.repairs >= self.options.max_repairs:
+            return None
+        self._repair_llm = self.router.llm_for("repair", self.result.repairs)
+        self._repair_start = time.perf_counter()
+        self.result.repairs += 1
+        return self._repair_llm
+
+    def repaired(self, fixed_code: str) -> bool:
+        """Save the repaired code; False (stop repairing) when it is not valid Python."""
+        self._repair_latency = time.perf_counter() - self._repair_start
+        if not validate_code(fixed_code):
+            self.router.record("repair", self._repair_llm.model_name, self._repair_latency, False)
+            return False
+        save_file(self.code_file, fixed_code)
+        return True
+
+    def rerun_args(self, fixed_code: str) -> tuple[str, str, str, str, str, str]:
+        """Arguments of rerun_pytest / arerun_pytest after a repair to `fixed_code`."""
+        return self.test_rel, self.out_dir, self.tests, self.code, fixed_code, self.output
+
+    def retested(self, fixed_code: str, success: bool, output: str) -> None:
+        """Record the pytest run of a repair round and its outcome for the router."""
+        self.run_store.record_round(
+            self.task_run, self.result.repairs, fixed_code, self.tests, success, output,
+            time.perf_counter() - self._repair_start,
+        )
+        self.router.record("repair", self._repair_llm.model_name, self._repair_latency, success)
+        self.code, self.success, self.output = fixed_code, success, output
+
+    def done(self) -> None:
+        """The repair loop is over: the task passed or failed."""
+        self.result.status = "passed" if self.success else "failed"
+        if self.success:
+            self.solution = self.code, self.tests
+
+    def failed(self, e: Exception) -> None:
+        self.result.error = f"{type(e).__name__}: {e}"
+
+    def finish(self) -> None:
+        self.result.duration = round(time.perf_counter() - self.start, 3)
+        self.run_store.finish_task(
+            self.task_run, self.result.status, self.result.repairs, self.result.error, self.result.duration
+        )
+
+
+@traced("task")
+def process_task(
+    item: BatchTask, out_dir: str, router: ModelRouter, options: BatchOptions, run_id: str | None = None
+) -> BatchResult:
+    """Generate code and tests for one task, repairing up to `options.max_repairs` times.
+
+    Each stage starts on the router's cheapest model and escalates when its
+    output fails validation; each repair round escalates too.
+    """
+    attempt = _TaskAttempt(item, out_dir, router, options, run_id)
+    if attempt.resume():
+        return attempt.result
+    try:
+        if attempt.reused(reuse_cached_solution(item, out_dir, attempt.test_rel)):
+            return attempt.result
+        draft = router.run(
+            "code", lambda llm: generate_draft(item, llm, router, options), lambda draft: validate_code(draft[0])
+        )
+        if not attempt.drafted(*draft):
+            return attempt.result
+        tests = attempt.tests or router.run(
+            "tests", lambda llm: generate_tests(attempt.code, llm, module_name=item.name), _valid_tests
+        )
+        attempt.save_tests(tests)
+        attempt.tested(*run_pytest(attempt.test_rel, out_dir))
+        while (llm_repair := attempt.next_repair()) is not None:
+            fixed_code = repair_code(attempt.code, attempt.tests, attempt.output, llm_repair)
+            if not attempt.repaired(fixed_code):
+                break
+            attempt.retested(fixed_code, *rerun_pytest(*attempt.rerun_args(fixed_code)))
+        attempt.done()
+    except Exception as e:  # one broken task must not kill the whole batch
+        attempt.failed(e)
+    finally:
+        attempt.finish()
+    if attempt.solution is not None:
+        cache_solution(item, *attempt.solution)
+    return attempt.result
+
+
+@traced("task")
+async def aprocess_task(
+    item: BatchTask, out_dir: str, router: ModelRouter, options: BatchOptions, run_id: str | None = None
+) -> BatchResult:
+    """Async variant of process_task built on `ainvoke`."""
+    attempt = _TaskAttempt(item, out_dir, router, options, run_id)
+    if attempt.resume():
+        return attempt.result
+    try:
+        if attempt.reused(await asyncio.to_thread(reuse_cached_solution, item, out_dir, attempt.test_rel)):
+            return attempt.result
+        draft = await router.arun(
+            "code", lambda llm: agenerate_draft(item, llm, router, options), lambda draft: validate_code(draft[0])
+        )
+        if not attempt.drafted(*draft):
+            return attempt.result
+        tests = attempt.tests or await router.arun(
+            "tests", lambda llm: agenerate_tests(attempt.code, llm, module_name=item.name), _valid_tests
+        )
+        attempt.save_tests(tests)
+        attempt.tested(*await arun_pytest(attempt.test_rel, out_dir))
+        while (llm_repair := attempt.next_repair()) is not None:
+            fixed_code = await arepair_code(attempt.code, attempt.tests, attempt.output, llm_repair)
+            if not attempt.repaired(fixed_code):
+                break
+            attempt.retested(fixed_code, *await arerun_pytest(*attempt.rerun_args(fixed_code)))
+        attempt.done()
+    except Exception as e:  # one broken task must not kill the whole batch
+        attempt.failed(e)
+    finally:
+        attempt.finish()
+    if attempt.solution is not None:
+        await acache_solution(item, *attempt.solution)
+    return attempt.result
+
+
+def batch_router(options: BatchOptions) -> ModelRouter:
+    """The shared router, or one pinned to DEFAULT_MODEL when routing is off."""
+    return get_router() if options.route else pinned_router(DEFAULT_MODEL)
+
+
+def start_batch_run(tasks: list[BatchTask], out_dir: str, concurrency: int, options: BatchOptions) -> str:
+    """Open this batch's run in the run store."""
+    return get_run_store().start_run(
+        "batch", tasks=len(tasks), out_dir=out_dir, concurrency=concurrency, **asdict(options)
+    )
+
+
+def run_batch(
+    tasks: list[BatchTask],
+    out_dir: str = DEFAULT_OUT_DIR,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    options: BatchOptions | None = None,
+) -> list[BatchResult]:
+    """Run the pipeline for all tasks with at most `concurrency` tasks in flight."""
+    options = options or BatchOptions()
+    save_file(os.path.join(out_dir, "tests", "__init__.py"), "")
+
+    # The router and its clients are thread-safe and shared by all workers.
+    router = batch_router(options)
+    run_id = start_batch_run(tasks, out_dir, concurrency, options)
+
+    # Load the embedding model once, before workers start retrieving.
+    warm_up()
+    configure_workers(concurrency)
+
+    results: list[BatchResult] = []
+    results_file = os.path.join(out_dir, "results.jsonl")
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, open(results_file, "w", encoding="utf-8") as log:
+        futures = [pool.submit(process_task, item, out_dir, router, options, run_id) for item in tasks]
+        for future in as_completed(futures):
+            _record(future.result(), results, len(tasks), log)
+    get_run_store().finish_run(run_id)  # interrupted runs keep finished_at empty
+    return results
+
+
+async def arun_batch(
+    tasks: list[BatchTask],
+    out_dir: str = DEFAULT_OUT_DIR,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    options: BatchOptions | None = None,
+) -> list[BatchResult]:
+    """Async variant of run_batch: one event loop drives all in-flight tasks."""
+    options = options or BatchOptions()
+    save_file(os.path.join(out_dir, "tests", "__init__.py"), "")
+
+    router = batch_router(options)
+    run_id = start_batch_run(tasks, out_dir, concurrency, options)
+
+    await asyncio.to_thread(warm_up)
+    configure_workers(concurrency)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(item: BatchTask) -> BatchResult:
+        async with semaphore:
+            return await aprocess_task(item, out_dir, router, options, run_id)
+
+    results: list[BatchResult] = []
+    results_file = os.path.join(out_dir, "results.jsonl")
+    with open(results_file, "w", encoding="utf-8") as log:
+        for next_done in asyncio.as_completed([bounded(item) for item in tasks]):
+            _record(await next_done, results, len(tasks), log)
+    get_run_store().finish_run(run_id)
+    return results
+
+
+def _record(result: BatchResult, results: list[BatchResult], total: int, log) -> None:
+    """Append a finished task to the results list, results file and console."""
+    results.append(result)
+    log.write(json.dumps(asdict(result)) + "\n")
+    log.flush()
+    icon = "✅" if result.status == "passed" else "❌"
+    print(f"{icon} [{len(results)}/{total}] {result.name}: {result.status} "
+          f"({result.repairs} repairs, {result.duration:.1f}s)")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate code and tests for many tasks concurrently.")
+    parser.add_argument("tasks", help="JSONL file with one {\"task\": ..., \"name\": ...} object per line")
+    parser.add_argument("--out-dir", default=DEFAULT_OUT_DIR, help="where modules and tests are written")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="max tasks in flight")
+    parser.add_argument("--max-repairs", type=int, default=DEFAULT_MAX_REPAIRS, help="repair rounds per task")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="drive all tasks from one asyncio event loop instead of a thread pool")
+    generation = parser.add_mutually_exclusive_group()
+    generation.add_argument("--speculative", action="store_true",
+                            help="draft tests from the task while the code is being generated")
+    generation.add_argument("--stream", action="store_true",
+                            help="stream code generation and abort doomed generations early")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip tasks already solved by an earlier run, restoring their code and tests")
+    parser.add_argument("--no-route", dest="route", action="store_false",
+                        help=f"use {DEFAULT_MODEL} for every stage instead of cost/latency-aware routing")
+    parser.add_argument("--prefix-report", action="store_true",
+                        help="print the prompt prefix shared by each stage's requests at the end")
+    parser.add_argument("--trace-summary", action="store_true",
+                        help="print time, tokens and cache hits per pipeline stage at the end")
+    args = parser.parse_args()
+
+    tasks = load_tasks(args.tasks)
+    print(f"🤖 Running {len(tasks)} tasks with concurrency {args.concurrency}...")
+    start = time.perf_counter()
+    options = BatchOptions(
+        max_repairs=args.max_repairs,
+        speculative=args.speculative,
+        stream=args.stream,
+        route=args.route,
+        resume=args.resume,
+    )
+    if args.use_async:
+        results = asyncio.run(arun_batch(tasks, args.out_dir, args.concurrency, options))
+    else:
+        results = run_batch(tasks, args.out_dir, args.concurrency, options)
+    passed = sum(r.status == "passed" for r in results)
+    print(f"\n🎉 {passed}/{len(results)} tasks passed in {time.perf_counter() - start:.1f}s")
+    resumed = sum(r.resumed for r in results)
+    if resumed:
+        print(f"⏭️ {resumed} tasks already solved by an earlier run (skipped)")
+    reused = sum(r.solution_reused for r in results)
+    if reused:
+        print(f"♻️ {reused} tasks reused a cached solution (no LLM calls)")
+    checks = preflight_stats()
+    if checks.rounds_saved:
+        print(f"🛫 Pre-flight checks saved {checks.rounds_saved}/{checks.checks} pytest runs")
+    compaction = compaction_totals()
+    if compaction.calls:
+        print(f"✂️ Repair prompts: {compaction.compacted}/{compaction.calls} compacted, "
+              f"{compaction.tokens_saved} tokens saved ({compaction.tokens_before} → {compaction.tokens_after})")
+    scheduler = get_scheduler()
+    if scheduler.stats.throttled or scheduler.stats.retries:
+        print(f"🚦 {scheduler.format_stats()}")
+    if args.prefix_report:
+        print("\n🧩 Prompt prefix shared per stage (provider prompt caching):")
+        print(format_prefix_report())
+    if args.trace_summary:
+        print_summary()
+    print(f"📄 Results written to {os.path.join(args.out_dir, 'results.jsonl')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+import agent_orch
+import agent_orch_advanced
+import main
+import main_advanced
+import style_knowledge_base
+import style_knowledge_base_advanced
+from incremental import rerun_after_repair
+from llm_cache import set_response_cache
+from llm_registry import get_chat_model, register_chat_model
+from tracing import Span, finished_span_count, finished_spans, percentile
+from workspace import create_workspace
+
+# ---------- Constants ----------
+DEFAULT_RUNS = 20
+DEFAULT_WARMUP = 1  # runs excluded from the statistics (worker start-up, index build)
+DEFAULT_LATENCY = 0.05  # seconds injected per fake LLM call
+FAKE_EMBEDDING_MODEL = "fake-embedding"
+FAKE_EMBEDDING_SIZE = 384
+
+# Every model name the benchmarked flows ask the registry for
+BENCH_MODELS = ("gpt-5-mini", "gpt-4o-mini")
+
+# ---------- Fake model ----------
+
+FIXED_CODE = '''def add(a: int, b: int) -> int:
+    """Return the sum of a and b."""
+    return a + b
+'''
+
+BUGGY_CODE = FIXED_CODE.replace("a + b", "a - b")
+
+TESTS = '''def test_add():
+    assert add(2, 3) == 5
+
+
+def test_add_zero():
+    assert add(0, 0) == 0
+
+
+def test_add_negative():
+    assert add(-1, 1) == 0
+'''
+
+
+def _fenced(code: str) -> str:
+    return f"```python\n{code}```"
+
+
+def canned_replies(scenario: str) -> dict[str, str]:
+    """Replies per prompt kind; in the "repair" scenario the first code fails and the repair fixes it."""
+    code = BUGGY_CODE if scenario == "repair" else FIXED_CODE
+    return {
+        "code": _fenced(code),
+        "tests": _fenced(TESTS),
+        "repair": _fenced(FIXED_CODE),
+        "repair_with_tests": _fenced(FIXED_CODE) + "\n### TESTS ###\n"
+        + _fenced(f"import pytest\nfrom generated_code import add\n\n\n{TESTS}"),
+    }
+
+
+def prompt_kind(prompt: str) -> str:
+    """Which pipeline step a prompt belongs to, told apart by the wording each step uses."""
+    if "### TESTS ###" in prompt:
+        return "repair_with_tests"  # agent_orch repairs code and tests together
+    if "pytest output" in prompt.lower():
+        return "repair"
+    if "test suite" in prompt:
+        return "tests"
+    return "code"
+
+
+class FakePipelineChatModel(FakeListChatModel):
+    """FakeListChatModel answering every pipeline prompt after a fixed, injected latency.
+
+    Replies are picked by prompt kind (see prompt_kind) instead of in list
+    order, so every flow gets a sensible answer whatever order it asks in.
+    """
+
+    responses: list[str] = []  # unused: see `replies`
+    replies: dict[str, str] = {}
+    latency: float = 0.0
+    model_name: str = "fake"
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs: Any) -> str:
+        time.sleep(self.latency)
+        return self.replies[prompt_kind("\n".join(str(message.content) for message in messages))]
+
+
+def install_fakes(latency: float = DEFAULT_LATENCY, scenario: str = "repair") -> None:
+    """Route every model and embedding lookup of the pipelines to local fakes."""
+    replies = canned_replies(scenario)
+    for model in BENCH_MODELS:
+        register_chat_model(model, FakePipelineChatModel(model_name=model, latency=latency, replies=replies))
+    embeddings = DeterministicFakeEmbedding(size=FAKE_EMBEDDING_SIZE)
+    style_knowledge_base.set_embeddings(embeddings, FAKE_EMBEDDING_MODEL)
+    style_knowledge_base_advanced.set_embeddings(embeddings, FAKE_EMBEDDING_MODEL)
+    set_response_cache(None)  # every call pays the injected latency, as an uncached API call would
+
+
+# ---------- Flows ----------
+
+def flow_main(task: str) -> None:
+    """main.py: generate code and tests (then run them, which main.py leaves to the user)."""
+    llm = get_chat_model("gpt-5-mini")
+    code = main.generate_code(task, llm)
+    if not main.validate_code(code):
+        raise RuntimeError("generated code is invalid")
+    with create_workspace("generated_code") as workspace:
+        workspace.write_code(code)
+        workspace.write_tests(main.generate_tests(code, llm))
+        workspace.run_tests()
+
+
+def flow_main_advanced(task: str) -> None:
+    """main_advanced.py: generate, test, repair once and rerun the affected tests."""
+    code = main_advanced.generate_code(task, get_chat_model("gpt-5-mini"))
+    if not main_advanced.validate_code(code):
+        raise RuntimeError("generated code is invalid")
+    with create_workspace(main_advanced.MODULE_NAME) as workspace:
+        workspace.write_code(code)
+        tests = main_advanced.generate_tests(code, get_chat_model("gpt-4o-mini"))
+        workspace.write_tests(tests)
+        success, output = main_advanced.run_pytest(workspace)
+        if not success:
+            fixed_code = main_advanced.repair_code(code, tests, output, get_chat_model("gpt-5-mini"))
+            workspace.write_code(fixed_code)
+            rerun_after_repair(workspace.test_file, workspace.path, tests, code, fixed_code, output)
+
+
+FLOWS: dict[str, Callable[[str], None]] = {
+    "main": flow_main,
+    "main_advanced": flow_main_advanced,
+    "agent_orch": lambda task: agent_orch.auto_generate_and_test(task, parallel=False),
+    "agent_orch_advanced": agent_orch_advanced.auto_generate_and_test,
+}
+
+
+# ---------- Measurement ----------
+
+@dataclass
+class StageReport:
+    """Time spent in one pipeline stage, with and without the injected LLM latency."""
+
+    calls: int
+    llm_calls: int
+    p50_ms: float
+    p95_ms: float
+    overhead_ms: float  # mean time per call not spent waiting for the (fake) LLM
+
+
+@dataclass
+class FlowReport:
+    """End-to-end latency and throughput of one flow."""
+
+    flow: str
+    runs: int
+    errors: int
+    throughput: float  # runs per second
+    p50: float
+    p95: float
+    stages: dict[str, StageReport] = field(default_factory=dict)
+    first_error: str = ""
+
+
+def _nested_llm_calls(spans: list[Span]) -> dict[str, int]:
+    """LLM calls made inside each span, including those of the spans nested in it."""
+    by_id = {s.span_id: s for s in spans}
+    totals = {s.span_id: 0 for s in spans}
+    for s in spans:
+        node: Span | None = s
+        while node is not None:
+            totals[node.span_id] += s.llm_calls
+            node = by_id.get(node.parent_id) if node.parent_id else None
+    return totals
+
+
+def stage_reports(spans: list[Span], latency: float) -> dict[str, StageReport]:
+    """Per-stage timings; overhead subtracts `latency` for every LLM call made inside the span."""
+    nested = _nested_llm_calls(spans)
+    stages: dict[str, list[Span]] = {}
+    for s in spans:
+        stages.setdefault(s.stage, []).append(s)
+    reports = {}
+    for stage, group in stages.items():
+        durations = [s.duration for s in group]
+        overhead = sum(max(0.0, s.duration - latency * nested[s.span_id]) for s in group) / len(group)
+        reports[stage] = StageReport(
+            calls=len(group),
+            llm_calls=sum(nested[s.span_id] for s in group),
+            p50_ms=round(percentile(durations, 0.5) * 1000, 2),
+            p95_ms=round(percentile(durations, 0.95) * 1000, 2),
+            overhead_ms=round(overhead * 1000, 2),
+        )
+    return reports
+
+
+def run_flow(name: str, runs: int, warmup: int = DEFAULT_WARMUP, latency: float = DEFAULT_LATENCY) -> FlowReport:
+    """Run one flow `warmup + runs` times on distinct tasks and measure the last `runs`."""
+    flow = FLOWS[name]
+    durations: list[float] = []
+    errors = 0
+    first_error = ""
+    first_span = 0
+    for i in range(warmup + runs):
+        if i == warmup:
+            first_span = finished_span_count()
+        task = f"Write add(a, b) returning the sum of two integers (variant {i})."
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):  # the flows narrate every step
+                flow(task)
+        except Exception as e:
+            errors += i >= warmup
+            first_error = first_error or f"{type(e).__name__}: {e}"
+        if i >= warmup:
+            durations.append(time.perf_counter() - start)
+    return FlowReport(
+        flow=name,
+        runs=runs,
+        errors=errors,
+        throughput=round(runs / sum(durations), 3) if durations else 0.0,
+        p50=round(percentile(durations, 0.5), 4),
+        p95=round(percentile(durations, 0.95), 4),
+        stages=stage_reports(finished_spans(first_span), latency),
+        first_error=first_error,
+    )
+
+
+def print_report(report: FlowReport) -> None:
+    icon = "✅" if not report.errors else "❌"
+    print(f"\n{icon} {report.flow}: {report.runs} runs, {report.errors} errors, "
+          f"{report.throughput:.2f} runs/s, p50 {report.p50 * 1000:.0f} ms, p95 {report.p95 * 1000:.0f} ms")
+    if report.first_error:
+        print(f"  ⚠️ First error: {report.first_error}")
+    print(f"  {'stage':<18}{'calls':>6}{'llm':>6}{'p50 ms':>10}{'p95 ms':>10}{'overhead ms':>13}")
+    for stage, s in sorted(report.stages.items(), key=lambda item: -item[1].overhead_ms):
+        print(f"  {stage:<18}{s.calls:>6}{s.llm_calls:>6}{s.p50_ms:>10.1f}{s.p95_ms:>10.1f}{s.overhead_ms:>13.1f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the pipelines against a local fake LLM.")
+    parser.add_argument("--flows", nargs="+", choices=sorted(FLOWS), default=list(FLOWS), help="flows to run")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="measured runs per flow")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="unmeasured runs per flow")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds per fake LLM call")
+    parser.add_argument("--scenario", choices=("pass", "repair"), default="repair",
+                        help="whether the first generated code passes or needs one repair")
+    parser.add_argument("--json", dest="json_path", help="also write the reports to this JSON file")
+    args = parser.parse_args()
+
+    install_fakes(args.latency, args.scenario)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    cwd = os.getcwd()
+    reports = []
+    # Flows publish their results and persist indexes relative to the working
+    # directory: keep all of that out of the repository.
+    with tempfile.TemporaryDirectory(prefix="bench-") as scratch:
+        os.chdir(scratch)
+        try:
+            print(f"🏎️ Benchmarking {', '.join(args.flows)} "
+                  f"({args.runs} runs, {args.latency * 1000:.0f} ms per LLM call)")
+            for name in args.flows:
+                report = run_flow(name, args.runs, args.warmup, args.latency)
+                print_report(report)
+                reports.append(report)
+        finally:
+            os.chdir(cwd)
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(report) for report in reports], f, indent=2)
+        print(f"\n📄 Reports written to {json_path}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,231 @@
+import ast
+import builtins
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from embedding_cache import CacheStats
+from utils import content_hash
+
+# Number of code versions kept (a task rarely goes through more than a few repairs)
+MAX_CACHED_ANALYSES = 256
+
+_BUILTIN_NAMES = set(dir(builtins)) | {"__file__", "__name__", "__doc__", "__spec__", "__builtins__"}
+
+
+@dataclass(frozen=True)
+class CodeAnalysis:
+    """Facts about one version of a generated module, computed in a single pass.
+
+    `tree` is shared between all users of the analysis: treat it as read-only.
+    """
+
+    code_hash: str
+    tree: ast.Module | None
+    syntax_error: SyntaxError | None = None
+    functions: tuple[str, ...] = ()
+    classes: tuple[str, ...] = ()
+    raised_exceptions: tuple[str, ...] = ()
+    imports: tuple[str, ...] = ()
+    signatures: dict[str, str] = field(default_factory=dict)
+    top_level_names: frozenset[str] = frozenset()  # everything `from module import ...` can fetch
+    star_exports: frozenset[str] = frozenset()  # what `from module import *` binds
+    undefined_names: tuple[str, ...] = ()
+    star_import: bool = False  # undefined names cannot be trusted when set
+
+    @property
+    def valid(self) -> bool:
+        return self.tree is not None
+
+    @property
+    def definitions(self) -> dict[str, ast.stmt]:
+        """Top-level functions and classes by name."""
+        if self.tree is None:
+            return {}
+        return {
+            node.name: node for node in self.tree.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+        }
+
+
+# PEP 695 type parameters (`def f[T](x: T)`), Python 3.12+
+_TYPE_PARAMS = tuple(getattr(ast, name) for name in ("TypeVar", "ParamSpec", "TypeVarTuple") if hasattr(ast, name))
+
+
+def _lazy_annotations(tree: ast.AST) -> bool:
+    """Whether the module has `from __future__ import annotations` (annotations are never evaluated)."""
+    return any(
+        isinstance(node, ast.ImportFrom) and node.module == "__future__"
+        and any(alias.name == "annotations" for alias in node.names)
+        for node in getattr(tree, "body", ())
+    )
+
+
+def _annotation_of(node: ast.AST) -> ast.expr | None:
+    if isinstance(node, (ast.arg, ast.AnnAssign)):
+        return node.annotation
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return node.returns
+    return None
+
+
+def free_names(tree: ast.AST) -> set[str]:
+    """Names read somewhere in `tree` but never bound anywhere in it (nor builtins).
+
+    Scopes are deliberately ignored: a name bound anywhere counts as
+    defined, so this only reports names that cannot possibly resolve.
+    Annotations are skipped under `from __future__ import annotations`.
+    """
+    lazy = _lazy_annotations(tree)
+    bound: set[str] = set()
+    loaded: set[str] = set()
+    pending: list[ast.AST] = [tree]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.alias):
+            bound.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bound.add(node.rest)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+        elif isinstance(node, _TYPE_PARAMS):
+            bound.add(node.name)
+        elif isinstance(node, ast.Name):
+            (loaded if isinstance(node.ctx, ast.Load) else bound).add(node.id)
+        annotation = _annotation_of(node) if lazy else None
+        pending.extend(child for child in ast.iter_child_nodes(node) if child is not annotation)
+    return loaded - bound - _BUILTIN_NAMES
+
+
+def _module_bindings(tree: ast.Module) -> set[str]:
+    """Names bound at module scope, including inside top-level if/try/with/for blocks."""
+    names: set[str] = set()
+    pending: list[ast.AST] = list(tree.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            continue  # their bodies are a different scope
+        if isinstance(node, (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            continue
+        if isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        pending.extend(ast.iter_child_nodes(node))
+    return names - {"*"}
+
+
+def _declared_all(tree: ast.Module) -> set[str] | None:
+    """Names listed in a literal module-level `__all__`, or None without one."""
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Assign)
+            and any(isinstance(t, ast.Name) and t.id == "__all__" for t in node.targets)
+            and isinstance(node.value, (ast.List, ast.Tuple))
+        ):
+            return {
+                elt.value for elt in node.value.elts
+                if isinstance(elt, ast.Constant) and isinstance(elt.value, str)
+            }
+    return None
+
+
+def _exception_name(exc: ast.expr) -> str | None:
+    if isinstance(exc, ast.Call):
+        # raise TypeError("msg")
+        exc = exc.func
+    if isinstance(exc, ast.Name):
+        return exc.id
+    if isinstance(exc, ast.Attribute):
+        return exc.attr
+    return None
+
+
+def _signature(node: ast.FunctionDef | ast.AsyncFunctionDef) -> str:
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return f"({ast.unparse(node.args)}){returns}"
+
+
+def _analyze(code: str, code_hash: str) -> CodeAnalysis:
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return CodeAnalysis(code_hash, None, syntax_error=e)
+
+    functions: list[str] = []
+    classes: list[str] = []
+    signatures: dict[str, str] = {}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            functions.append(node.name)
+            signatures[node.name] = _signature(node)
+        elif isinstance(node, ast.ClassDef):
+            classes.append(node.name)
+
+    raised: set[str] = set()
+    imports: list[str] = []
+    star_import = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Raise) and node.exc is not None:
+            name = _exception_name(node.exc)
+            if name:
+                raised.add(name)
+        elif isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = "." * node.level + (node.module or "")
+            imports.extend(f"{module}.{alias.name}" for alias in node.names)
+            star_import |= any(alias.name == "*" for alias in node.names)
+
+    top_level = _module_bindings(tree)
+    star_exports = _declared_all(tree)
+    if star_exports is None:
+        star_exports = {name for name in top_level if not name.startswith("_")}
+    return CodeAnalysis(
+        code_hash,
+        tree,
+        functions=tuple(functions),
+        classes=tuple(classes),
+        raised_exceptions=tuple(sorted(raised)),
+        imports=tuple(dict.fromkeys(imports)),
+        signatures=signatures,
+        top_level_names=frozenset(top_level),
+        star_exports=frozenset(star_exports),
+        undefined_names=tuple(sorted(free_names(tree))),
+        star_import=star_import,
+    )
+
+
+_cache: OrderedDict[str, CodeAnalysis] = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = CacheStats()
+
+
+def analyze(code: str) -> CodeAnalysis:
+    """Return the (memoized) analysis of `code`, keyed by its content hash."""
+    key = content_hash(code)
+    with _cache_lock:
+        analysis = _cache.get(key)
+        if analysis is not None:
+            _cache.move_to_end(key)
+            _stats.hits += 1
+            return analysis
+        _stats.misses += 1
+    analysis = _analyze(code, key)
+    with _cache_lock:
+        _cache[key] = analysis
+        while len(_cache) > MAX_CACHED_ANALYSES:
+            _cache.popitem(last=False)
+    return analysis
+
+
+def analysis_cache_stats() -> CacheStats:
+    """Hit/miss counters of the analysis cache."""
+    return _stats
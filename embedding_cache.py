@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from tracing import record_cache_hit
+from utils import content_hash
+
+# On-disk cache shared by all processes (set to "" to keep the cache in memory only)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+DEFAULT_MAX_ENTRIES = 1024
+
+
+@dataclass
+class CacheStats:
+    """Hit/miss counters for a cache."""
+
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / total if total else 0.0
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an embedding model with an LRU + SQLite cache for query embeddings.
+
+    Keys are derived from the model name and the query text, so switching
+    models never returns stale vectors. Document embeddings are delegated
+    untouched: the style corpus is already persisted with its index.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        db_path: str | None = EMBEDDING_CACHE_PATH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._memory: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        if db_path:
+            dirpath = os.path.dirname(db_path)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key: str) -> List[float] | None:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats.hits += 1
+                return self._memory[key]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    vector = array("d", row[0]).tolist()
+                    self._remember(key, vector)
+                    self.stats.disk_hits += 1
+                    return vector
+            self.stats.misses += 1
+            return None
+
+    def _store(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._remember(key, vector)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                    (key, array("d", vector).tobytes()),
+                )
+                self._conn.commit()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Return the cached query embedding, computing it only on a miss."""
+        key = content_hash(self.model_name, text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._store(key, vector)
+        else:
+            record_cache_hit()
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Async variant of embed_query."""
+        key = content_hash(self.model_name, text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            self._store(key, vector)
+        else:
+            record_cache_hit()
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents with the underlying model (not cached)."""
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of embed_documents (not cached)."""
+        return await self.underlying.aembed_documents(texts)
@@ -0,0 +1,215 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.prompts import PromptTemplate
+from langchain_openai import ChatOpenAI
+
+from llm_cache import invoke_chain, set_response_cache
+from scheduler import STAGE_PRIORITY, RateLimit, RequestScheduler, set_scheduler
+from tracing import span
+
+# ---------- Constants ----------
+DEFAULT_REPLY = "```python\ndef add(a, b):\n    return a + b\n```"
+FAKE_MODEL = "fake-model"
+
+
+class FakeOpenAIServer:
+    """Local OpenAI-compatible chat completions endpoint that answers 429 like a busy API.
+
+    Requests over `rpm` per `window` seconds are rejected, and so is a random
+    `error_rate` share of the others, with a Retry-After header of
+    `retry_after` seconds. Use as a context manager; point clients at `base_url`.
+    """
+
+    def __init__(
+        self,
+        reply: str = DEFAULT_REPLY,
+        latency: float = 0.0,
+        rpm: int = 0,
+        error_rate: float = 0.0,
+        retry_after: float = 0.2,
+        seed: int | None = None,
+        window: float = 60.0,
+    ) -> None:
+        self.reply = reply
+        self.latency = latency
+        self.rpm = rpm  # 0 = no per-minute limit
+        self.window = window
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._accepted: deque[float] = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def admit(self) -> bool:
+        """Count a request; False when it must be answered with a 429."""
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            while self._accepted and self._accepted[0] <= now - self.window:
+                self._accepted.popleft()
+            if (self.rpm and len(self._accepted) >= self.rpm) or self._random.random() < self.error_rate:
+                self.rate_limited += 1
+                return False
+            self._accepted.append(now)
+            return True
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args) -> None:  # keep the demo output readable
+                pass
+
+            def _send_json(self, status: int, body: dict, headers: dict[str, str] | None = None) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                if not server.admit():
+                    self._send_json(
+                        429,
+                        {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                        {"Retry-After": str(server.retry_after)},
+                    )
+                    return
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.latency)
+                    if request.get("stream"):
+                        self._stream(request)
+                    else:
+                        self._send_json(200, server.completion(request))
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _stream(self, request: dict) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                completion = server.completion(request)
+                for delta, finish_reason in (({"role": "assistant", "content": server.reply}, None), ({}, "stop")):
+                    chunk = {
+                        "id": completion["id"],
+                        "object": "chat.completion.chunk",
+                        "created": completion["created"],
+                        "model": completion["model"],
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+    def completion(self, request: dict) -> dict:
+        """A chat.completion answering `request` with the canned reply."""
+        prompt = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(self.reply) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", FAKE_MODEL),
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": self.reply}, "finish_reason": "stop"}
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+
+# ---------- Demo ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the request scheduler against a local server returning 429s.")
+    parser.add_argument("--requests", type=int, default=40, help="LLM requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="threads sending requests")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="share of requests answered with a 429")
+    parser.add_argument("--server-rpm", type=int, default=0, help="requests per minute the server accepts (0 = any)")
+    parser.add_argument("--rpm", type=int, default=500, help="requests per minute the scheduler allows")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the server takes per answer")
+    args = parser.parse_args()
+
+    set_response_cache(None)  # every request must reach the server
+    scheduler = RequestScheduler({FAKE_MODEL: RateLimit(rpm=args.rpm)})
+    set_scheduler(scheduler)
+    prompt = PromptTemplate.from_template("Write a Python function: {task}")
+    stages = list(STAGE_PRIORITY)
+
+    with FakeOpenAIServer(latency=args.latency, rpm=args.server_rpm, error_rate=args.error_rate, seed=0) as server:
+        llm = ChatOpenAI(model=FAKE_MODEL, base_url=server.base_url, api_key="fake", max_retries=0, timeout=10)
+        finished: list[str] = []
+
+        def send(i: int) -> None:
+            stage = stages[i % len(stages)]
+            with span(stage):
+                invoke_chain(prompt, llm, {"task": f"add two numbers (request {i})"})
+            finished.append(stage)
+
+        print(f"🚦 Sending {args.requests} requests ({args.concurrency} at a time, "
+              f"{args.error_rate:.0%} answered 429)...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            errors = [f.exception() for f in [pool.submit(send, i) for i in range(args.requests)]]
+        failed = [e for e in errors if e is not None]
+
+    print(f"\n✅ {args.requests - len(failed)}/{args.requests} requests succeeded "
+          f"in {time.perf_counter() - start:.1f}s")
+    for e in failed[:3]:
+        print(f"  ❌ {type(e).__name__}: {e}")
+    print(f"🖥️ Server: {server.requests} requests, {server.rate_limited} answered 429, "
+          f"max {server.max_in_flight} in flight")
+    print(f"🚦 Scheduler: {scheduler.format_stats()}")
+    positions: dict[int, list[int]] = {}
+    for position, stage in enumerate(finished):
+        positions.setdefault(STAGE_PRIORITY[stage], []).append(position)
+    print("🥇 Mean completion position per priority (0 = repairs first): " + ", ".join(
+        f"{priority}: {sum(p) / len(p):.1f}" for priority, p in sorted(positions.items())
+    ))
+
+
+if __name__ == "__main__":
+    main()
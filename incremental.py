@@ -0,0 +1,153 @@
+import ast
+from collections.abc import Sequence
+
+from code_analysis import analyze
+from preflight import run_checked
+from prompt_budget import failing_test_names
+from pytest_service import DEFAULT_ARGS, DEFAULT_TIMEOUT, RunResult
+
+
+def _referenced_names(nodes: Sequence[ast.AST]) -> set[str]:
+    """Names and attribute names read anywhere in `nodes` (covers `f()` and `mod.f()`)."""
+    names: set[str] = set()
+    for node in nodes:
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                names.add(child.id)
+            elif isinstance(child, ast.Attribute):
+                names.add(child.attr)
+    return names
+
+
+def _is_definition(node: ast.stmt) -> bool:
+    return isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+
+
+def _definitions(tree: ast.Module) -> dict[str, ast.stmt]:
+    return {node.name: node for node in tree.body if _is_definition(node)}
+
+
+# ---------- Test -> function map ----------
+
+def map_tests_to_functions(tests: str, code: str) -> dict[str, set[str]]:
+    """Map each test ("test_x" or "TestY::test_x") to the module functions/classes it exercises.
+
+    Helpers and fixtures defined in the test file are followed transitively.
+    Returns {} when either source does not parse.
+    """
+    analysis = analyze(code)
+    try:
+        test_tree = ast.parse(tests)
+    except SyntaxError:
+        return {}
+    if not analysis.valid:
+        return {}
+    exported = set(analysis.functions) | set(analysis.classes)
+    local = _definitions(test_tree)
+
+    def closure(nodes: list[ast.AST]) -> set[str]:
+        seen: set[str] = set()
+        pending = list(nodes)
+        while pending:
+            node = pending.pop()
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                args = {a.arg for a in node.args.args}  # fixtures
+            else:
+                args = set()
+            for name in _referenced_names([node]) | args:
+                if name in local and name not in seen and not name.startswith("test"):
+                    seen.add(name)
+                    pending.append(local[name])
+                seen.add(name)
+        return seen & exported
+
+    deps: dict[str, set[str]] = {}
+    for node in test_tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test"):
+            deps[node.name] = closure([node])
+        elif isinstance(node, ast.ClassDef) and node.name.startswith("Test"):
+            # Setup methods and class attributes apply to every test in the class
+            shared = [n for n in node.body if not getattr(n, "name", "").startswith("test")]
+            for method in node.body:
+                if isinstance(method, (ast.FunctionDef, ast.AsyncFunctionDef)) and method.name.startswith("test"):
+                    deps[f"{node.name}::{method.name}"] = closure([method, *shared])
+    return deps
+
+
+# ---------- Change detection ----------
+
+def changed_definitions(old_code: str, new_code: str) -> set[str] | None:
+    """Top-level functions/classes whose source changed, plus those that call them.
+
+    Returns None when anything outside a definition (imports, constants)
+    changed or either side does not parse: every test may be affected.
+    """
+    old, new = analyze(old_code), analyze(new_code)
+    if not (old.valid and new.valid):
+        return None
+
+    def module_level(tree: ast.Module) -> list[str]:
+        return [ast.dump(node) for node in tree.body if not _is_definition(node)]
+
+    if module_level(old.tree) != module_level(new.tree):
+        return None
+
+    old_defs = {name: ast.dump(node) for name, node in old.definitions.items()}
+    new_defs = new.definitions
+    changed = {name for name, node in new_defs.items() if old_defs.get(name) != ast.dump(node)}
+    changed |= old_defs.keys() - new_defs.keys()
+
+    # A function is affected when anything it (transitively) uses changed.
+    uses = {name: _referenced_names([node]) for name, node in new_defs.items()}
+    affected = set(changed)
+    grew = True
+    while grew:
+        grew = False
+        for name, names in uses.items():
+            if name not in affected and names & affected:
+                affected.add(name)
+                grew = True
+    return affected
+
+
+def select_tests(tests: str, old_code: str, new_code: str, failing: set[str]) -> list[str] | None:
+    """Tests to rerun first after a repair: the failing ones and those touching changed code.
+
+    Returns None when a full run is needed anyway (nothing could be narrowed down).
+    """
+    deps = map_tests_to_functions(tests, new_code)
+    changed = changed_definitions(old_code, new_code)
+    if not deps or changed is None or not failing:
+        return None
+    selected = [
+        test for test, used in deps.items()
+        if test.rsplit("::", 1)[-1] in failing or used & changed
+    ]
+    if not selected or len(selected) == len(deps):
+        return None
+    return selected
+
+
+# ---------- Runner ----------
+
+def rerun_after_repair(
+    test_file: str,
+    cwd: str | None,
+    tests: str,
+    old_code: str,
+    new_code: str,
+    errors: str,
+    args=DEFAULT_ARGS,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> RunResult:
+    """Rerun the previously failing and affected tests first; the full file only once they pass.
+
+    `errors` is the failure report of the run before the repair.
+    """
+    selected = select_tests(tests, old_code, new_code, failing_test_names(errors))
+    if selected:
+        print(f"⚡ Rerunning {len(selected)} affected test(s) first...")
+        result = run_checked(test_file, cwd, args, timeout, select=selected)
+        if not result.success:
+            return result
+    return run_checked(test_file, cwd, args, timeout)
@@ -0,0 +1,233 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Protocol
+
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import BasePromptTemplate
+
+from embedding_cache import CacheStats
+from scheduler import asubmit, submit
+from tracing import record_cache_hit, trace_config
+from utils import content_hash
+
+# Cache backend: "sqlite" (memory LRU in front of SQLite), "memory" or "off"
+LLM_CACHE = os.getenv("LLM_CACHE", "sqlite")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+# Models cached although they sample (comma-separated, e.g. "gpt-5-mini"; gpt-5 models ignore temperature)
+LLM_CACHE_MODELS = {m.strip() for m in os.getenv("LLM_CACHE_MODELS", "").split(",") if m.strip()}
+
+
+class ResponseCache(Protocol):
+    """Minimal interface of a response cache backend."""
+
+    stats: CacheStats
+
+    def get(self, key: str) -> str | None: ...
+
+    def set(self, key: str, value: str) -> None: ...
+
+
+class LRUResponseCache:
+    """In-memory least-recently-used cache."""
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResponseCache:
+    """On-disk cache with a time-to-live and a maximum number of entries."""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl_seconds: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        dirpath = os.path.dirname(path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.stats.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats.disk_hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones above the size limit."""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+class TieredResponseCache:
+    """Memory LRU in front of a slower (persistent) backend."""
+
+    def __init__(self, memory: LRUResponseCache, disk: ResponseCache) -> None:
+        self.memory = memory
+        self.disk = disk
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> str | None:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            return value
+        value = self.disk.get(key)
+        if value is not None:
+            self.memory.set(key, value)
+            self.stats.disk_hits += 1
+            return value
+        self.stats.misses += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+
+def _default_cache() -> ResponseCache | None:
+    if LLM_CACHE == "off":
+        return None
+    if LLM_CACHE == "memory":
+        return LRUResponseCache()
+    return TieredResponseCache(LRUResponseCache(), SQLiteResponseCache())
+
+
+_cache: ResponseCache | None = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache | None:
+    """Return the process-wide response cache (None when caching is disabled)."""
+    global _cache, _cache_configured
+    if not _cache_configured:
+        with _cache_lock:
+            if not _cache_configured:
+                _cache = _default_cache()
+                _cache_configured = True
+    return _cache
+
+
+def set_response_cache(cache: ResponseCache | None) -> None:
+    """Install a different cache backend (or None to disable caching)."""
+    global _cache, _cache_configured
+    with _cache_lock:
+        _cache = cache
+        _cache_configured = True
+
+
+def model_identity(llm: Any) -> str:
+    """Describe the model settings that influence its output."""
+    name = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+    return f"{name}|temperature={getattr(llm, 'temperature', None)}"
+
+
+def is_deterministic(llm: Any) -> bool:
+    """Only models with an explicit temperature of 0 (or opted in via LLM_CACHE_MODELS) are safe to cache.
+
+    An unset temperature means the provider's default sampling, not greedy decoding.
+    """
+    if getattr(llm, "temperature", None) == 0:
+        return True
+    name = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    return name in LLM_CACHE_MODELS
+
+
+def prompt_key(llm: Any, prompt_text: str) -> str:
+    """Content address of a (model, rendered prompt) pair."""
+    return content_hash(model_identity(llm), prompt_text)
+
+
+def invoke_chain(prompt: BasePromptTemplate, llm: BaseLanguageModel, inputs: dict[str, Any]) -> str:
+    """Run `prompt | llm | StrOutputParser()` through the scheduler, serving repeated prompts from the cache."""
+    cache = get_response_cache() if is_deterministic(llm) else None
+    prompt_text = prompt.format(**inputs)
+    key = prompt_key(llm, prompt_text)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        record_cache_hit()
+        return cached
+    chain = prompt | llm | StrOutputParser()
+    output = submit(llm, prompt_text, lambda: chain.invoke(inputs, config=trace_config()))
+    if cache is not None:
+        cache.set(key, output)
+    return output
+
+
+async def ainvoke_chain(prompt: BasePromptTemplate, llm: BaseLanguageModel, inputs: dict[str, Any]) -> str:
+    """Async variant of invoke_chain built on `ainvoke`."""
+    cache = get_response_cache() if is_deterministic(llm) else None
+    prompt_text = prompt.format(**inputs)
+    key = prompt_key(llm, prompt_text)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        record_cache_hit()
+        return cached
+    chain = prompt | llm | StrOutputParser()
+    output = await asubmit(llm, prompt_text, lambda: chain.ainvoke(inputs, config=trace_config()))
+    if cache is not None:
+        cache.set(key, output)
+    return output
@@ -0,0 +1,76 @@
+import os
+import threading
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from scheduler import LLM_SCHEDULER
+
+# Keep-alive pool shared by every chat client in the process (all hit the same API host)
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
+# Seconds before an LLM request times out
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+_http_client: httpx.Client | None = None
+_models: dict[tuple[str, float], ChatOpenAI] = {}
+_lock = threading.Lock()
+
+
+def shared_http_client() -> httpx.Client:
+    """Return the process-wide HTTP client with connection pooling."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+            )
+        return _http_client
+
+
+def get_chat_model(model: str, temperature: float = 0) -> ChatOpenAI:
+    """Return a cached ChatOpenAI client for (model, temperature).
+
+    Clients are created once per process and reused across calls and tasks,
+    so TLS handshakes and connection set-up are paid only once. The async
+    side of each client keeps its own pool, reused as long as the client is.
+    """
+    key = (model, float(temperature))
+    llm = _models.get(key)
+    if llm is None:
+        http_client = shared_http_client()
+        with _lock:
+            llm = _models.get(key)
+            if llm is None:
+                llm = ChatOpenAI(
+                    model=model,
+                    temperature=temperature,
+                    http_client=http_client,
+                    timeout=LLM_TIMEOUT,
+                    # The scheduler retries itself, so that a 429 also holds back the other requests
+                    max_retries=0 if LLM_SCHEDULER else 2,
+                )
+                _models[key] = llm
+    return llm
+
+
+def register_chat_model(model: str, llm: ChatOpenAI, temperature: float = 0) -> None:
+    """Serve `llm` for (model, temperature) from now on (e.g. a fake model in benchmarks)."""
+    with _lock:
+        _models[(model, float(temperature))] = llm
+
+
+def close_clients() -> None:
+    """Close pooled connections and forget cached clients (e.g. at shutdown)."""
+    global _http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+        _models.clear()
@@ -1,12 +1,18 @@
 import os
 import re
-import ast
+import asyncio
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.documents import Document
 
-from style_knowledge_base import add_documents, retrieve_style
+from code_analysis import analyze
+from llm_cache import ainvoke_chain, invoke_chain
+from llm_registry import get_chat_model
+from prompt_prefix import prefixed_prompt
+from solution_cache import Solution, closest_example
+from style_knowledge_base import add_documents, aretrieve_style, retrieve_style
+from tracing import traced
 
 # Load environment variables from .env
 load_dotenv()
@@ -22,135 +28,158 @@ def clean_code(text: str) -> str:
 
 def validate_code(code: str) -> bool:
     """Check if the generated code is syntactically valid Python."""
-    try:
-        ast.parse(code)
-        return True
-    except SyntaxError as e:
-        print(f"❌ Syntax error in generated code: {e}")
-        return False
+    analysis = analyze(code)
+    if analysis.syntax_error is not None:
+        print(f"❌ Syntax error in generated code: {analysis.syntax_error}")
+    return analysis.valid
 
 
 def list_exported_functions(code: str) -> list[str]:
     """Return names of top-level functions defined in the code."""
-    try:
-        tree = ast.parse(code)
-    except SyntaxError:
-        return []
-    funcs: list[str] = []
-    for node in tree.body:
-        if isinstance(node, ast.FunctionDef):
-            funcs.append(node.name)
-    return funcs
+    return list(analyze(code).functions)
 
 
 def list_raised_exceptions(code: str) -> list[str]:
     """Return a sorted list of exception type names that the code explicitly raises."""
-    try:
-        tree = ast.parse(code)
-    except SyntaxError:
-        return []
-    exceptions: set[str] = set()
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Raise) and node.exc is not None:
-            name = None
-            exc = node.exc
-            if isinstance(exc, ast.Call):
-                # raise TypeError("msg")
-                func = exc.func
-                if isinstance(func, ast.Name):
-                    name = func.id
-                elif isinstance(func, ast.Attribute):
-                    name = func.attr
-            elif isinstance(exc, ast.Name):
-                # raise TypeError
-                name = exc.id
-            if name:
-                exceptions.add(name)
-    return sorted(exceptions)
+    return list(analyze(code).raised_exceptions)
 
 
-def generate_code(task: str, llm: ChatOpenAI) -> str:
-    """Generate Python code from task description with style context."""
-    # Ensure style docs are loaded
-    add_documents()
-    style_guidelines = retrieve_style(task)
-    style_text = "\n".join([doc.page_content for doc in style_guidelines])
+# Fixed instructions first, so every code request shares this prefix.
+# It is still below CACHEABLE_PREFIX_TOKENS: format_prefix_report() measures it, nothing is cached yet.
+CODE_INSTRUCTIONS = """
+You are Guido van Rossum, the creator of Python.
+Write clean, enterprise-level Python code that solves the task given by the user.
+Always follow PEP8, typing annotations, and the Zen of Python.
+
+Requirements:
+- Include type hints for all function signatures.
+- Add a clear docstring for each function.
+- Import all required types from the typing module explicitly (e.g., Optional, List, Dict).
+- Do NOT include any example calls, print statements, or main blocks.
+- The output must contain ONLY the Python functions/classes with necessary imports.
+- Follow the additional style guidelines given with the task.
+- When a solution to a similar task is given, adapt it rather than starting over.
+
+Return ONLY the Python code in a markdown block.
+"""
+
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
 
-    template = f"""
-    You are Guido van Rossum, the creator of Python.
-    Write clean, enterprise-level Python code that solves the following task.
-    Always follow PEP8, typing annotations, and the Zen of Python.
 
-    Additional style guidelines to follow:
-    {style_text}
+def _example_section(example: Solution | None) -> str:
+    """Prompt section showing a passing solution to a similar task (braces escaped for the template)."""
+    if example is None:
+        return ""
+    return f"""
 
-    Requirements:
-    - Include type hints for all function signatures.
-    - Add a clear docstring for each function.
-    - Import all required types from the typing module explicitly (e.g., Optional, List, Dict).
-    - Do NOT include any example calls, print statements, or main blocks.
-    - The output must contain ONLY the Python functions/classes with necessary imports.
+A solution to a similar task ("{_escape(example.task)}") that passed its tests:
+```python
+{_escape(example.code)}
+```"""
 
-    Return ONLY the Python code in a markdown block.
 
-    Task: {{task}}
-    """
-    prompt = PromptTemplate.from_template(template)
-    chain = prompt | llm | StrOutputParser()
-    raw_output = chain.invoke({"task": task})
+def build_code_prompt(style_guidelines: list[Document], example: Solution | None = None) -> ChatPromptTemplate:
+    """Build the code generation prompt: fixed instructions, then style guidelines, example and task."""
+    style_text = "\n".join([doc.page_content for doc in style_guidelines])
+
+    request = f"""
+Additional style guidelines to follow:
+{_escape(style_text)}{_example_section(example)}
+
+Task: {{task}}
+"""
+    return prefixed_prompt(CODE_INSTRUCTIONS, request)
+
+
+@traced("generate_code")
+def generate_code(task: str, llm: ChatOpenAI) -> str:
+    """Generate Python code from task description with style context."""
+    # Ensure style docs are loaded
+    add_documents()
+    prompt = build_code_prompt(retrieve_style(task), closest_example(task))
+    raw_output = invoke_chain(prompt, llm, {"task": task})
     return clean_code(raw_output)
 
 
-def generate_tests(code: str, llm: ChatOpenAI) -> str:
-    """Generate a pytest suite for the given code, forcing correct imports and realistic error tests."""
-    func_names = list_exported_functions(code)
-    exceptions = list_raised_exceptions(code)
+@traced("generate_code")
+async def agenerate_code(task: str, llm: ChatOpenAI) -> str:
+    """Async variant of generate_code (retrieval and LLM call do not block the loop)."""
+    await asyncio.to_thread(add_documents)
+    prompt = build_code_prompt(await aretrieve_style(task), await asyncio.to_thread(closest_example, task))
+    raw_output = await ainvoke_chain(prompt, llm, {"task": task})
+    return clean_code(raw_output)
 
-    func_list_str = ", ".join(func_names) if func_names else "*"
-    exception_list_str = ", ".join(exceptions) if exceptions else "none"
 
-    # We let LLM write ONLY test functions/fixtures (no imports).
-    test_prompt = PromptTemplate.from_template("""
+# We let LLM write ONLY test functions/fixtures (no imports).
+TEST_INSTRUCTIONS = """
 You are an expert Python developer.
-Write a complete pytest test suite for the code below.
+Write a complete pytest test suite for the code given by the user.
 
 Constraints:
 - Do NOT include any import statements (no 'import pytest', no 'from ... import ...').
-- Assume the following functions are already imported and available in the test namespace: {func_list}.
+- Assume the functions the user lists are already imported and available in the test namespace.
 - Cover normal cases and edge cases.
-- Only include error-case tests for these exception types if the code actually raises them: {exception_list}.
-  If 'none', do NOT include any tests expecting exceptions.
+- Only include error-case tests for the exception types the user lists, and only if the code actually raises them.
+  If the list is 'none', do NOT include any tests expecting exceptions.
 - Use plain pytest style (no unittest).
 - Return ONLY valid Python test code (no markdown fences).
+"""
+
+TEST_PROMPT = prefixed_prompt(TEST_INSTRUCTIONS, """
+Functions available in the test namespace: {func_list}
+Exception types the code may raise: {exception_list}
 
 Code under test:
 {code}
 """)
 
-    test_chain = test_prompt | llm | StrOutputParser()
-    raw_tests = test_chain.invoke({
+
+def build_test_request(code: str, module_name: str = "generated_code") -> tuple[dict[str, str], str]:
+    """Return the TEST_PROMPT inputs and the enforced imports header for the code."""
+    func_names = list_exported_functions(code)
+    exceptions = list_raised_exceptions(code)
+
+    func_list_str = ", ".join(func_names) if func_names else "*"
+    exception_list_str = ", ".join(exceptions) if exceptions else "none"
+    inputs = {
         "func_list": func_list_str,
         "exception_list": exception_list_str,
         "code": code,
-    })
-    tests_body = clean_code(raw_tests)
+    }
 
     # We prepend our own, correct imports header.
     header_lines = ["import pytest"]
     if func_names:
-        header_lines.append(f"from generated_code import {func_list_str}")
+        header_lines.append(f"from {module_name} import {func_list_str}")
     else:
-        header_lines.append("from generated_code import *")
+        header_lines.append(f"from {module_name} import *")
     header = "\n".join(header_lines) + "\n\n"
+    return inputs, header
+
+
+@traced("generate_tests")
+def generate_tests(code: str, llm: ChatOpenAI, module_name: str = "generated_code") -> str:
+    """Generate a pytest suite for the given code, forcing correct imports and realistic error tests."""
+    inputs, header = build_test_request(code, module_name)
+    raw_tests = invoke_chain(TEST_PROMPT, llm, inputs)
+    return header + clean_code(raw_tests)
+
 
-    return header + tests_body
+@traced("generate_tests")
+async def agenerate_tests(code: str, llm: ChatOpenAI, module_name: str = "generated_code") -> str:
+    """Async variant of generate_tests."""
+    inputs, header = build_test_request(code, module_name)
+    raw_tests = await ainvoke_chain(TEST_PROMPT, llm, inputs)
+    return header + clean_code(raw_tests)
 
 
 if __name__ == "__main__":
     task = input("Enter task description: ")
 
     # Initialize LLM
-    llm = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm = get_chat_model("gpt-5-mini")
 
     # Generate code
     code = generate_code(task, llm)
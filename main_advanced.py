@@ -1,20 +1,26 @@
 import os
 import re
-import ast
-import subprocess
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
+from code_analysis import analyze
+from incremental import rerun_after_repair
+from llm_cache import invoke_chain
+from llm_registry import get_chat_model
+from prompt_budget import build_repair_inputs, merge_code
+from prompt_prefix import prefixed_prompt
 from style_knowledge_base_advanced import add_documents, retrieve_style
+from tracing import traced
+from workspace import Workspace, create_workspace
 
 # Load environment variables
 load_dotenv()
 
-CODE_FILENAME = "generated_code_agent_advanced.py"
+MODULE_NAME = "generated_code_agent_advanced"
+CODE_FILENAME = f"{MODULE_NAME}.py"
 TESTS_DIR = "tests"
-TEST_FILENAME = os.path.join(TESTS_DIR, "test_generated_code_agent_advanced.py")
+TEST_FILENAME = os.path.join(TESTS_DIR, f"test_{MODULE_NAME}.py")
 
 
 def clean_code(text: str) -> str:
@@ -27,56 +33,55 @@ def clean_code(text: str) -> str:
 
 def validate_code(code: str) -> bool:
     """Check if generated code is valid Python."""
-    try:
-        ast.parse(code)
-        return True
-    except SyntaxError as e:
-        print(f"❌ Syntax error in generated code: {e}")
-        return False
+    analysis = analyze(code)
+    if analysis.syntax_error is not None:
+        print(f"❌ Syntax error in generated code: {analysis.syntax_error}")
+    return analysis.valid
 
 
-def run_pytest() -> tuple[bool, str]:
-    """Run pytest ONLY on our generated test file."""
-    result = subprocess.run(
-        ["pytest", "-q", "--tb=short", TEST_FILENAME],
-        capture_output=True,
-        text=True
-    )
-    success = result.returncode == 0
-    return success, result.stdout + result.stderr
+def run_pytest(workspace: Workspace) -> tuple[bool, str]:
+    """Run pytest ONLY on the workspace's test file; report only failing tests."""
+    result = workspace.run_tests()
+    return result.success, result.failure_report()
 
 
+# Fixed instructions come first in every prompt, so requests share a prefix.
+# It is still below CACHEABLE_PREFIX_TOKENS: format_prefix_report() measures it, nothing is cached yet.
+CODE_INSTRUCTIONS = """
+You are Guido van Rossum, the creator of Python.
+Write clean, enterprise-level Python code that solves the task given by the user.
+Always follow PEP8, typing annotations, and the Zen of Python.
+
+Requirements:
+- Include type hints for all function signatures.
+- Add a clear docstring for each function.
+- Import required types from typing explicitly (List, Dict, Optional, etc.).
+- Do NOT include any example calls, print statements, or main blocks.
+- The output must contain ONLY Python code.
+- Follow the additional style guidelines given with the task.
+
+Return ONLY the Python code in a markdown block.
+"""
+
+
+@traced("generate_code")
 def generate_code(task: str, llm: ChatOpenAI) -> str:
     """Generate Python code using RAG style guidelines."""
     add_documents()
     style_guidelines = retrieve_style(task)
     style_text = "\n".join([doc.page_content for doc in style_guidelines])
 
-    template = f"""
-    You are Guido van Rossum, the creator of Python.
-    Write clean, enterprise-level Python code that solves the following task.
-    Always follow PEP8, typing annotations, and the Zen of Python.
+    prompt = prefixed_prompt(CODE_INSTRUCTIONS, """
+Additional style guidelines to follow:
+{style_text}
 
-    Additional style guidelines to follow:
-    {style_text}
-
-    Requirements:
-    - Include type hints for all function signatures.
-    - Add a clear docstring for each function.
-    - Import required types from typing explicitly (List, Dict, Optional, etc.).
-    - Do NOT include any example calls, print statements, or main blocks.
-    - The output must contain ONLY Python code.
-
-    Return ONLY the Python code in a markdown block.
-
-    Task: {{task}}
-    """
-    prompt = PromptTemplate.from_template(template)
-    chain = prompt | llm | StrOutputParser()
-    raw_output = chain.invoke({"task": task})
+Task: {task}
+""")
+    raw_output = invoke_chain(prompt, llm, {"style_text": style_text, "task": task})
     return clean_code(raw_output)
 
 
+@traced("generate_tests")
 def generate_tests(code: str, llm: ChatOpenAI) -> str:
     """Generate pytest test suite for the given code, with fixed import header."""
     test_prompt = PromptTemplate.from_template("""
@@ -92,8 +97,7 @@ def generate_tests(code: str, llm: ChatOpenAI) -> str:
     {code}
     """)
 
-    test_chain = test_prompt | llm | StrOutputParser()
-    raw_tests = test_chain.invoke({"code": code})
+    raw_tests = invoke_chain(test_prompt, llm, {"code": code})
     tests_body = clean_code(raw_tests)
 
     # Always prepend our correct imports
@@ -101,39 +105,41 @@ def generate_tests(code: str, llm: ChatOpenAI) -> str:
     return header + tests_body
 
 
-def repair_code(code: str, tests: str, errors: str, llm: ChatOpenAI) -> str:
-    """Repair broken code based on failing pytest output."""
-    repair_prompt = PromptTemplate.from_template("""
-    You are an expert Python developer.
-    The following code failed pytest tests.
+REPAIR_PROMPT = prefixed_prompt("""
+You are an expert Python developer.
+The user sends code that failed pytest tests, the tests, and the pytest output.
 
-    Code:
-    {code}
+Task:
+- Fix ONLY the code so that all tests pass.
+- Do not modify the tests.
+- Return ONLY the corrected Python code in a markdown block.
+""", """
+Code:
+{code}
 
-    Tests:
-    {tests}
+Tests:
+{tests}
 
-    Pytest output (errors and failures):
-    {errors}
+Pytest output (errors and failures):
+{errors}
+""")
 
-    Task:
-    - Fix ONLY the code so that all tests pass.
-    - Do not modify the tests.
-    - Return ONLY the corrected Python code in a markdown block.
-    """)
 
-    repair_chain = repair_prompt | llm | StrOutputParser()
-    raw_fixed = repair_chain.invoke({"code": code, "tests": tests, "errors": errors})
-    return clean_code(raw_fixed)
+@traced("repair_code")
+def repair_code(code: str, tests: str, errors: str, llm: ChatOpenAI) -> str:
+    """Repair broken code based on failing pytest output."""
+    inputs, stats = build_repair_inputs(code, tests, errors, model=llm.model_name)
+    fixed = clean_code(invoke_chain(REPAIR_PROMPT, llm, inputs))
+    return merge_code(code, fixed) if stats.code_partial else fixed
 
 
 if __name__ == "__main__":
     task = input("Enter task description: ")
 
     # Use separate models for different steps
-    llm_code = ChatOpenAI(model="gpt-5-mini", temperature=0)
-    llm_tests = ChatOpenAI(model="gpt-4o-mini", temperature=0)  # can swap to gpt-5-mini if you want
-    llm_repair = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    llm_code = get_chat_model("gpt-5-mini")
+    llm_tests = get_chat_model("gpt-4o-mini")  # can swap to gpt-5-mini if you want
+    llm_repair = get_chat_model("gpt-5-mini")
 
     # Step 1: generate code
     code = generate_code(task, llm_code)
@@ -144,45 +150,47 @@ if __name__ == "__main__":
         print("⚠️ Invalid Python code, exiting.")
         exit(1)
 
-    with open(CODE_FILENAME, "w", encoding="utf-8") as f:
-        f.write(code)
-    print(f"✅ Code saved to {CODE_FILENAME}")
-
-    # Step 2: generate tests
-    test_code = generate_tests(code, llm_tests)
-    os.makedirs(TESTS_DIR, exist_ok=True)
-    with open(TEST_FILENAME, "w", encoding="utf-8") as f:
-        f.write(test_code)
-    print(f"✅ Test suite saved to {TEST_FILENAME}")
-
-    # Step 3: run pytest
-    success, output = run_pytest()
-    print("\n=== Pytest Output ===")
-    print(output)
-
-    # Step 4: repair if needed
-    if not success:
-        print("⚠️ Tests failed. Attempting to repair code...")
-
-        fixed_code = repair_code(code, test_code, output, llm_repair)
-        print("\n=== Fixed Code ===\n")
-        print(fixed_code)
-
-        if validate_code(fixed_code):
-            with open(CODE_FILENAME, "w", encoding="utf-8") as f:
-                f.write(fixed_code)
-            print(f"✅ Fixed code saved to {CODE_FILENAME}")
-
-            # Run pytest again
-            success, output = run_pytest()
-            print("\n=== Pytest Output After Repair ===")
-            print(output)
-
-            if success:
-                print("🎉 All tests passed after repair!")
+    # Work in a private workspace so concurrent runs cannot clobber each other
+    with create_workspace(MODULE_NAME) as workspace:
+        workspace.write_code(code)
+        print(f"✅ Code saved to {workspace.path}/{CODE_FILENAME}")
+
+        # Step 2: generate tests
+        test_code = generate_tests(code, llm_tests)
+        workspace.write_tests(test_code)
+        print(f"✅ Test suite saved to {workspace.path}/{TEST_FILENAME}")
+
+        # Step 3: run pytest
+        success, output = run_pytest(workspace)
+        print("\n=== Pytest Output ===")
+        print(output)
+
+        # Step 4: repair if needed
+        if not success:
+            print("⚠️ Tests failed. Attempting to repair code...")
+
+            fixed_code = repair_code(code, test_code, output, llm_repair)
+            print("\n=== Fixed Code ===\n")
+            print(fixed_code)
+
+            if validate_code(fixed_code):
+                workspace.write_code(fixed_code)
+                print(f"✅ Fixed code saved to {workspace.path}/{CODE_FILENAME}")
+
+                # Run pytest again: failing and affected tests first, then the whole file
+                result = rerun_after_repair(workspace.test_file, workspace.path, test_code, code, fixed_code, output)
+                success, output = result.success, result.failure_report()
+                print("\n=== Pytest Output After Repair ===")
+                print(output)
+
+                if success:
+                    print("🎉 All tests passed after repair!")
+                else:
+                    print("❌ Tests still failing, manual fix required.")
             else:
-                print("❌ Tests still failing, manual fix required.")
+                print("❌ Fixed code is not valid Python.")
         else:
-            print("❌ Fixed code is not valid Python.")
-    else:
-        print("🎉 All tests passed on first run!")
+            print("🎉 All tests passed on first run!")
+
+        workspace.publish()
+        print(f"📄 Results copied to {CODE_FILENAME} and {TEST_FILENAME}")
@@ -1,19 +1,23 @@
-import os
 import re
-import ast
-import subprocess
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
+from code_analysis import analyze
+from incremental import rerun_after_repair
+from llm_cache import ainvoke_chain, invoke_chain
+from llm_registry import get_chat_model
+from prompt_budget import build_repair_inputs, merge_code
+from prompt_prefix import prefixed_prompt
 from style_knowledge_base import add_documents, retrieve_style
+from tracing import traced
+from workspace import Workspace, create_workspace
 
 # Load environment variables from .env
 load_dotenv()
 
-CODE_FILENAME = "generated_code_mix.py"
-TEST_FILENAME = "tests/test_generated_code_mix.py"
+MODULE_NAME = "generated_code_mix"
+CODE_FILENAME = f"{MODULE_NAME}.py"
+TEST_FILENAME = f"tests/test_{MODULE_NAME}.py"
 
 
 def clean_code(text: str) -> str:
@@ -26,113 +30,122 @@ def clean_code(text: str) -> str:
 
 def validate_code(code: str) -> bool:
     """Check if the generated code is syntactically valid Python."""
-    try:
-        ast.parse(code)
-        return True
-    except SyntaxError as e:
-        print(f"❌ Syntax error in generated code: {e}")
-        return False
+    analysis = analyze(code)
+    if analysis.syntax_error is not None:
+        print(f"❌ Syntax error in generated code: {analysis.syntax_error}")
+    return analysis.valid
 
 
-def run_pytest() -> tuple[bool, str]:
-    """Run pytest only on the generated test file and return (success, output)."""
-    result = subprocess.run(
-        ["pytest", "-q", "--tb=short", TEST_FILENAME],
-        capture_output=True,
-        text=True
-    )
-    success = result.returncode == 0
-    return success, result.stdout + result.stderr
+def run_pytest(workspace: Workspace) -> tuple[bool, str]:
+    """Run pytest only on the workspace's test file and return (success, failure report)."""
+    result = workspace.run_tests()
+    return result.success, result.failure_report()
 
 
+# Fixed instructions come first in every prompt, so requests share a prefix.
+# It is still below CACHEABLE_PREFIX_TOKENS: format_prefix_report() measures it, nothing is cached yet.
+CODE_INSTRUCTIONS = """
+You are Guido van Rossum, the creator of Python.
+Write clean, enterprise-level Python code that solves the task given by the user.
+Always follow PEP8, typing annotations, and the Zen of Python.
+
+Requirements:
+- Include type hints for all function signatures.
+- Add a clear docstring for each function.
+- Import all required types from the typing module explicitly (e.g., Optional, List, Dict).
+- Do NOT include any example calls, print statements, or main blocks.
+- The output must contain ONLY the Python functions/classes with necessary imports.
+- Follow the additional style guidelines given with the task.
+
+Return ONLY the Python code in a markdown block.
+"""
+
+
+@traced("generate_code")
 def generate_code(task: str, llm_code: ChatOpenAI) -> str:
     """Generate Python code from task description with style context."""
     add_documents()
     style_guidelines = retrieve_style(task)
     style_text = "\n".join([doc.page_content for doc in style_guidelines])
 
-    template = f"""
-    You are Guido van Rossum, the creator of Python.
-    Write clean, enterprise-level Python code that solves the following task.
-    Always follow PEP8, typing annotations, and the Zen of Python.
+    prompt = prefixed_prompt(CODE_INSTRUCTIONS, """
+Additional style guidelines to follow:
+{style_text}
 
-    Additional style guidelines to follow:
-    {style_text}
-
-    Requirements:
-    - Include type hints for all function signatures.
-    - Add a clear docstring for each function.
-    - Import all required types from the typing module explicitly (e.g., Optional, List, Dict).
-    - Do NOT include any example calls, print statements, or main blocks.
-    - The output must contain ONLY the Python functions/classes with necessary imports.
-
-    Return ONLY the Python code in a markdown block.
-
-    Task: {{task}}
-    """
-    prompt = PromptTemplate.from_template(template)
-    chain = prompt | llm_code | StrOutputParser()
-    raw_output = chain.invoke({"task": task})
+Task: {task}
+""")
+    raw_output = invoke_chain(prompt, llm_code, {"style_text": style_text, "task": task})
     return clean_code(raw_output)
 
 
-def generate_tests(code: str, llm_tests: ChatOpenAI) -> str:
-    """Generate pytest suite for the given code (imports fixed)."""
-    test_prompt = PromptTemplate.from_template("""
-    You are an expert Python developer.
-    Write a pytest test suite for the following code.
+TEST_PROMPT = prefixed_prompt("""
+You are an expert Python developer.
+Write a pytest test suite for the code given by the user.
 
-    Constraints:
-    - Do NOT include any import statements.
-    - Only write test functions.
-    - Cover normal cases, edge cases, and (if relevant) error cases.
+Constraints:
+- Do NOT include any import statements.
+- Only write test functions.
+- Cover normal cases, edge cases, and (if relevant) error cases.
+""", """
+Code under test:
+{code}
+""")
 
-    Code under test:
-    {code}
-    """)
 
-    test_chain = test_prompt | llm_tests | StrOutputParser()
-    raw_tests = test_chain.invoke({"code": code})
+@traced("generate_tests")
+def generate_tests(code: str, llm_tests: ChatOpenAI, module_name: str = MODULE_NAME) -> str:
+    """Generate pytest suite for the given code (imports fixed)."""
+    raw_tests = invoke_chain(TEST_PROMPT, llm_tests, {"code": code})
     tests_body = clean_code(raw_tests)
 
     # Force correct header to match generated code file
-    header = f"import pytest\nfrom {CODE_FILENAME.replace('.py', '')} import *\n\n"
+    header = f"import pytest\nfrom {module_name} import *\n\n"
     return header + tests_body
 
 
-def repair_code(code: str, tests: str, errors: str, llm_repair: ChatOpenAI) -> str:
-    """Ask LLM to repair broken code based on failing tests and traceback."""
-    repair_prompt = PromptTemplate.from_template("""
-    You are an expert Python developer.
-    The following code failed some pytest tests.
+REPAIR_PROMPT = prefixed_prompt("""
+You are an expert Python developer.
+The user sends code that failed some pytest tests, the tests, and the pytest output.
+
+Task:
+- Fix the code so that all tests pass.
+- Do not modify the tests.
+- Return ONLY the corrected Python code in a markdown block.
+""", """
+Code:
+{code}
 
-    Code:
-    {code}
+Tests:
+{tests}
 
-    Tests:
-    {tests}
+Pytest output (errors and failures):
+{errors}
+""")
 
-    Pytest output (errors and failures):
-    {errors}
 
-    Task:
-    - Fix the code so that all tests pass.
-    - Do not modify the tests.
-    - Return ONLY the corrected Python code in a markdown block.
-    """)
+@traced("repair_code")
+def repair_code(code: str, tests: str, errors: str, llm_repair: ChatOpenAI) -> str:
+    """Ask LLM to repair broken code based on failing tests and traceback."""
+    inputs, stats = build_repair_inputs(code, tests, errors, model=llm_repair.model_name)
+    fixed = clean_code(invoke_chain(REPAIR_PROMPT, llm_repair, inputs))
+    return merge_code(code, fixed) if stats.code_partial else fixed
 
-    repair_chain = repair_prompt | llm_repair | StrOutputParser()
-    raw_fixed = repair_chain.invoke({"code": code, "tests": tests, "errors": errors})
-    return clean_code(raw_fixed)
+
+@traced("repair_code")
+async def arepair_code(code: str, tests: str, errors: str, llm_repair: ChatOpenAI) -> str:
+    """Async variant of repair_code."""
+    inputs, stats = build_repair_inputs(code, tests, errors, model=llm_repair.model_name)
+    fixed = clean_code(await ainvoke_chain(REPAIR_PROMPT, llm_repair, inputs))
+    return merge_code(code, fixed) if stats.code_partial else fixed
 
 
 if __name__ == "__main__":
     task = input("Enter task description: ")
 
     # Models (dual-mode setup)
-    llm_code = ChatOpenAI(model="gpt-5-mini", temperature=0)   # generate code
-    llm_tests = ChatOpenAI(model="gpt-5-mini", temperature=0)  # generate tests
-    llm_repair = ChatOpenAI(model="gpt-5-mini", temperature=0) # repair code
+    llm_code = get_chat_model("gpt-5-mini")   # generate code
+    llm_tests = get_chat_model("gpt-5-mini")  # generate tests
+    llm_repair = get_chat_model("gpt-5-mini") # repair code
 
     # Step 1: generate code
     code = generate_code(task, llm_code)
@@ -143,45 +156,47 @@ if __name__ == "__main__":
         print("\n⚠️ Invalid Python code, exiting.")
         exit(1)
 
-    with open(CODE_FILENAME, "w", encoding="utf-8") as f:
-        f.write(code)
-    print(f"\n✅ Code saved to {CODE_FILENAME}")
-
-    # Step 2: generate tests
-    test_code = generate_tests(code, llm_tests)
-    os.makedirs("tests", exist_ok=True)
-    with open(TEST_FILENAME, "w", encoding="utf-8") as f:
-        f.write(test_code)
-    print(f"✅ Test suite saved to {TEST_FILENAME}")
-
-    # Step 3: run pytest
-    success, output = run_pytest()
-    print("\n=== Pytest Output ===")
-    print(output)
-
-    # Step 4: if tests fail, repair
-    if not success:
-        print("⚠️ Tests failed. Attempting to repair code...")
-
-        fixed_code = repair_code(code, test_code, output, llm_repair)
-        print("\n=== Fixed Code ===\n")
-        print(fixed_code)
-
-        if validate_code(fixed_code):
-            with open(CODE_FILENAME, "w", encoding="utf-8") as f:
-                f.write(fixed_code)
-            print(f"\n✅ Fixed code saved to {CODE_FILENAME}")
-
-            # Run pytest again
-            success, output = run_pytest()
-            print("\n=== Pytest Output After Repair ===")
-            print(output)
-
-            if success:
-                print("🎉 All tests passed after repair!")
+    # Work in a private workspace so concurrent runs cannot clobber each other
+    with create_workspace(MODULE_NAME) as workspace:
+        workspace.write_code(code)
+        print(f"\n✅ Code saved to {workspace.path}/{CODE_FILENAME}")
+
+        # Step 2: generate tests
+        test_code = generate_tests(code, llm_tests)
+        workspace.write_tests(test_code)
+        print(f"✅ Test suite saved to {workspace.path}/{TEST_FILENAME}")
+
+        # Step 3: run pytest
+        success, output = run_pytest(workspace)
+        print("\n=== Pytest Output ===")
+        print(output)
+
+        # Step 4: if tests fail, repair
+        if not success:
+            print("⚠️ Tests failed. Attempting to repair code...")
+
+            fixed_code = repair_code(code, test_code, output, llm_repair)
+            print("\n=== Fixed Code ===\n")
+            print(fixed_code)
+
+            if validate_code(fixed_code):
+                workspace.write_code(fixed_code)
+                print(f"\n✅ Fixed code saved to {workspace.path}/{CODE_FILENAME}")
+
+                # Run pytest again: failing and affected tests first, then the whole file
+                result = rerun_after_repair(workspace.test_file, workspace.path, test_code, code, fixed_code, output)
+                success, output = result.success, result.failure_report()
+                print("\n=== Pytest Output After Repair ===")
+                print(output)
+
+                if success:
+                    print("🎉 All tests passed after repair!")
+                else:
+                    print("❌ Tests still failing, manual fix needed.")
             else:
-                print("❌ Tests still failing, manual fix needed.")
+                print("❌ Fixed code is not valid Python.")
         else:
-            print("❌ Fixed code is not valid Python.")
-    else:
-        print("🎉 All tests passed on first run!")
+            print("🎉 All tests passed on first run!")
+
+        workspace.publish()
+        print(f"📄 Results copied to {CODE_FILENAME} and {TEST_FILENAME}")
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import TypeVar
+
+from langchain_openai import ChatOpenAI
+
+from llm_registry import get_chat_model
+
+# Models tried per stage, cheapest/fastest first: "code=a>b;tests=a>b;repair=a>b"
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+DEFAULT_ROUTE = ("gpt-4o-mini", "gpt-5-mini")
+STAGES = ("code", "tests", "repair")
+
+# Per-model statistics shared by all runs (set to "" to keep them in memory only)
+MODEL_STATS_PATH = os.getenv("MODEL_STATS_PATH", ".cache/model_stats.sqlite")
+
+# A model with at least MIN_SAMPLES attempts and a success rate below MIN_SUCCESS_RATE
+# for a stage is skipped there: escalating straight away is faster than failing first.
+MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "20"))
+MIN_SUCCESS_RATE = float(os.getenv("ROUTER_MIN_SUCCESS_RATE", "0.5"))
+
+T = TypeVar("T")
+
+
+def parse_routes(spec: str = MODEL_ROUTES) -> dict[str, tuple[str, ...]]:
+    """Parse "stage=model>model;..." into ladders; stages not listed use DEFAULT_ROUTE."""
+    routes = {stage: DEFAULT_ROUTE for stage in STAGES}
+    for item in filter(None, (part.strip() for part in spec.split(";"))):
+        stage, _, models = item.partition("=")
+        ladder = tuple(model.strip() for model in models.split(">") if model.strip())
+        if not ladder:
+            raise ValueError(f"MODEL_ROUTES: no models for stage '{stage.strip()}'")
+        routes[stage.strip()] = ladder
+    return routes
+
+
+@dataclass
+class ModelStats:
+    """Outcomes of one model on one stage."""
+
+    stage: str
+    model: str
+    calls: int = 0
+    successes: int = 0
+    total_latency: float = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.calls if self.calls else 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.calls if self.calls else 0.0
+
+
+class ModelStatsStore:
+    """Per (stage, model) counters persisted in SQLite, so routing improves across runs."""
+
+    def __init__(self, path: str = MODEL_STATS_PATH) -> None:
+        self._lock = threading.Lock()
+        if path:
+            dirpath = os.path.dirname(path)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS model_stats ("
+            "stage TEXT NOT NULL, model TEXT NOT NULL, calls INTEGER NOT NULL, successes INTEGER NOT NULL, "
+            "total_latency REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (stage, model))"
+        )
+        self._conn.commit()
+
+    def record(self, stage: str, model: str, latency: float, success: bool) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO model_stats (stage, model, calls, successes, total_latency, updated_at) "
+                "VALUES (?, ?, 1, ?, ?, ?) ON CONFLICT (stage, model) DO UPDATE SET "
+                "calls = calls + 1, successes = successes + excluded.successes, "
+                "total_latency = total_latency + excluded.total_latency, updated_at = excluded.updated_at",
+                (stage, model, int(success), latency, time.time()),
+            )
+            self._conn.commit()
+
+    def get(self, stage: str, model: str) -> ModelStats:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT calls, successes, total_latency FROM model_stats WHERE stage = ? AND model = ?",
+                (stage, model),
+            ).fetchone()
+        return ModelStats(stage, model, *row) if row else ModelStats(stage, model)
+
+    def all(self) -> list[ModelStats]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, model, calls, successes, total_latency FROM model_stats ORDER BY stage, model"
+            ).fetchall()
+        return [ModelStats(*row) for row in rows]
+
+
+class ModelRouter:
+    """Pick the model for each attempt of a stage: cheapest first, escalating after failures."""
+
+    def __init__(
+        self,
+        routes: dict[str, tuple[str, ...]] | None = None,
+        stats: ModelStatsStore | None = None,
+    ) -> None:
+        self.routes = routes or parse_routes()
+        self.stats = stats or ModelStatsStore()
+
+    def ladder(self, stage: str) -> list[str]:
+        """The stage's models in escalation order, without those that keep failing it."""
+        ladder = list(self.routes.get(stage, DEFAULT_ROUTE))
+        kept = [
+            model for model in ladder[:-1]
+            if (s := self.stats.get(stage, model)).calls < MIN_SAMPLES or s.success_rate >= MIN_SUCCESS_RATE
+        ]
+        return kept + ladder[-1:]  # the strongest model is always available
+
+    def model_for(self, stage: str, attempt: int = 0) -> str:
+        """Model for the `attempt`-th try of a stage (0 = first); stays on the strongest one afterwards."""
+        ladder = self.ladder(stage)
+        return ladder[min(attempt, len(ladder) - 1)]
+
+    def llm_for(self, stage: str, attempt: int = 0) -> ChatOpenAI:
+        return get_chat_model(self.model_for(stage, attempt))
+
+    def record(self, stage: str, model: str, latency: float, success: bool) -> None:
+        self.stats.record(stage, model, latency, success)
+
+    def run(self, stage: str, call: Callable[[ChatOpenAI], T], accept: Callable[[T], bool]) -> T:
+        """Call each model of the ladder in turn until `accept` approves a result.
+
+        Only the call itself is timed; the last result is returned even when rejected.
+        """
+        result = None
+        for model in self.ladder(stage):
+            start = time.perf_counter()
+            result = call(get_chat_model(model))
+            latency = time.perf_counter() - start
+            ok = accept(result)
+            self.record(stage, model, latency, ok)
+            if ok:
+                return result
+            print(f"⬆️ {stage}: {model} failed validation, escalating")
+        return result
+
+    async def arun(self, stage: str, call: Callable[[ChatOpenAI], Awaitable[T]], accept: Callable[[T], bool]) -> T:
+        """Async variant of run."""
+        result = None
+        for model in self.ladder(stage):
+            start = time.perf_counter()
+            result = await call(get_chat_model(model))
+            latency = time.perf_counter() - start
+            ok = accept(result)
+            self.record(stage, model, latency, ok)
+            if ok:
+                return result
+            print(f"⬆️ {stage}: {model} failed validation, escalating")
+        return result
+
+    def format_stats(self) -> str:
+        """Table of calls, success rate and mean latency per stage and model."""
+        lines = [f"{'stage':<8}{'model':<24}{'calls':>7}{'success':>9}{'mean s':>9}"]
+        for s in self.stats.all():
+            lines.append(f"{s.stage:<8}{s.model:<24}{s.calls:>7}{s.success_rate:>9.0%}{s.mean_latency:>9.2f}")
+        return "\n".join(lines)
+
+
+_router: ModelRouter | None = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """Return the process-wide router (routes from MODEL_ROUTES, stats from MODEL_STATS_PATH)."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
+
+
+def pinned_router(model: str) -> ModelRouter:
+    """Router using `model` for every stage, without escalation (statistics are still recorded)."""
+    return ModelRouter({stage: (model,) for stage in STAGES}, get_router().stats)
+
+
+if __name__ == "__main__":
+    router = get_router()
+    for stage in STAGES:
+        print(f"{stage}: {' > '.join(router.ladder(stage))}")
+    print()
+    print(router.format_stats())
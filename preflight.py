@@ -0,0 +1,235 @@
+import ast
+import importlib.util
+import os
+import sys
+import threading
+import time
+import typing
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+from code_analysis import CodeAnalysis, analyze, free_names
+from pytest_service import DEFAULT_ARGS, DEFAULT_TIMEOUT, RunResult, TestCaseResult, run_tests
+from tracing import span
+
+# Set PREFLIGHT=0 to always go straight to pytest
+PREFLIGHT = os.getenv("PREFLIGHT", "1") == "1"
+
+# Exit code of a run that was answered by the pre-flight checks (pytest itself uses 0-5)
+PREFLIGHT_EXIT_CODE = -2
+
+_TYPING_NAMES = set(typing.__all__)
+
+
+@dataclass
+class PreflightStats:
+    """How many pytest runs the pre-flight checks answered on their own."""
+
+    checks: int = 0
+    rounds_saved: int = 0
+
+
+_stats = PreflightStats()
+_stats_lock = threading.Lock()
+
+
+def preflight_stats() -> PreflightStats:
+    """Return the process-wide pre-flight counters."""
+    return _stats
+
+
+# ---------- Checks ----------
+
+def _resolvable(module: str, search_dir: str | None) -> bool:
+    """Whether `module` can be imported, without importing it (only its top-level package)."""
+    top = module.split(".")[0]
+    if top in sys.modules:
+        return True
+    if search_dir and (
+        os.path.exists(os.path.join(search_dir, f"{top}.py")) or os.path.isdir(os.path.join(search_dir, top))
+    ):
+        return True
+    try:
+        return importlib.util.find_spec(top) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _is_submodule(package, name: str) -> bool:
+    """Whether `name` is a submodule of the loaded `package`, imported or not (e.g. `logging.handlers`)."""
+    if name in sys.modules:
+        return True
+    if not hasattr(package, "__path__"):
+        return False
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+_IMPORT_GUARDS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+
+def _guarded_imports(tree: ast.Module) -> set[ast.stmt]:
+    """Imports inside `try: ... except ImportError:` blocks (optional dependencies)."""
+    guarded: set[ast.stmt] = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Try):
+            continue
+        caught = set()
+        for handler in node.handlers:
+            if handler.type is None:
+                caught.add("BaseException")
+            else:
+                types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+                caught.update(t.id for t in types if isinstance(t, ast.Name))
+        if caught & _IMPORT_GUARDS:
+            guarded.update(
+                n for stmt in node.body for n in ast.walk(stmt) if isinstance(n, (ast.Import, ast.ImportFrom))
+            )
+    return guarded
+
+
+def check_imports(analysis: CodeAnalysis, search_dir: str | None = None) -> list[str]:
+    """Imports that cannot resolve in the installed environment.
+
+    Names imported from modules that are already loaded (typically the
+    standard library) are checked as well, e.g. `from typing import Lst`.
+    Imports guarded by `except ImportError` are optional and skipped.
+    """
+    problems: list[str] = []
+    guarded = _guarded_imports(analysis.tree)
+    for node in ast.walk(analysis.tree):
+        if node in guarded:
+            continue
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules = [node.module]
+        else:
+            continue
+        for module in modules:
+            if not _resolvable(module, search_dir):
+                problems.append(f"line {node.lineno}: cannot import module '{module}' (not installed)")
+                continue
+            loaded = sys.modules.get(node.module) if isinstance(node, ast.ImportFrom) else None
+            if loaded is None:
+                continue
+            for alias in node.names:
+                if alias.name != "*" and not hasattr(loaded, alias.name) \
+                        and not _is_submodule(loaded, f"{node.module}.{alias.name}"):
+                    problems.append(f"line {node.lineno}: cannot import name '{alias.name}' from '{node.module}'")
+    return problems
+
+
+def check_names(analysis: CodeAnalysis) -> list[str]:
+    """Names the module uses but never defines, with the fix for forgotten typing imports."""
+    if analysis.star_import:
+        return []
+    problems = []
+    for name in analysis.undefined_names:
+        if name in _TYPING_NAMES:
+            problems.append(f"name '{name}' is not defined (missing 'from typing import {name}')")
+        else:
+            problems.append(f"name '{name}' is not defined")
+    return problems
+
+
+def check_test_imports(tests: str, analysis: CodeAnalysis, module_name: str) -> list[str]:
+    """Names the tests expect from the module under test that it does not provide."""
+    try:
+        tree = ast.parse(tests)
+    except SyntaxError as e:
+        return [f"tests: syntax error: {e}"]
+    exported = analysis.top_level_names
+
+    problems: list[str] = []
+    aliases: set[str] = set()
+    star = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module == module_name:
+            for alias in node.names:
+                if alias.name == "*":
+                    star = True
+                elif alias.name not in exported:
+                    problems.append(f"tests import '{alias.name}' but {module_name} does not define it")
+        elif isinstance(node, ast.Import):
+            aliases.update(alias.asname or alias.name for alias in node.names if alias.name == module_name)
+        elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in aliases:
+            if node.attr not in exported:
+                problems.append(f"tests use '{module_name}.{node.attr}' but {module_name} does not define it")
+
+    if star:
+        missing = free_names(tree) - analysis.star_exports - {"pytest"}
+        problems.extend(f"tests use '{name}' but {module_name} does not define it" for name in sorted(missing))
+    return list(dict.fromkeys(problems))
+
+
+def preflight(code: str, tests: str = "", module_name: str | None = None, search_dir: str | None = None) -> list[str]:
+    """Run the static checks; returns the problems found (empty means "go run pytest")."""
+    analysis = analyze(code)
+    if not analysis.valid:
+        return [f"syntax error: {analysis.syntax_error}"]
+    problems = check_imports(analysis, search_dir) + check_names(analysis)
+    if tests and module_name:
+        problems += check_test_imports(tests, analysis, module_name)
+    return problems
+
+
+# ---------- Runner ----------
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _module_under_test(test_file: str) -> str | None:
+    """`tests/test_<module>.py` -> `<module>` (the layout every pipeline uses)."""
+    name = os.path.splitext(os.path.basename(test_file))[0]
+    return name[len("test_"):] if name.startswith("test_") else None
+
+
+def run_checked(
+    test_file: str,
+    cwd: str | None = None,
+    args=DEFAULT_ARGS,
+    timeout: float = DEFAULT_TIMEOUT,
+    select: Sequence[str] = (),
+) -> RunResult:
+    """Like run_tests, but answer from the pre-flight checks when they already find problems.
+
+    The failing RunResult carries the problems as its report, so the caller
+    goes straight to repair without paying for a pytest run.
+    """
+    with span("run_pytest", selected=len(select)) as current:
+        result = _run_checked(test_file, cwd, args, timeout, select)
+        current.attrs["exit_code"] = result.exit_code
+        return result
+
+
+def _run_checked(test_file: str, cwd: str | None, args, timeout: float, select: Sequence[str]) -> RunResult:
+    module_name = _module_under_test(test_file)
+    root = cwd or os.getcwd()
+    code = _read(os.path.join(root, f"{module_name}.py")) if module_name else None
+    if not PREFLIGHT or code is None:
+        return run_tests(test_file, cwd, args, timeout, select)
+
+    start = time.perf_counter()
+    problems = preflight(code, _read(os.path.join(root, test_file)) or "", module_name, root)
+    with _stats_lock:
+        _stats.checks += 1
+        _stats.rounds_saved += bool(problems)
+    if not problems:
+        return run_tests(test_file, cwd, args, timeout, select)
+
+    report = "\n".join(f"{module_name}.py: {problem}" for problem in problems)
+    return RunResult(
+        False,
+        f"Pre-flight checks failed (pytest not run):\n{report}",
+        PREFLIGHT_EXIT_CODE,
+        time.perf_counter() - start,
+        [TestCaseResult("preflight", "error", 0.0, report)],
+    )
@@ -0,0 +1,321 @@
+import ast
+import os
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+
+import tiktoken
+
+from code_analysis import analyze
+
+# Token budget for the variable parts (code + tests + errors) of a repair prompt
+REPAIR_TOKEN_BUDGET = int(os.getenv("REPAIR_TOKEN_BUDGET", "6000"))
+
+PARTIAL_CODE_NOTE = (
+    "# NOTE: only the functions involved in the failures are shown below; all other\n"
+    "# code is unchanged and omitted. Return the corrected versions of the functions\n"
+    "# shown (plus any imports they need) - omitted code will be kept as is.\n"
+)
+
+_TRACEBACK_FRAME = re.compile(r":\d+: in (\w+)")
+_NODE_ID = re.compile(r"::(\w+)")
+_ASSERTION_LINE = re.compile(r"^E\s+.*$", re.MULTILINE)
+
+
+@dataclass
+class CompactionStats:
+    """What build_repair_inputs did to fit the budget."""
+
+    tokens_before: int = 0
+    tokens_after: int = 0
+    code_partial: bool = False
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+@dataclass
+class CompactionTotals:
+    """Process-wide compaction metrics."""
+
+    calls: int = 0
+    compacted: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+_totals = CompactionTotals()
+_totals_lock = threading.Lock()
+
+
+def compaction_totals() -> CompactionTotals:
+    """Return the accumulated token savings of repair prompt compaction."""
+    return _totals
+
+
+# ---------- Token counting ----------
+
+# Rough characters-per-token ratio used when no tokenizer is available
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str) -> tiktoken.Encoding | None:
+    """Return the model's tokenizer, or None when it cannot be loaded (e.g. offline)."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Count tokens the way the OpenAI model will (estimated without a tokenizer)."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# ---------- Compaction steps ----------
+
+def dedupe_errors(errors: str) -> str:
+    """Collapse failure blocks whose assertion lines repeat an earlier block."""
+    blocks = errors.strip().split("\n\n")
+    seen: dict[tuple[str, ...], str] = {}
+    kept: list[str] = []
+    for block in blocks:
+        signature = tuple(_ASSERTION_LINE.findall(block))
+        header = block.splitlines()[0] if block else block
+        if signature and signature in seen:
+            kept.append(f"{header}\n(same error as {seen[signature]})")
+            continue
+        if signature:
+            seen[signature] = header.split(" ")[0]
+        kept.append(block)
+    return "\n\n".join(kept)
+
+
+def failing_test_names(errors: str) -> set[str]:
+    """Names of the test functions mentioned in a pytest report."""
+    return {name for name in _NODE_ID.findall(errors) if name.startswith("test")}
+
+
+def _called_names(node: ast.AST) -> set[str]:
+    names: set[str] = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Call) and isinstance(child.func, ast.Name):
+            names.add(child.func.id)
+        elif isinstance(child, ast.Name):
+            names.add(child.id)
+    return names
+
+
+def _is_definition(node: ast.stmt) -> bool:
+    return isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+
+
+def _span(node: ast.stmt) -> tuple[int, int]:
+    """0-based [start, end) line range of a statement, decorators included."""
+    start = min([d.lineno for d in getattr(node, "decorator_list", [])] + [node.lineno])
+    return start - 1, node.end_lineno
+
+
+def _segment(lines: list[str], node: ast.stmt) -> str:
+    start, end = _span(node)
+    return "\n".join(lines[start:end])
+
+
+def _keep_definitions(source: str, tree: ast.Module, keep: set[str]) -> str:
+    """Remove top-level definitions not in `keep`, leaving everything else as written."""
+    lines = source.splitlines()
+    for node in reversed(tree.body):
+        if _is_definition(node) and node.name not in keep:
+            start, end = _span(node)
+            del lines[start:end]
+    return re.sub(r"\n{4,}", "\n\n\n", "\n".join(lines)).strip("\n")
+
+
+def select_failing_tests(tests: str, failing: set[str]) -> str:
+    """Keep module-level setup, the failing tests and the fixtures they use."""
+    try:
+        tree = ast.parse(tests)
+    except SyntaxError:
+        return tests
+    defs = {node.name: node for node in tree.body if _is_definition(node)}
+    wanted = {name for name in failing if name in defs}
+    if not wanted:
+        return tests
+
+    # Fixtures are referenced as arguments; follow them transitively.
+    pending = list(wanted)
+    while pending:
+        node = defs[pending.pop()]
+        args = [a.arg for a in node.args.args] if not isinstance(node, ast.ClassDef) else []
+        for name in args + sorted(_called_names(node)):
+            if name in defs and name not in wanted and not name.startswith("test"):
+                wanted.add(name)
+                pending.append(name)
+
+    return _keep_definitions(tests, tree, wanted)
+
+
+def select_relevant_code(code: str, tests: str, errors: str) -> str | None:
+    """Keep imports, module-level statements and the functions/classes the failures touch.
+
+    Returns None when nothing could be left out.
+    """
+    analysis = analyze(code)
+    try:
+        test_tree = ast.parse(tests)
+    except SyntaxError:
+        return None
+    if not analysis.valid:
+        return None
+    tree, defs = analysis.tree, analysis.definitions
+
+    wanted = {name for name in _TRACEBACK_FRAME.findall(errors) if name in defs}
+    wanted |= {name for name in _called_names(test_tree) if name in defs}
+    pending = list(wanted)
+    while pending:  # include helpers the kept functions rely on
+        for name in _called_names(defs[pending.pop()]):
+            if name in defs and name not in wanted:
+                wanted.add(name)
+                pending.append(name)
+    if not wanted or len(wanted) == len(defs):
+        return None
+
+    return PARTIAL_CODE_NOTE + "\n" + _keep_definitions(code, tree, wanted)
+
+
+def truncate_to_budget(text: str, budget: int, model: str) -> str:
+    """Keep the tail of `text` within `budget` tokens."""
+    if count_tokens(text, model) <= budget:
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        return "...(truncated)\n" + text[-budget * _CHARS_PER_TOKEN:]
+    return "...(truncated)\n" + encoding.decode(encoding.encode(text, disallowed_special=())[-budget:])
+
+
+# ---------- Prompt inputs ----------
+
+def build_repair_inputs(
+    code: str,
+    tests: str,
+    errors: str,
+    model: str = "gpt-4o-mini",
+    budget: int = REPAIR_TOKEN_BUDGET,
+) -> tuple[dict[str, str], CompactionStats]:
+    """Return {"code", "tests", "errors"} for a repair prompt within `budget` tokens.
+
+    Inputs are compacted in order of increasing information loss and only
+    as far as needed: deduplicated errors, failing tests only, then only
+    the code involved in the failures. Merge the model's answer back with
+    merge_code() when `stats.code_partial` is set.
+    """
+    def total(parts: dict[str, str]) -> int:
+        return sum(count_tokens(value, model) for value in parts.values())
+
+    inputs = {"code": code, "tests": tests, "errors": errors}
+    stats = CompactionStats(tokens_before=total(inputs))
+    size = stats.tokens_before
+
+    if size > budget:
+        inputs["errors"] = dedupe_errors(errors)
+        size = total(inputs)
+    if size > budget:
+        inputs["tests"] = select_failing_tests(tests, failing_test_names(errors))
+        size = total(inputs)
+    if size > budget:
+        partial = select_relevant_code(code, inputs["tests"], errors)
+        if partial is not None:
+            inputs["code"] = partial
+            stats.code_partial = True
+            size = total(inputs)
+    if size > budget:
+        fixed = count_tokens(inputs["code"], model) + count_tokens(inputs["tests"], model)
+        inputs["errors"] = truncate_to_budget(inputs["errors"], max(budget - fixed, budget // 4), model)
+        size = total(inputs)
+
+    stats.tokens_after = size
+    with _totals_lock:
+        _totals.calls += 1
+        _totals.compacted += stats.tokens_saved > 0
+        _totals.tokens_before += stats.tokens_before
+        _totals.tokens_after += stats.tokens_after
+    return inputs, stats
+
+
+def compact_errors(errors: str, model: str = "gpt-4o-mini", budget: int = REPAIR_TOKEN_BUDGET // 2) -> str:
+    """Deduplicate and truncate a pytest report only (for prompts that rewrite code and tests)."""
+    compacted = truncate_to_budget(dedupe_errors(errors), budget, model)
+    before, after = count_tokens(errors, model), count_tokens(compacted, model)
+    with _totals_lock:
+        _totals.calls += 1
+        _totals.compacted += after < before
+        _totals.tokens_before += before
+        _totals.tokens_after += after
+    return compacted
+
+
+def _import_block_end(tree: ast.Module) -> int:
+    """Line after the module's leading docstring and imports (where new imports go)."""
+    end = 0
+    for index, node in enumerate(tree.body):
+        docstring = index == 0 and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+        if not (docstring or isinstance(node, (ast.Import, ast.ImportFrom))):
+            break
+        end = node.end_lineno
+    return end
+
+
+def merge_code(original: str, patch: str) -> str:
+    """Apply a partial repair: replace/add the top-level definitions in `patch`.
+
+    Imports from the patch that the original lacks are added after its
+    leading imports. Falls back to the patch itself when either side, or
+    the merged result, does not parse.
+    """
+    original_tree, patch_tree = analyze(original).tree, analyze(patch).tree
+    if original_tree is None or patch_tree is None:
+        return patch
+
+    patch_lines = patch.splitlines()
+    replacements = {
+        node.name: _segment(patch_lines, node) for node in patch_tree.body if _is_definition(node)
+    }
+    original_imports = {
+        ast.unparse(node) for node in original_tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    }
+    new_imports = [
+        _segment(patch_lines, node) for node in patch_tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom)) and ast.unparse(node) not in original_imports
+    ]
+
+    lines = original.splitlines()
+    # Taken before any replacement: the leading block sits above every definition, so it never moves.
+    import_end = _import_block_end(original_tree)
+    # Replace bottom-up so earlier line numbers stay valid.
+    for node in reversed(original_tree.body):
+        if _is_definition(node) and node.name in replacements:
+            start, end = _span(node)
+            lines[start:end] = replacements.pop(node.name).splitlines()
+
+    added = [replacements[name] for name in replacements]  # definitions the repair added
+    merged = "\n".join(lines[:import_end] + new_imports + lines[import_end:]).rstrip("\n")
+    if added:
+        merged += "\n\n\n" + "\n\n\n".join(added)
+    merged += "\n"
+    return merged if analyze(merged).valid else patch
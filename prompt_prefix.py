@@ -0,0 +1,90 @@
+import os
+import threading
+from dataclasses import dataclass
+
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from tracing import current_span
+
+# Providers only cache prompt prefixes of at least this many tokens (OpenAI: 1024)
+CACHEABLE_PREFIX_TOKENS = int(os.getenv("CACHEABLE_PREFIX_TOKENS", "1024"))
+
+
+def prefixed_prompt(instructions: str, request: str) -> ChatPromptTemplate:
+    """Chat prompt whose fixed `instructions` (system message) come before the variable `request` template.
+
+    Every rendering starts with the same system message, so a batch of
+    requests shares that prefix. `instructions` is sent verbatim: it is not
+    a template. Providers only cache the prefix once it reaches
+    CACHEABLE_PREFIX_TOKENS. The current instruction blocks are a few hundred
+    tokens, so for now this ordering only makes the shared prefix measurable
+    with format_prefix_report(); it does not lower latency or cost.
+    """
+    return ChatPromptTemplate.from_messages([SystemMessage(content=instructions.strip()), ("human", request.strip())])
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return len(text) // 4
+
+
+@dataclass
+class PrefixStats:
+    """Longest prefix shared by all prompts sent for one stage."""
+
+    stage: str
+    prompts: int = 0
+    prefix: str = ""
+    shortest: int = 0  # characters of the shortest prompt
+
+    @property
+    def prefix_tokens(self) -> int:
+        return estimate_tokens(self.prefix)
+
+    @property
+    def cacheable(self) -> bool:
+        return self.prefix_tokens >= CACHEABLE_PREFIX_TOKENS
+
+    def add(self, prompt_text: str) -> None:
+        if not self.prompts:
+            self.prefix = prompt_text
+            self.shortest = len(prompt_text)
+        else:
+            length = 0
+            for a, b in zip(self.prefix, prompt_text):
+                if a != b:
+                    break
+                length += 1
+            self.prefix = self.prefix[:length]
+            self.shortest = min(self.shortest, len(prompt_text))
+        self.prompts += 1
+
+
+_stats: dict[str, PrefixStats] = {}
+_lock = threading.Lock()
+
+
+def record_prompt(prompt_text: str) -> None:
+    """Track the prefix this prompt shares with the others sent from the same pipeline stage."""
+    current = current_span()
+    stage = current.stage if current else "other"
+    with _lock:
+        _stats.setdefault(stage, PrefixStats(stage)).add(prompt_text)
+
+
+def prefix_stats() -> list[PrefixStats]:
+    """Shared prefix per stage for the prompts sent so far in this process."""
+    with _lock:
+        return sorted(_stats.values(), key=lambda s: s.stage)
+
+
+def format_prefix_report(stats: list[PrefixStats] | None = None) -> str:
+    """Table of prompts, shared prefix and its share of the shortest prompt per stage."""
+    stats = prefix_stats() if stats is None else stats
+    lines = [f"{'stage':<18}{'prompts':>8}{'prefix tok':>12}{'of prompt':>11}  cacheable"]
+    for s in stats:
+        share = len(s.prefix) / s.shortest if s.shortest else 0.0
+        cacheable = "yes" if s.cacheable else "no"
+        lines.append(f"{s.stage:<18}{s.prompts:>8}{s.prefix_tokens:>12}{share:>11.0%}  {cacheable}")
+    return "\n".join(lines)
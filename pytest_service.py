@@ -0,0 +1,352 @@
+import atexit
+import contextlib
+import io
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+
+# "worker" keeps pytest warm in a long-lived process, "subprocess" spawns one per run
+PYTEST_RUNNER = os.getenv("PYTEST_RUNNER", "worker")
+DEFAULT_TIMEOUT = float(os.getenv("PYTEST_TIMEOUT", "120"))
+DEFAULT_ARGS = ("-q", "--tb=short")
+
+# Limits for the traceback kept per failing test (repair prompts only need the tail)
+MAX_TRACEBACK_LINES = 25
+MAX_TRACEBACK_CHARS = 2000
+
+
+def trim_traceback(text: str, max_lines: int = MAX_TRACEBACK_LINES, max_chars: int = MAX_TRACEBACK_CHARS) -> str:
+    """Keep the last lines of a traceback, where the assertion error lives."""
+    lines = text.strip().splitlines()
+    if len(lines) > max_lines:
+        lines = ["..."] + lines[-max_lines:]
+    trimmed = "\n".join(lines)
+    return trimmed if len(trimmed) <= max_chars else "..." + trimmed[-max_chars:]
+
+
+@dataclass
+class TestCaseResult:
+    """Outcome of a single test (or of collecting a test module)."""
+
+    __test__ = False  # not a pytest test class
+
+    nodeid: str
+    outcome: str  # "passed", "failed", "error" or "skipped"
+    duration: float = 0.0
+    traceback: str = ""
+
+
+@dataclass
+class RunResult:
+    """Outcome of one pytest run."""
+
+    success: bool
+    output: str
+    exit_code: int
+    duration: float
+    tests: list[TestCaseResult] = field(default_factory=list)
+
+    @property
+    def failures(self) -> list[TestCaseResult]:
+        return [t for t in self.tests if t.outcome in ("failed", "error")]
+
+    def summary(self) -> str:
+        """One line such as '12 passed, 2 failed in 0.05s'."""
+        counts: dict[str, int] = {}
+        for test in self.tests:
+            counts[test.outcome] = counts.get(test.outcome, 0) + 1
+        parts = [f"{n} {outcome}" for outcome, n in sorted(counts.items())] or ["no tests ran"]
+        return f"{', '.join(parts)} in {self.duration:.2f}s"
+
+    def failure_report(self) -> str:
+        """Compact report of the failing tests only (for repair prompts).
+
+        Falls back to the raw output when pytest failed without reporting
+        any individual test (e.g. a usage error or a crash).
+        """
+        if self.success:
+            return self.summary()
+        if not self.failures:
+            return trim_traceback(self.output)
+        blocks = [f"{t.nodeid} [{t.outcome}]\n{t.traceback}".rstrip() for t in self.failures]
+        return "\n\n".join(blocks + [self.summary()])
+
+
+def _targets(test_file: str, select: Sequence[str]) -> list[str]:
+    """Command-line targets: the whole file, or only the selected tests in it."""
+    if not select:
+        return [test_file]
+    return [f"{test_file}::{name}" for name in select]
+
+
+# ---------- Worker process ----------
+
+class _ResultCollector:
+    """pytest plugin recording a TestCaseResult per test."""
+
+    def __init__(self) -> None:
+        self.results: dict[str, TestCaseResult] = {}
+
+    def pytest_collectreport(self, report) -> None:
+        if report.failed:
+            self.results[report.nodeid or "collection"] = TestCaseResult(
+                report.nodeid or "collection", "error", 0.0, trim_traceback(report.longreprtext)
+            )
+
+    def pytest_runtest_logreport(self, report) -> None:
+        current = self.results.get(report.nodeid)
+        if report.when == "call" or report.outcome != "passed":
+            if current is not None and current.outcome in ("failed", "error"):
+                current.duration += report.duration
+                return  # keep the first failure (e.g. setup error)
+            if report.failed:
+                outcome = "failed" if report.when == "call" else "error"
+            else:
+                outcome = report.outcome
+            self.results[report.nodeid] = TestCaseResult(
+                report.nodeid,
+                outcome,
+                report.duration + (current.duration if current else 0.0),
+                trim_traceback(report.longreprtext) if report.failed else "",
+            )
+        elif current is None:
+            self.results[report.nodeid] = TestCaseResult(report.nodeid, "passed", report.duration)
+        else:
+            current.duration += report.duration
+
+
+def _purge_modules(roots: set[str]) -> None:
+    """Forget modules imported from any served directory so the next run sees fresh code."""
+    prefixes = tuple(os.path.abspath(root) + os.sep for root in roots)
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(prefixes):
+            del sys.modules[name]
+
+
+def _worker_main(conn) -> None:
+    """Serve pytest runs until told to stop (runs inside the worker process)."""
+    import importlib
+
+    import pytest
+
+    # Generated files are rewritten within the same second; never trust bytecode caches.
+    sys.dont_write_bytecode = True
+    base_path = list(sys.path)
+    served_roots: set[str] = set()
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        cwd, args = request
+        start = time.perf_counter()
+        buffer = io.StringIO()
+        collector = _ResultCollector()
+        try:
+            os.chdir(cwd)
+            sys.path[:] = [cwd] + base_path
+            served_roots.add(cwd)
+            _purge_modules(served_roots)
+            # Workspaces are short-lived: forget deleted ones once their modules are gone.
+            served_roots = {root for root in served_roots if os.path.isdir(root)}
+            importlib.invalidate_caches()
+            with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+                exit_code = int(pytest.main(["-p", "no:cacheprovider", *args], plugins=[collector]))
+        except BaseException as e:  # report crashes instead of killing the worker
+            buffer.write(f"\nPytest execution failed: {type(e).__name__}: {e}\n")
+            exit_code = 3
+        conn.send((exit_code, buffer.getvalue(), time.perf_counter() - start, list(collector.results.values())))
+
+
+class PytestWorker:
+    """A persistent process that runs `pytest.main` on demand.
+
+    pytest and its plugins are imported once; before every run the modules
+    loaded from the working directory (generated code and tests) are purged
+    so edits made by a repair round are picked up.
+    """
+
+    def __init__(self) -> None:
+        self._ctx = multiprocessing.get_context("spawn")
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._process is not None and self._process.is_alive():
+            return
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self._process.start()
+        self._conn = parent_conn
+
+    def run(self, test_file: str, cwd: str | None = None, args=DEFAULT_ARGS, timeout: float = DEFAULT_TIMEOUT,
+            select: Sequence[str] = ()) -> RunResult:
+        """Run pytest on `test_file` (relative to `cwd`) and wait for the result.
+
+        `select` restricts the run to the named tests ("test_x" or "TestY::test_x").
+        """
+        cwd = os.path.abspath(cwd or os.getcwd())
+        with self._lock:
+            self._ensure_started()
+            start = time.perf_counter()
+            try:
+                self._conn.send((cwd, [*args, *_targets(test_file, select)]))
+                if not self._conn.poll(timeout):
+                    # Hung test (e.g. an infinite loop in generated code): restart the worker.
+                    self.close()
+                    return RunResult(False, f"Pytest timed out after {timeout:.0f}s", -1, time.perf_counter() - start)
+                exit_code, output, duration, tests = self._conn.recv()
+            except (EOFError, OSError):
+                # Worker died (at start-up or mid-run): the pipe is closed or reset.
+                self.close()
+                return RunResult(False, "Pytest worker crashed", -1, time.perf_counter() - start)
+        return RunResult(exit_code == 0, output, exit_code, duration, tests)
+
+    def close(self) -> None:
+        """Stop the worker process."""
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            try:
+                self._conn.send(None)
+                self._process.join(timeout=1)
+            except (BrokenPipeError, OSError):
+                pass
+            if self._process.is_alive():
+                self._process.kill()
+        self._process = None
+        self._conn = None
+
+
+class PytestWorkerPool:
+    """A fixed number of warm workers, so concurrent tasks can test in parallel."""
+
+    def __init__(self, size: int) -> None:
+        self._workers = [PytestWorker() for _ in range(max(1, size))]
+        self._idle: queue.Queue[PytestWorker] = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def run(self, test_file: str, cwd: str | None = None, args=DEFAULT_ARGS, timeout: float = DEFAULT_TIMEOUT,
+            select: Sequence[str] = ()) -> RunResult:
+        worker = self._idle.get()
+        try:
+            return worker.run(test_file, cwd, args, timeout, select)
+        finally:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.close()
+
+
+# ---------- Entry points ----------
+
+def _junit_nodeid(classname: str, name: str, test_file: str | None) -> str:
+    """pytest node id of a JUnit test case: `tests.test_x.TestY` + `test_z` -> `tests/test_x.py::TestY::test_z`."""
+    if not classname:
+        return name
+    module = os.path.splitext(os.path.normpath(test_file))[0].replace(os.sep, ".") if test_file else ""
+    if module and (classname == module or classname.startswith(f"{module}.")):
+        classes = classname[len(module) + 1:].split(".") if classname != module else []
+    else:
+        # Unknown test file: class names are the trailing capitalized parts (TestY, TestY.TestNested).
+        parts = classname.split(".")
+        split = len(parts)
+        while split > 1 and parts[split - 1][:1].isupper():
+            split -= 1
+        module, classes = ".".join(parts[:split]), parts[split:]
+    return "::".join([f"{module.replace('.', '/')}.py", *classes, name])
+
+
+def _parse_junit(path: str, test_file: str | None = None) -> list[TestCaseResult]:
+    """Read per-test results from a JUnit XML report (of a run of `test_file`, when given)."""
+    try:
+        root = ET.parse(path).getroot()
+    except (ET.ParseError, OSError):
+        return []
+    results: list[TestCaseResult] = []
+    for case in root.iter("testcase"):
+        nodeid = _junit_nodeid(case.get("classname", ""), case.get("name", ""), test_file)
+        outcome, traceback = "passed", ""
+        for tag, name in (("failure", "failed"), ("error", "error"), ("skipped", "skipped")):
+            child = case.find(tag)
+            if child is not None:
+                outcome = name
+                traceback = trim_traceback(child.text or child.get("message", "")) if tag != "skipped" else ""
+                break
+        results.append(TestCaseResult(nodeid, outcome, float(case.get("time", 0) or 0), traceback))
+    return results
+
+
+def run_pytest_subprocess(test_file: str, cwd: str | None = None, args=DEFAULT_ARGS, timeout: float = DEFAULT_TIMEOUT,
+                          select: Sequence[str] = ()) -> RunResult:
+    """Run pytest in a fresh interpreter (the original, slower strategy)."""
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        junit_path = os.path.join(tmp, "junit.xml")
+        try:
+            result = subprocess.run(
+                [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", f"--junitxml={junit_path}",
+                 *args, *_targets(test_file, select)],
+                capture_output=True,
+                text=True,
+                cwd=cwd,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return RunResult(False, f"Pytest timed out after {timeout:.0f}s", -1, time.perf_counter() - start)
+        tests = _parse_junit(junit_path, test_file)
+    return RunResult(result.returncode == 0, result.stdout + result.stderr, result.returncode,
+                     time.perf_counter() - start, tests)
+
+
+# Number of warm workers (raise it for concurrent batches, see configure_workers)
+PYTEST_WORKERS = int(os.getenv("PYTEST_WORKERS", "1"))
+
+_pool: PytestWorkerPool | None = None
+_pool_lock = threading.Lock()
+
+
+def _close_pool() -> None:
+    if _pool is not None:
+        _pool.close()
+
+
+atexit.register(_close_pool)
+
+
+def configure_workers(size: int) -> None:
+    """Resize the process-wide worker pool (workers start lazily on first use)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = PytestWorkerPool(size)
+
+
+def get_pool() -> PytestWorkerPool:
+    """Return the process-wide pool of warm pytest workers."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PytestWorkerPool(PYTEST_WORKERS)
+        return _pool
+
+
+def run_tests(test_file: str, cwd: str | None = None, args=DEFAULT_ARGS, timeout: float = DEFAULT_TIMEOUT,
+              select: Sequence[str] = ()) -> RunResult:
+    """Run pytest on a single test file (or the `select`ed tests in it) using the configured PYTEST_RUNNER."""
+    if PYTEST_RUNNER == "subprocess":
+        return run_pytest_subprocess(test_file, cwd, args, timeout, select)
+    return get_pool().run(test_file, cwd, args, timeout, select)
@@ -0,0 +1,294 @@
+import argparse
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any
+
+from tracing import current_span
+from utils import content_hash
+
+# SQLite file keeping every run's tasks, artifacts and outcomes (set to "" to keep them in memory only)
+RUN_STORE_PATH = os.getenv("RUN_STORE_PATH", ".cache/runs.sqlite")
+
+# Set RUN_STORE_PROMPTS=1 to keep the full text of every LLM prompt (otherwise only its hash and length)
+RUN_STORE_PROMPTS = os.getenv("RUN_STORE_PROMPTS", "0") == "1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    meta TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS task_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT REFERENCES runs (run_id),
+    task_hash TEXT NOT NULL,
+    task TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    repairs INTEGER NOT NULL DEFAULT 0,
+    error TEXT NOT NULL DEFAULT '',
+    started_at REAL NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS task_runs_hash ON task_runs (task_hash, status);
+CREATE INDEX IF NOT EXISTS task_runs_started ON task_runs (started_at);
+CREATE INDEX IF NOT EXISTS task_runs_run ON task_runs (run_id);
+CREATE TABLE IF NOT EXISTS rounds (
+    task_run_id INTEGER NOT NULL REFERENCES task_runs (id),
+    round INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    tests TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    output TEXT NOT NULL,
+    duration REAL NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (task_run_id, round)
+);
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_run_id INTEGER NOT NULL REFERENCES task_runs (id),
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    prompt_chars INTEGER NOT NULL,
+    prompt TEXT NOT NULL,
+    latency REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_calls_task_run ON llm_calls (task_run_id);
+"""
+
+# Task run that LLM calls made in this thread/task belong to
+_current_task_run: contextvars.ContextVar[int | None] = contextvars.ContextVar("current_task_run", default=None)
+
+
+def task_hash(task: str) -> str:
+    """Stable key of a task description (identical text, identical hash)."""
+    return content_hash(task)
+
+
+@dataclass
+class TaskRun:
+    """One attempt at one task, recorded while it runs."""
+
+    id: int
+    token: contextvars.Token | None = None
+
+
+@dataclass
+class SolvedTask:
+    """The passing code and tests of an earlier attempt at a task."""
+
+    task: str
+    name: str
+    code: str
+    tests: str
+    run_id: str | None
+    finished_at: float
+
+
+@dataclass
+class DayTrend:
+    """Outcomes of all task runs started on one day."""
+
+    day: str
+    tasks: int
+    passed: int
+    mean_duration: float
+    mean_repairs: float
+
+    @property
+    def pass_rate(self) -> float:
+        return self.passed / self.tasks if self.tasks else 0.0
+
+
+class RunStore:
+    """SQLite record of runs: each task's LLM calls, models, code/test versions per round, outcomes and timings."""
+
+    def __init__(self, path: str = RUN_STORE_PATH) -> None:
+        self._lock = threading.Lock()
+        if path:
+            dirpath = os.path.dirname(path)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ---------- Recording ----------
+
+    def start_run(self, kind: str, **meta: Any) -> str:
+        """Open a run (a batch, an agent session, ...) and return its id."""
+        run_id = uuid.uuid4().hex[:16]
+        self._execute(
+            "INSERT INTO runs (run_id, kind, started_at, meta) VALUES (?, ?, ?, ?)",
+            (run_id, kind, time.time(), json.dumps(meta, default=str)),
+        )
+        return run_id
+
+    def finish_run(self, run_id: str) -> None:
+        self._execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def start_task(self, run_id: str | None, task: str, name: str) -> TaskRun:
+        """Record the start of a task; LLM calls made from here on (same thread/task) are attached to it."""
+        cursor = self._execute(
+            "INSERT INTO task_runs (run_id, task_hash, task, name, started_at) VALUES (?, ?, ?, ?, ?)",
+            (run_id, task_hash(task), task, name, time.time()),
+        )
+        task_run = TaskRun(cursor.lastrowid)
+        task_run.token = _current_task_run.set(task_run.id)
+        return task_run
+
+    def finish_task(self, task_run: TaskRun, status: str, repairs: int, error: str, duration: float) -> None:
+        if task_run.token is not None:
+            _current_task_run.reset(task_run.token)
+            task_run.token = None
+        self._execute(
+            "UPDATE task_runs SET status = ?, repairs = ?, error = ?, duration = ? WHERE id = ?",
+            (status, repairs, error, duration, task_run.id),
+        )
+
+    def record_round(
+        self, task_run: TaskRun, round_no: int, code: str, tests: str, passed: bool, output: str, duration: float
+    ) -> None:
+        """Record the code and tests of one round (0 = first generation, then one per repair) and their pytest run."""
+        self._execute(
+            "INSERT OR REPLACE INTO rounds (task_run_id, round, code, tests, passed, output, duration, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (task_run.id, round_no, code, tests, int(passed), output, duration, time.time()),
+        )
+
+    def record_llm_call(
+        self,
+        task_run_id: int,
+        stage: str,
+        model: str,
+        prompt: str,
+        latency: float,
+        keep_prompt: bool = RUN_STORE_PROMPTS,
+    ) -> None:
+        """Record one LLM call; the prompt is stored as its hash and length unless `keep_prompt`."""
+        self._execute(
+            "INSERT INTO llm_calls (task_run_id, stage, model, prompt_hash, prompt_chars, prompt, latency, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (task_run_id, stage, model, content_hash(prompt), len(prompt), prompt if keep_prompt else "", latency,
+             time.time()),
+        )
+
+    # ---------- Lookup ----------
+
+    def solved(self, task: str) -> SolvedTask | None:
+        """The latest passing code and tests for exactly this task, from any earlier run."""
+        rows = self._query(
+            "SELECT t.task, t.name, r.code, r.tests, t.run_id, r.created_at FROM task_runs t "
+            "JOIN rounds r ON r.task_run_id = t.id AND r.passed = 1 "
+            "WHERE t.task_hash = ? AND t.status = 'passed' ORDER BY r.created_at DESC LIMIT 1",
+            (task_hash(task),),
+        )
+        return SolvedTask(*rows[0]) if rows else None
+
+    def history(self, task: str) -> list[tuple]:
+        """(started_at, run_id, status, repairs, duration, error) of every attempt at a task, newest first."""
+        return self._query(
+            "SELECT started_at, run_id, status, repairs, duration, error FROM task_runs "
+            "WHERE task_hash = ? ORDER BY started_at DESC",
+            (task_hash(task),),
+        )
+
+    def recent_runs(self, limit: int = 10) -> list[tuple]:
+        """(run_id, kind, started_at, finished_at, tasks, passed, mean duration) of the latest runs."""
+        return self._query(
+            "SELECT r.run_id, r.kind, r.started_at, r.finished_at, COUNT(t.id), "
+            "COALESCE(SUM(t.status = 'passed'), 0), COALESCE(AVG(t.duration), 0) FROM runs r "
+            "LEFT JOIN task_runs t ON t.run_id = r.run_id GROUP BY r.run_id ORDER BY r.started_at DESC LIMIT ?",
+            (limit,),
+        )
+
+    def trends(self, days: int = 30) -> list[DayTrend]:
+        """Pass rate, duration and repairs per day over the last `days` days."""
+        rows = self._query(
+            "SELECT date(started_at, 'unixepoch', 'localtime') AS day, COUNT(*), SUM(status = 'passed'), "
+            "COALESCE(AVG(duration), 0), AVG(repairs) FROM task_runs WHERE started_at >= ? AND status != 'running' "
+            "GROUP BY day ORDER BY day",
+            (time.time() - days * 24 * 3600,),
+        )
+        return [DayTrend(*row) for row in rows]
+
+
+_store: RunStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_run_store() -> RunStore:
+    """Return the process-wide run store (RUN_STORE_PATH)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RunStore()
+        return _store
+
+
+def record_llm_call(model: str, prompt: str, latency: float) -> None:
+    """Attach an LLM call to the task run in progress, if any (stage taken from the current trace span)."""
+    task_run_id = _current_task_run.get()
+    if task_run_id is None:
+        return
+    current = current_span()
+    get_run_store().record_llm_call(task_run_id, current.stage if current else "other", model, prompt, latency)
+
+
+# ---------- Report ----------
+
+def _when(timestamp: float | None) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show recorded runs, daily trends or one task's history.")
+    parser.add_argument("--task", help="show every recorded attempt at this task")
+    parser.add_argument("--runs", type=int, default=10, help="number of recent runs to show")
+    parser.add_argument("--days", type=int, default=30, help="days of daily trends to show")
+    parser.add_argument("--path", default=RUN_STORE_PATH, help="run store SQLite file")
+    args = parser.parse_args()
+    store = RunStore(args.path)
+
+    if args.task:
+        print(f"📜 Attempts at: {args.task}")
+        for started_at, run_id, status, repairs, duration, error in store.history(args.task):
+            print(f"  {_when(started_at)}  {run_id or '-':<16}  {status:<8} {repairs} repairs  "
+                  f"{duration or 0:.1f}s  {error}")
+        return
+
+    print("🗂️ Recent runs:")
+    print(f"  {'run':<18}{'kind':<8}{'started':<18}{'finished':<18}{'tasks':>6}{'passed':>8}{'mean s':>8}")
+    for run_id, kind, started_at, finished_at, tasks, passed, mean in store.recent_runs(args.runs):
+        print(f"  {run_id:<18}{kind:<8}{_when(started_at):<18}{_when(finished_at):<18}"
+              f"{tasks:>6}{passed:>8}{mean:>8.1f}")
+
+    print(f"\n📈 Last {args.days} days:")
+    print(f"  {'day':<12}{'tasks':>6}{'passed':>8}{'rate':>7}{'mean s':>8}{'repairs':>9}")
+    for day in store.trends(args.days):
+        print(f"  {day.day:<12}{day.tasks:>6}{day.passed:>8}{day.pass_rate:>7.0%}"
+              f"{day.mean_duration:>8.1f}{day.mean_repairs:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
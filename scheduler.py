@@ -0,0 +1,352 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+import httpx
+from openai import APIConnectionError
+
+from prompt_prefix import record_prompt
+from run_store import record_llm_call
+from tracing import current_span, record_retry
+
+# Set LLM_SCHEDULER=0 to send every LLM request straight away, without budgets or retries
+LLM_SCHEDULER = os.getenv("LLM_SCHEDULER", "1") == "1"
+
+# Budgets per model and minute; override per model with "model=rpm/tpm;model=rpm/tpm"
+DEFAULT_RPM = int(os.getenv("LLM_RPM", "500"))
+DEFAULT_TPM = int(os.getenv("LLM_TPM", "200000"))
+RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+
+# Retries of rate-limited (429), timed-out and 5xx requests, with full-jitter exponential backoff
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "6"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "60"))
+
+# Completion tokens reserved per request on top of the prompt (the real size is unknown upfront)
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "1000"))
+
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+WINDOW = 60.0  # seconds covered by the RPM/TPM budgets
+POLL_INTERVAL = 0.05  # async waiters re-check the queue this often
+
+# Queued requests are served lowest priority first: repairs unblock a task that
+# already paid for generation, so they go before fresh generations.
+PRIORITY_REPAIR = 0
+PRIORITY_TESTS = 1
+PRIORITY_CODE = 2
+STAGE_PRIORITY = {
+    "repair_code": PRIORITY_REPAIR,
+    "repair_candidate": PRIORITY_REPAIR,
+    "generate_tests": PRIORITY_TESTS,
+    "draft_tests": PRIORITY_TESTS,
+    "generate_code": PRIORITY_CODE,
+}
+
+T = TypeVar("T")
+
+
+@dataclass
+class RateLimit:
+    """Requests and tokens a model may use per minute."""
+
+    rpm: int = DEFAULT_RPM
+    tpm: int = DEFAULT_TPM
+
+
+def parse_limits(spec: str = RATE_LIMITS) -> dict[str, RateLimit]:
+    """Parse "model=rpm/tpm;..." into per-model limits."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(";"))):
+        model, _, budget = item.partition("=")
+        rpm, _, tpm = budget.partition("/")
+        limits[model.strip()] = RateLimit(int(rpm or DEFAULT_RPM), int(tpm or DEFAULT_TPM))
+    return limits
+
+
+@dataclass
+class SchedulerStats:
+    """What the scheduler did to keep the pipelines within their budgets."""
+
+    requests: int = 0
+    retries: int = 0
+    rate_limited: int = 0  # 429 responses
+    timeouts: int = 0
+    failures: int = 0  # requests given up after MAX_RETRIES, or with a non-retryable error
+    throttled: int = 0  # admissions (first tries and retries) that had to wait for their turn or budget
+    wait_time: float = 0.0  # seconds spent queued, summed over requests
+    max_queue_depth: int = 0
+
+
+def estimate_tokens(prompt_text: str) -> int:
+    """Rough token count of a request (~4 characters per token) plus the expected completion."""
+    return len(prompt_text) // 4 + EXPECTED_COMPLETION_TOKENS
+
+
+def current_priority() -> int:
+    """Priority of a request made now, from the pipeline stage it is made in."""
+    current = current_span()
+    return STAGE_PRIORITY.get(current.stage, PRIORITY_TESTS) if current else PRIORITY_TESTS
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, timeouts, dropped connections and transient server errors."""
+    if isinstance(error, (APIConnectionError, httpx.TransportError, TimeoutError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+def retry_after(error: BaseException) -> float | None:
+    """Delay the server asked for in a Retry-After header, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)]."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class _ModelQueue:
+    """Waiting requests and the last minute's usage of one model."""
+
+    def __init__(self, limit: RateLimit) -> None:
+        self.limit = limit
+        self.waiting: list[tuple[int, int]] = []  # heap of (priority, sequence number)
+        self.window: deque[tuple[float, int]] = deque()  # (admitted at, tokens)
+        self.window_tokens = 0
+        self.cooldown_until = 0.0  # set by 429s: nobody calls the model before then
+
+    def delay(self, tokens: int, now: float) -> float:
+        """Seconds until a request of `tokens` fits the budgets (0 when it fits now)."""
+        while self.window and self.window[0][0] <= now - WINDOW:
+            self.window_tokens -= self.window.popleft()[1]
+        waits = [self.cooldown_until - now]
+        if len(self.window) >= self.limit.rpm:
+            waits.append(self.window[-self.limit.rpm][0] + WINDOW - now)
+        # A single request above the whole budget is let through once the window is empty.
+        excess = self.window_tokens + tokens - self.limit.tpm
+        for admitted, used in self.window:
+            if excess <= 0:
+                break
+            excess -= used
+            waits.append(admitted + WINDOW - now)
+        return max(0.0, *waits)
+
+
+class RequestScheduler:
+    """Admit LLM requests within per-model RPM/TPM budgets, by priority, retrying transient errors.
+
+    Callers queue per model; the highest-priority request (oldest first) is
+    admitted once the budgets allow. A 429 pauses the whole model for the
+    delay the server asked for (or a jittered backoff), so the other queued
+    requests do not hammer it meanwhile.
+    """
+
+    def __init__(self, limits: dict[str, RateLimit] | None = None, max_retries: int = MAX_RETRIES) -> None:
+        self.limits = parse_limits() if limits is None else limits
+        self.max_retries = max_retries
+        self.stats = SchedulerStats()
+        self._queues: dict[str, _ModelQueue] = {}
+        self._cond = threading.Condition()
+        self._sequence = itertools.count()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = self._queues[model] = _ModelQueue(self.limits.get(model, RateLimit()))
+        return queue
+
+    def queue_depth(self, model: str | None = None) -> int:
+        """Requests waiting for admission (for one model, or all of them)."""
+        with self._cond:
+            if model is not None:
+                return len(self._queues[model].waiting) if model in self._queues else 0
+            return sum(len(queue.waiting) for queue in self._queues.values())
+
+    # ---------- Admission ----------
+
+    def ticket(self, priority: int = PRIORITY_TESTS) -> tuple[int, int]:
+        """Place in line of a new request; a retried request keeps its ticket (and its place)."""
+        return priority, next(self._sequence)
+
+    def _enqueue(self, model: str, ticket: tuple[int, int]) -> None:
+        heapq.heappush(self._queue(model).waiting, ticket)
+        self.stats.max_queue_depth = max(
+            self.stats.max_queue_depth, sum(len(queue.waiting) for queue in self._queues.values())
+        )
+
+    def _try_admit(self, model: str, ticket: tuple[int, int], tokens: int) -> float | None:
+        """Admit `ticket` if it is next and fits: 0.0. Otherwise seconds to wait (None: until notified)."""
+        queue = self._queues[model]
+        if queue.waiting[0] != ticket:
+            return None
+        now = time.monotonic()
+        delay = queue.delay(tokens, now)
+        if delay > 0:
+            return delay
+        heapq.heappop(queue.waiting)
+        queue.window.append((now, tokens))
+        queue.window_tokens += tokens
+        self._cond.notify_all()  # the next request in line may fit too
+        return 0.0
+
+    def _withdraw(self, model: str, ticket: tuple[int, int]) -> None:
+        queue = self._queues[model]
+        if ticket in queue.waiting:
+            queue.waiting.remove(ticket)
+            heapq.heapify(queue.waiting)
+            self._cond.notify_all()
+
+    def _count_wait(self, started: float) -> None:
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.stats.throttled += 1
+            self.stats.wait_time += waited
+
+    def acquire(self, model: str, tokens: int, ticket: tuple[int, int]) -> None:
+        """Block until the request holding `ticket` may send `tokens` to `model`."""
+        started = time.monotonic()
+        with self._cond:
+            self._enqueue(model, ticket)
+            try:
+                while (delay := self._try_admit(model, ticket, tokens)) != 0.0:
+                    self._cond.wait(delay)
+            except BaseException:
+                self._withdraw(model, ticket)
+                raise
+            self._count_wait(started)
+
+    async def aacquire(self, model: str, tokens: int, ticket: tuple[int, int]) -> None:
+        """Async variant of acquire: waits without blocking the event loop."""
+        started = time.monotonic()
+        with self._cond:
+            self._enqueue(model, ticket)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_admit(model, ticket, tokens)
+                    if delay == 0.0:
+                        self._count_wait(started)
+                        return
+                await asyncio.sleep(min(delay or POLL_INTERVAL, POLL_INTERVAL))
+        except BaseException:
+            with self._cond:
+                self._withdraw(model, ticket)
+            raise
+
+    # ---------- Retries ----------
+
+    def _retry_delay(self, model: str, error: Exception, attempt: int) -> float | None:
+        """Seconds to sleep before retrying after `error`, or None to give up."""
+        with self._cond:
+            if not is_retryable(error) or attempt >= self.max_retries:
+                self.stats.failures += 1
+                return None
+            self.stats.retries += 1
+            delay = retry_after(error) or backoff_delay(attempt)
+            if getattr(error, "status_code", None) == 429:
+                self.stats.rate_limited += 1
+                queue = self._queue(model)
+                queue.cooldown_until = max(queue.cooldown_until, time.monotonic() + delay)
+                delay = 0.0  # the cooldown holds this request back along with the others
+            elif isinstance(error, (APIConnectionError, httpx.TimeoutException, TimeoutError)):
+                self.stats.timeouts += 1
+        record_retry()
+        print(f"⏳ {model}: {type(error).__name__}, retry {attempt + 1}/{self.max_retries}")
+        return delay
+
+    def run(self, llm: Any, prompt_text: str, call: Callable[[], T]) -> T:
+        """Send `call()`, the request built from `prompt_text`, within `llm`'s budgets.
+
+        Transient errors (see is_retryable) are retried up to `max_retries` times.
+        """
+        model = _model_name(llm)
+        tokens = estimate_tokens(prompt_text)
+        ticket = self.ticket(current_priority())
+        with self._cond:
+            self.stats.requests += 1
+        for attempt in itertools.count():
+            self.acquire(model, tokens, ticket)
+            try:
+                return call()
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def arun(self, llm: Any, prompt_text: str, call: Callable[[], Awaitable[T]]) -> T:
+        """Async variant of run."""
+        model = _model_name(llm)
+        tokens = estimate_tokens(prompt_text)
+        ticket = self.ticket(current_priority())
+        with self._cond:
+            self.stats.requests += 1
+        for attempt in itertools.count():
+            await self.aacquire(model, tokens, ticket)
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def format_stats(self) -> str:
+        s = self.stats
+        return (f"{s.requests} LLM requests, {s.throttled} throttled ({s.wait_time:.1f}s queued, "
+                f"max queue depth {s.max_queue_depth}), {s.retries} retries "
+                f"({s.rate_limited} rate limited, {s.timeouts} timeouts), {s.failures} failed")
+
+
+def _model_name(llm: Any) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+_scheduler: RequestScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """Return the process-wide scheduler (limits from LLM_RPM, LLM_TPM and LLM_RATE_LIMITS)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def set_scheduler(scheduler: RequestScheduler) -> None:
+    """Install a differently configured scheduler (e.g. tight limits against a fake server)."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
+
+
+def submit(llm: Any, prompt_text: str, call: Callable[[], T]) -> T:
+    """Run one LLM request through the process-wide scheduler (directly when LLM_SCHEDULER=0)."""
+    record_prompt(prompt_text)
+    start = time.perf_counter()
+    result = get_scheduler().run(llm, prompt_text, call) if LLM_SCHEDULER else call()
+    record_llm_call(_model_name(llm), prompt_text, time.perf_counter() - start)
+    return result
+
+
+async def asubmit(llm: Any, prompt_text: str, call: Callable[[], Awaitable[T]]) -> T:
+    """Async variant of submit."""
+    record_prompt(prompt_text)
+    start = time.perf_counter()
+    result = await (get_scheduler().arun(llm, prompt_text, call) if LLM_SCHEDULER else call())
+    record_llm_call(_model_name(llm), prompt_text, time.perf_counter() - start)
+    return result
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from langchain_core.documents import Document
+
+from style_knowledge_base import embedding_model_name, get_embeddings
+from tracing import record_cache_hit, traced
+from utils import content_hash, model_slug
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+
+# Set SOLUTION_CACHE=0 to always generate from scratch
+SOLUTION_CACHE = os.getenv("SOLUTION_CACHE", "1") == "1"
+
+# Root directory of the persisted solution index (one sub-directory per embedding model)
+SOLUTION_INDEX_DIR = os.getenv("SOLUTION_INDEX_DIR", ".cache/solutions")
+COLLECTION_NAME = "solutions"
+
+# Cosine similarity above which a stored solution is reused as is (after its tests pass again)
+REUSE_THRESHOLD = float(os.getenv("SOLUTION_REUSE_THRESHOLD", "0.92"))
+# Cosine similarity above which the closest solution is shown to the LLM as an example
+EXAMPLE_THRESHOLD = float(os.getenv("SOLUTION_EXAMPLE_THRESHOLD", "0.6"))
+
+_vectorstore: Chroma | None = None
+_vectorstore_model: str | None = None
+_lock = threading.Lock()
+
+
+@dataclass
+class Solution:
+    """Test-validated code for a task, as stored in the index."""
+
+    task: str
+    code: str
+    tests: str
+    module_name: str
+    score: float = 0.0  # similarity to the query task (0..1)
+
+    def tests_for(self, module_name: str) -> str:
+        """The stored tests, importing from `module_name` instead of the original module."""
+        if module_name == self.module_name:
+            return self.tests
+        old = re.escape(self.module_name)
+        tests = re.sub(rf"^(\s*from\s+){old}(\s+import\b)", rf"\g<1>{module_name}\g<2>", self.tests, flags=re.M)
+        return re.sub(rf"^(\s*import\s+){old}\b", rf"\g<1>{module_name}", tests, flags=re.M)
+
+
+def index_path() -> str:
+    """Persist directory for the current embedding model."""
+    return os.path.join(SOLUTION_INDEX_DIR, f"chroma-{model_slug(embedding_model_name())}")
+
+
+def get_vectorstore() -> Chroma:
+    """Return the solution collection, embedded with the style knowledge base's model."""
+    global _vectorstore, _vectorstore_model
+    embeddings = get_embeddings()
+    with _lock:
+        # set_embeddings() may have swapped the model: its vectors live in another index.
+        if _vectorstore is None or _vectorstore_model != embeddings.model_name:
+            from langchain_chroma import Chroma
+
+            _vectorstore = Chroma(
+                collection_name=COLLECTION_NAME,
+                embedding_function=embeddings,
+                persist_directory=index_path(),
+                collection_metadata={"hnsw:space": "cosine"},  # relevance score == cosine similarity
+            )
+            _vectorstore_model = embeddings.model_name
+    return _vectorstore
+
+
+# ---------- Lookup ----------
+
+def closest_solution(task: str) -> Solution | None:
+    """The stored solution whose task is most similar to `task` (None when the index is empty)."""
+    if not SOLUTION_CACHE:
+        return None
+    results = get_vectorstore().similarity_search_with_relevance_scores(task, k=1)
+    if not results:
+        return None
+    doc, score = results[0]
+    return Solution(
+        task=doc.page_content,
+        code=doc.metadata["code"],
+        tests=doc.metadata["tests"],
+        module_name=doc.metadata["module_name"],
+        score=score,
+    )
+
+
+def find_reusable(task: str, threshold: float = REUSE_THRESHOLD) -> Solution | None:
+    """A stored solution for a near-duplicate task, if any (still to be re-verified by its tests)."""
+    solution = closest_solution(task)
+    return solution if solution is not None and solution.score >= threshold else None
+
+
+async def afind_reusable(task: str, threshold: float = REUSE_THRESHOLD) -> Solution | None:
+    """Async variant of find_reusable."""
+    return await asyncio.to_thread(find_reusable, task, threshold)
+
+
+def closest_example(task: str, threshold: float = EXAMPLE_THRESHOLD) -> Solution | None:
+    """The closest stored solution when it is similar enough to guide generation."""
+    try:
+        solution = closest_solution(task)
+    except Exception as e:  # an example is a bonus: never fail generation over it
+        print(f"⚠️ Solution index unavailable: {e}")
+        return None
+    return solution if solution is not None and solution.score >= threshold else None
+
+
+@traced("reuse_solution")
+def reuse_if_passing(solution: Solution, module_name: str, run_tests) -> tuple[str, str] | None:
+    """Re-run a stored solution's tests; returns (code, tests) when they still pass.
+
+    `run_tests(code, tests)` writes both files and returns whether pytest passed,
+    so the caller decides where they live.
+    """
+    tests = solution.tests_for(module_name)
+    if not run_tests(solution.code, tests):
+        print(f"⚠️ Cached solution for a similar task ({solution.score:.2f}) failed its tests, regenerating")
+        return None
+    record_cache_hit()
+    return solution.code, tests
+
+
+# ---------- Storage ----------
+
+def store_solution(task: str, code: str, tests: str, module_name: str) -> None:
+    """Remember code whose tests passed; storing the same task again replaces the old entry."""
+    if not SOLUTION_CACHE:
+        return
+    doc = Document(page_content=task, metadata={"code": code, "tests": tests, "module_name": module_name})
+    get_vectorstore().add_documents([doc], ids=[content_hash(task)])
+
+
+async def astore_solution(task: str, code: str, tests: str, module_name: str) -> None:
+    """Async variant of store_solution."""
+    await asyncio.to_thread(store_solution, task, code, tests, module_name)
@@ -0,0 +1,145 @@
+import ast
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_openai import ChatOpenAI
+
+from code_analysis import analyze, free_names
+from llm_cache import ainvoke_chain, invoke_chain
+from main import agenerate_code, agenerate_tests, clean_code, generate_code, generate_tests
+from prompt_prefix import prefixed_prompt
+from tracing import traced
+
+# Tests drafted from the task alone, while the code is still being generated.
+DRAFT_TEST_PROMPT = prefixed_prompt("""
+You are an expert Python developer.
+Another developer is implementing the task given by the user right now; you cannot see their code.
+Write a pytest test suite for the implementation they will produce.
+
+Constraints:
+- Do NOT include any import statements (no 'import pytest', no 'from ... import ...').
+- Call the functions by the snake_case names the task implies (or states explicitly).
+- Only use the public functions the task asks for; do not invent helpers.
+- Cover normal cases and edge cases; only expect exceptions the task clearly requires.
+- Use plain pytest style (no unittest).
+- Return ONLY valid Python test code (no markdown fences).
+""", "Task: {task}")
+
+@traced("draft_tests")
+def draft_tests(task: str, llm: ChatOpenAI) -> str:
+    """Draft a test body from the task description only."""
+    return clean_code(invoke_chain(DRAFT_TEST_PROMPT, llm, {"task": task}))
+
+
+@traced("draft_tests")
+async def adraft_tests(task: str, llm: ChatOpenAI) -> str:
+    """Async variant of draft_tests."""
+    return clean_code(await ainvoke_chain(DRAFT_TEST_PROMPT, llm, {"task": task}))
+
+
+def _expected_exceptions(tree: ast.Module) -> set[str]:
+    """Exception names used in `pytest.raises(...)`."""
+    names: set[str] = set()
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "raises"
+            and node.args
+        ):
+            targets = node.args[0].elts if isinstance(node.args[0], ast.Tuple) else [node.args[0]]
+            names.update(t.id for t in targets if isinstance(t, ast.Name))
+    return names
+
+
+def reconcile_tests(draft: str, code: str, module_name: str = "generated_code") -> str | None:
+    """Adapt a drafted test body to the generated code.
+
+    Returns the complete test file when the draft only uses names the module
+    exports and only expects exceptions the code raises, otherwise None (the
+    caller then falls back to regular test generation).
+    """
+    analysis = analyze(code)
+    try:
+        tree = ast.parse(draft)
+    except SyntaxError:
+        return None
+    if not analysis.valid:
+        return None
+
+    exported = set(analysis.functions) | set(analysis.classes)
+
+    # Drop imports of the code under test the model added despite the
+    # instructions; we write our own header below.
+    def imports_module_under_test(node: ast.stmt) -> bool:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            return False
+        bound = {(alias.asname or alias.name).split(".")[0] for alias in node.names}
+        return "*" in bound or bool(bound & exported)
+
+    tree.body = [node for node in tree.body if not imports_module_under_test(node)]
+
+    needed = free_names(tree) - {"pytest"}
+    if not needed or not needed <= exported:
+        return None
+
+    raised = set(analysis.raised_exceptions)
+    if not _expected_exceptions(tree) <= raised | exported:
+        return None
+
+    header = f"import pytest\nfrom {module_name} import {', '.join(sorted(needed))}\n\n"
+    return header + ast.unparse(tree) + "\n"
+
+
+def generate_code_and_tests(
+    task: str,
+    llm_code: ChatOpenAI,
+    llm_tests: ChatOpenAI,
+    module_name: str = "generated_code",
+) -> tuple[str, str, bool]:
+    """Generate code while speculatively drafting its tests in parallel.
+
+    Returns (code, tests, speculation_hit). On a miss the tests are generated
+    from the code as usual, so the result is never worse than the serial flow.
+    Tests are empty when the generated code does not parse.
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        draft_future = pool.submit(contextvars.copy_context().run, draft_tests, task, llm_tests)
+        code = generate_code(task, llm_code)
+        try:
+            draft = draft_future.result()
+        except Exception:
+            draft = ""
+
+    if not analyze(code).valid:
+        return code, "", False
+    tests = reconcile_tests(draft, code, module_name) if draft else None
+    if tests is not None:
+        return code, tests, True
+    return code, generate_tests(code, llm_tests, module_name=module_name), False
+
+
+async def agenerate_code_and_tests(
+    task: str,
+    llm_code: ChatOpenAI,
+    llm_tests: ChatOpenAI,
+    module_name: str = "generated_code",
+) -> tuple[str, str, bool]:
+    """Async variant of generate_code_and_tests."""
+    code, draft = await asyncio.gather(
+        agenerate_code(task, llm_code),
+        adraft_tests(task, llm_tests),
+        return_exceptions=True,
+    )
+    if isinstance(code, BaseException):
+        raise code
+    if isinstance(draft, BaseException):
+        draft = ""
+
+    if not analyze(code).valid:
+        return code, "", False
+    tests = reconcile_tests(draft, code, module_name) if draft else None
+    if tests is not None:
+        return code, tests, True
+    return code, await agenerate_tests(code, llm_tests, module_name=module_name), False
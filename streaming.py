@@ -0,0 +1,185 @@
+import ast
+import asyncio
+import os
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_openai import ChatOpenAI
+
+from llm_cache import get_response_cache, is_deterministic, prompt_key
+from main import build_code_prompt, clean_code
+from scheduler import asubmit, submit
+from solution_cache import closest_example
+from style_knowledge_base import add_documents, aretrieve_style, retrieve_style
+from tracing import record_cache_hit, record_retry, trace_config, traced
+
+# Abort when no ```python fence has appeared after this many characters
+FENCE_DEADLINE_CHARS = int(os.getenv("STREAM_FENCE_DEADLINE_CHARS", "400"))
+# Abort runaway generations longer than this
+MAX_OUTPUT_CHARS = int(os.getenv("STREAM_MAX_OUTPUT_CHARS", "20000"))
+MAX_ATTEMPTS = 2
+
+RETRY_REMINDER = "\n\nIMPORTANT: answer with a single ```python fenced code block and nothing else."
+
+# SyntaxErrors that only mean "the rest has not arrived yet"
+_INCOMPLETE_MARKERS = ("unterminated", "was never closed", "unexpected EOF", "expected an indented block")
+
+# Lines at column 0 that continue the previous statement rather than start one
+_CONTINUATIONS = ("#", "@", ")", "]", "}", "else", "elif", "except", "finally")
+
+
+class GenerationAborted(Exception):
+    """Raised when a streamed generation is abandoned early."""
+
+
+class StreamMonitor:
+    """Incrementally extract the fenced code block and sanity-check it.
+
+    `feed` returns True once the closing fence has arrived (the caller can
+    stop reading) and raises GenerationAborted when the stream goes off the
+    rails: no code fence in time, runaway length, or a syntax error in a
+    top-level block that is already complete.
+    """
+
+    def __init__(self, fence_deadline: int = FENCE_DEADLINE_CHARS, max_chars: int = MAX_OUTPUT_CHARS) -> None:
+        self.fence_deadline = fence_deadline
+        self.max_chars = max_chars
+        self.text = ""
+        self._code_start: int | None = None
+        self._checked_lines = 0
+
+    def feed(self, chunk: str) -> bool:
+        self.text += chunk
+        if len(self.text) > self.max_chars:
+            raise GenerationAborted(f"output exceeded {self.max_chars} characters")
+
+        if self._code_start is None:
+            fence = self.text.find("```")
+            if fence == -1:
+                if len(self.text) > self.fence_deadline:
+                    raise GenerationAborted(f"no code fence after {self.fence_deadline} characters")
+                return False
+            newline = self.text.find("\n", fence)
+            if newline == -1:
+                return False  # still reading the ```python line
+            self._code_start = newline + 1
+
+        body = self.text[self._code_start:]
+        if "```" in body:
+            return True
+        self._check_complete_blocks(body)
+        return False
+
+    def _check_complete_blocks(self, body: str) -> None:
+        """Parse everything before the last top-level statement start."""
+        lines = body.split("\n")[:-1]  # the last line may still be growing
+        if len(lines) <= self._checked_lines:
+            return
+        boundary = None
+        for i in range(len(lines) - 1, self._checked_lines, -1):
+            line = lines[i]
+            if line and not line[0].isspace() and not line.startswith(_CONTINUATIONS):
+                boundary = i
+                break
+        if boundary is None:
+            return
+        # A def/class starts its statement at its first decorator: never end the prefix on an `@` line.
+        while boundary > 0 and lines[boundary - 1].startswith(("@", "#")):
+            boundary -= 1
+        if boundary <= self._checked_lines:
+            return
+        try:
+            ast.parse("\n".join(lines[:boundary]))
+        except SyntaxError as e:
+            if not any(marker in str(e.msg) for marker in _INCOMPLETE_MARKERS):
+                raise GenerationAborted(f"syntax error in streamed code: {e}") from e
+            return
+        self._checked_lines = boundary
+
+
+def _inputs(task: str, attempt: int) -> dict[str, str]:
+    return {"task": task + (RETRY_REMINDER if attempt else "")}
+
+
+def _consume(stream) -> StreamMonitor:
+    """Read `stream` until the code block is complete (see StreamMonitor.feed)."""
+    monitor = StreamMonitor()
+    try:
+        for chunk in stream:
+            if monitor.feed(chunk):
+                break
+    finally:
+        stream.close()  # stop the HTTP stream: no more paying for tokens
+    return monitor
+
+
+async def _aconsume(stream) -> StreamMonitor:
+    """Async variant of _consume."""
+    monitor = StreamMonitor()
+    try:
+        async for chunk in stream:
+            if monitor.feed(chunk):
+                break
+    finally:
+        await stream.aclose()
+    return monitor
+
+
+@traced("generate_code")
+def generate_code_streaming(task: str, llm: ChatOpenAI, max_attempts: int = MAX_ATTEMPTS) -> str:
+    """Stream code generation, abandoning and retrying doomed generations early."""
+    add_documents()
+    prompt = build_code_prompt(retrieve_style(task), closest_example(task))
+    cache = get_response_cache() if is_deterministic(llm) else None
+    key = prompt_key(llm, prompt.format(**_inputs(task, 0)))
+    if cache is not None and (cached := cache.get(key)) is not None:
+        record_cache_hit()
+        return clean_code(cached)
+
+    chain = prompt | llm | StrOutputParser()
+    last_error: GenerationAborted | None = None
+    for attempt in range(max_attempts):
+        inputs = _inputs(task, attempt)
+        try:
+            # Rate-limited or dropped streams are restarted by the scheduler, from scratch
+            monitor = submit(
+                llm, prompt.format(**inputs), lambda: _consume(chain.stream(inputs, config=trace_config()))
+            )
+        except GenerationAborted as e:
+            print(f"⚠️ Generation aborted ({e}), retrying...")
+            record_retry()
+            last_error = e
+            continue
+        if cache is not None and attempt == 0:
+            cache.set(key, monitor.text)
+        return clean_code(monitor.text)
+    raise GenerationAborted(f"all {max_attempts} attempts aborted") from last_error
+
+
+@traced("generate_code")
+async def agenerate_code_streaming(task: str, llm: ChatOpenAI, max_attempts: int = MAX_ATTEMPTS) -> str:
+    """Async variant of generate_code_streaming built on `astream`."""
+    await asyncio.to_thread(add_documents)
+    prompt = build_code_prompt(await aretrieve_style(task), await asyncio.to_thread(closest_example, task))
+    cache = get_response_cache() if is_deterministic(llm) else None
+    key = prompt_key(llm, prompt.format(**_inputs(task, 0)))
+    if cache is not None and (cached := cache.get(key)) is not None:
+        record_cache_hit()
+        return clean_code(cached)
+
+    chain = prompt | llm | StrOutputParser()
+    last_error: GenerationAborted | None = None
+    for attempt in range(max_attempts):
+        inputs = _inputs(task, attempt)
+        try:
+            monitor = await asubmit(
+                llm, prompt.format(**inputs), lambda: _aconsume(chain.astream(inputs, config=trace_config()))
+            )
+        except GenerationAborted as e:
+            print(f"⚠️ Generation aborted ({e}), retrying...")
+            record_retry()
+            last_error = e
+            continue
+        if cache is not None and attempt == 0:
+            cache.set(key, monitor.text)
+        return clean_code(monitor.text)
+    raise GenerationAborted(f"all {max_attempts} attempts aborted") from last_error
@@ -1,25 +1,156 @@
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from typing import TYPE_CHECKING
+
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CacheStats, CachedEmbeddings
+from tracing import traced
+from utils import content_hash, model_slug
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+
+# Embedding model (small but effective for code & text)
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+COLLECTION_NAME = "style_guides"
+
+# Root directory for persisted style indexes (one sub-directory per corpus/model)
+STYLE_INDEX_DIR = os.getenv("STYLE_INDEX_DIR", ".style_index")
+
+# Initial style documents (PEP8 rules, Zen of Python, etc.)
+STYLE_GUIDELINES = [
+    "Use 4 spaces per indentation level.",
+    "Limit all lines to a maximum of 79 characters.",
+    "Use type hints for function signatures.",
+    "Write clear docstrings for all public modules, functions, classes, and methods.",
+    "Imports should usually be on separate lines.",
+    "Use 'is' or 'is not' when comparing with None.",
+]
+
+# Heavy objects (torch / sentence-transformers) are built lazily on first use
+# and shared by the whole process.
+_embeddings: CachedEmbeddings | None = None
+_vectorstore: Chroma | None = None
+_lock = threading.Lock()
+
+# Content hashes already stored in the collection (used as Chroma ids).
+_ingested_ids: set[str] = set()
+_ingest_lock = threading.Lock()
+
+
+def embedding_model_name() -> str:
+    """Name of the embedding model in use (EMBEDDING_MODEL unless replaced by set_embeddings)."""
+    return _embeddings.model_name if _embeddings is not None else EMBEDDING_MODEL
+
+
+def corpus_hash() -> str:
+    """Hash identifying the current style corpus together with the embedding model."""
+    return content_hash(embedding_model_name(), *STYLE_GUIDELINES)
+
+
+def index_path() -> str:
+    """Return the persist directory for the current corpus/model combination."""
+    return os.path.join(STYLE_INDEX_DIR, f"chroma-{model_slug(embedding_model_name())}-{corpus_hash()[:16]}")
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """Return the process-wide (query-cached) embedding model, loading it on first call."""
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+
+                _embeddings = CachedEmbeddings(
+                    HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL), EMBEDDING_MODEL
+                )
+    return _embeddings
 
-# Create embedding model (small but effective for code & text)
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-# Initialize Chroma DB in-memory for now
-vectorstore = Chroma(collection_name="style_guides", embedding_function=embeddings)
+def get_vectorstore() -> Chroma:
+    """Return the process-wide Chroma collection, creating it on first call."""
+    global _vectorstore
+    if _vectorstore is None:
+        embeddings = get_embeddings()
+        with _lock:
+            if _vectorstore is None:
+                from langchain_chroma import Chroma
+
+                # Persisted Chroma DB: a changed corpus or model maps to a fresh
+                # directory, so the index is only rebuilt when it is stale.
+                _vectorstore = Chroma(
+                    collection_name=COLLECTION_NAME,
+                    embedding_function=embeddings,
+                    persist_directory=index_path(),
+                )
+    return _vectorstore
+
+
+def set_embeddings(embeddings: Embeddings, model_name: str) -> None:
+    """Use another embedding model (e.g. a fake one in benchmarks) instead of EMBEDDING_MODEL.
+
+    Query vectors are cached in memory only, and the vector store is reopened
+    on next use from the index directory of `model_name`.
+    """
+    global _embeddings, _vectorstore
+    with _lock:
+        _embeddings = CachedEmbeddings(embeddings, model_name, db_path=None)
+        _vectorstore = None
+    with _ingest_lock:
+        _ingested_ids.clear()
+
+
+def embedding_cache_stats() -> CacheStats:
+    """Return hit/miss counters of the query embedding cache (without loading the model)."""
+    return _embeddings.stats if _embeddings is not None else CacheStats()
+
+
+def warm_up() -> None:
+    """Eagerly load the embedding model and vector store (e.g. before a batch run)."""
+    get_vectorstore()
+
+
+def ingest_documents(docs: list[Document]) -> int:
+    """Add documents keyed by content hash, skipping ones already stored.
+
+    Returns the number of documents that were actually embedded.
+    """
+    unique: dict[str, Document] = {}
+    for doc in docs:
+        unique.setdefault(content_hash(doc.page_content), doc)
+
+    with _ingest_lock:
+        pending = [doc_id for doc_id in unique if doc_id not in _ingested_ids]
+        if not pending:
+            return 0
+
+        vectorstore = get_vectorstore()
+        stored = set(vectorstore.get(ids=pending, include=[])["ids"])
+        missing = [doc_id for doc_id in pending if doc_id not in stored]
+        if missing:
+            vectorstore.add_documents([unique[doc_id] for doc_id in missing], ids=missing)
+        _ingested_ids.update(pending)
+        return len(missing)
+
 
 def add_documents():
-    """Load initial style documents (PEP8 rules, Zen of Python, etc.)"""
-    docs = [
-        Document(page_content="Use 4 spaces per indentation level."),
-        Document(page_content="Limit all lines to a maximum of 79 characters."),
-        Document(page_content="Use type hints for function signatures."),
-        Document(page_content="Write clear docstrings for all public modules, functions, classes, and methods."),
-        Document(page_content="Imports should usually be on separate lines."),
-        Document(page_content="Use 'is' or 'is not' when comparing with None."),
-    ]
-    vectorstore.add_documents(docs)
+    """Load initial style documents (idempotent, no re-embedding on repeat calls)."""
+    ingest_documents([Document(page_content=text) for text in STYLE_GUIDELINES])
+
 
+@traced("retrieve_style")
 def retrieve_style(query: str, k: int = 2):
     """Retrieve top-k relevant style guidelines for a given query."""
-    return vectorstore.similarity_search(query, k=k)
+    return get_vectorstore().similarity_search(query, k=k)
+
+
+@traced("retrieve_style")
+async def aretrieve_style(query: str, k: int = 2):
+    """Async variant of retrieve_style."""
+    vectorstore = await asyncio.to_thread(get_vectorstore)
+    return await vectorstore.asimilarity_search(query, k=k)
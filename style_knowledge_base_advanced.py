@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 from typing import List
 from dotenv import load_dotenv
 
@@ -6,6 +8,13 @@ from langchain_openai import ChatOpenAI
 from langchain.docstore.document import Document
 from langchain.vectorstores import FAISS
 from langchain.embeddings import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CacheStats, CachedEmbeddings
+from llm_registry import get_chat_model
+from model_router import get_router
+from tracing import traced
+from utils import content_hash, model_slug
 
 
 # Load environment variables (e.g., OPENAI_API_KEY, TEST_MODEL)
@@ -16,60 +25,114 @@ load_dotenv()
 # MODEL CONFIGURATION
 # ======================================================================
 
-# Default models
-CODE_MODEL = "gpt-5-mini"       # Deterministic & enterprise-grade code
-REPAIR_MODEL = "gpt-5-mini"     # Repair should be strict & consistent
-DEFAULT_TEST_MODEL = "gpt-4o-mini"  # Verbose & exploratory for tests
-
-# Allow overriding test model via environment variable
-TEST_MODEL = os.getenv("TEST_MODEL", DEFAULT_TEST_MODEL)
+# Models per stage come from the router (MODEL_ROUTES): cheapest first, escalating
+# on later attempts. Set TEST_MODEL to pin test generation to one model instead.
+TEST_MODEL = os.getenv("TEST_MODEL", "")
 
 
-def get_llm_code() -> ChatOpenAI:
-    """Return LLM for code generation."""
-    return ChatOpenAI(model=CODE_MODEL, temperature=0)
+def get_llm_code(attempt: int = 0) -> ChatOpenAI:
+    """Return LLM for the `attempt`-th try at code generation."""
+    return get_router().llm_for("code", attempt)
 
 
-def get_llm_tests() -> ChatOpenAI:
+def get_llm_tests(attempt: int = 0) -> ChatOpenAI:
     """Return LLM for test generation (switchable)."""
-    return ChatOpenAI(model=TEST_MODEL, temperature=0)
+    return get_chat_model(TEST_MODEL) if TEST_MODEL else get_router().llm_for("tests", attempt)
 
 
-def get_llm_repair() -> ChatOpenAI:
-    """Return LLM for repairing code based on failing tests."""
-    return ChatOpenAI(model=REPAIR_MODEL, temperature=0)
+def get_llm_repair(attempt: int = 0) -> ChatOpenAI:
+    """Return LLM for the `attempt`-th round of repairing code based on failing tests."""
+    return get_router().llm_for("repair", attempt)
 
 
 # ======================================================================
 # STYLE KNOWLEDGE BASE (RAG)
 # ======================================================================
 
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+# Root directory for persisted style indexes (one sub-directory per corpus/model)
+STYLE_INDEX_DIR = os.getenv("STYLE_INDEX_DIR", ".style_index")
+
+STYLE_GUIDELINES: List[str] = [
+    "Always follow PEP8 guidelines.",
+    "Use type hints for all function signatures.",
+    "Every function and class must have a docstring.",
+    "Avoid inline print statements in libraries.",
+    "Follow Zen of Python principles.",
+    "Keep functions short and focused.",
+    "Prefer List, Dict, Optional imports from typing explicitly.",
+    "Use descriptive variable names.",
+    "Raise specific exceptions (ValueError, TypeError).",
+    "Write modular, testable, enterprise-grade code.",
+]
+
+_embeddings: CachedEmbeddings | None = None
 _vectorstore: FAISS | None = None
 
 
+def get_embeddings() -> CachedEmbeddings:
+    """Return OpenAI embeddings with cached query vectors (shared per process)."""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = CachedEmbeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
+    return _embeddings
+
+
+def set_embeddings(embeddings: Embeddings, model_name: str) -> None:
+    """Use another embedding model (e.g. a fake one in benchmarks); the index is rebuilt for it."""
+    global _embeddings, _vectorstore
+    _embeddings = CachedEmbeddings(embeddings, model_name, db_path=None)
+    _vectorstore = None
+
+
+def embedding_cache_stats() -> CacheStats:
+    """Return hit/miss counters of the query embedding cache (without creating the client)."""
+    return _embeddings.stats if _embeddings is not None else CacheStats()
+
+
+def index_path() -> str:
+    """Return the FAISS directory for the current corpus/model combination."""
+    model_name = get_embeddings().model_name
+    digest = content_hash(model_name, *STYLE_GUIDELINES)
+    return os.path.join(STYLE_INDEX_DIR, f"faiss-{model_slug(model_name)}-{digest[:16]}")
+
+
+def _save_index(vectorstore: FAISS, path: str) -> None:
+    """Write the index next to its final location, then swap it in atomically."""
+    os.makedirs(STYLE_INDEX_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".faiss-", dir=STYLE_INDEX_DIR)
+    vectorstore.save_local(tmp_dir)
+    try:
+        os.replace(tmp_dir, path)
+    except OSError:
+        # Another process persisted the same corpus first; keep theirs.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
 def add_documents() -> None:
-    """Initialize vectorstore with style guidelines (idempotent)."""
+    """Initialize vectorstore with style guidelines (idempotent).
+
+    The index is loaded from disk when one exists for the current corpus and
+    embedding model, and only embedded (then persisted) otherwise.
+    """
     global _vectorstore
     if _vectorstore is not None:
         return  # Already initialized
 
-    style_docs: List[Document] = [
-        Document(page_content="Always follow PEP8 guidelines."),
-        Document(page_content="Use type hints for all function signatures."),
-        Document(page_content="Every function and class must have a docstring."),
-        Document(page_content="Avoid inline print statements in libraries."),
-        Document(page_content="Follow Zen of Python principles."),
-        Document(page_content="Keep functions short and focused."),
-        Document(page_content="Prefer List, Dict, Optional imports from typing explicitly."),
-        Document(page_content="Use descriptive variable names."),
-        Document(page_content="Raise specific exceptions (ValueError, TypeError)."),
-        Document(page_content="Write modular, testable, enterprise-grade code."),
-    ]
-
-    embeddings = OpenAIEmbeddings()
+    embeddings = get_embeddings()
+    path = index_path()
+    if os.path.exists(os.path.join(path, "index.faiss")):
+        # The index is written only by this module, so unpickling the docstore is safe.
+        _vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        return
+
+    style_docs: List[Document] = [Document(page_content=text) for text in STYLE_GUIDELINES]
     _vectorstore = FAISS.from_documents(style_docs, embeddings)
+    _save_index(_vectorstore, path)
 
 
+@traced("retrieve_style")
 def retrieve_style(query: str) -> List[Document]:
     """Retrieve top style guidelines relevant to the query."""
     if _vectorstore is None:
@@ -90,7 +153,10 @@ if __name__ == "__main__":
     for r in results:
         print("-", r.page_content)
 
+    print("Embedding cache:", embedding_cache_stats())
+
     print("\nLLM setup:")
-    print("Code model:", CODE_MODEL)
-    print("Repair model:", REPAIR_MODEL)
-    print("Test model (active):", TEST_MODEL)
+    router = get_router()
+    print("Code models:", " > ".join(router.ladder("code")))
+    print("Repair models:", " > ".join(router.ladder("repair")))
+    print("Test models (active):", TEST_MODEL or " > ".join(router.ladder("tests")))
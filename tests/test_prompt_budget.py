@@ -0,0 +1,48 @@
+import ast
+
+import pytest
+
+pytest.importorskip("tiktoken")
+
+from prompt_budget import merge_code  # noqa: E402
+
+
+def _functions(source: str) -> dict[str, str]:
+    tree = ast.parse(source)
+    return {node.name: ast.unparse(node) for node in tree.body if isinstance(node, ast.FunctionDef)}
+
+
+def test_new_imports_go_after_the_leading_imports():
+    original = '"""Module doc."""\nimport os\n\n\ndef a():\n    return os.sep\n'
+    patch = "import re\n\n\ndef a():\n    return re.escape(os.sep)\n"
+    merged = merge_code(original, patch)
+    assert merged.splitlines()[:3] == ['"""Module doc."""', "import os", "import re"]
+    assert "re.escape" in _functions(merged)["a"]
+
+
+def test_import_below_a_longer_replacement_stays_out_of_its_body():
+    original = "def b():\n    return 1\n\n\nimport os\n\n\ndef c():\n    return os.sep\n"
+    patch = "import re\n\n\ndef b():\n    x = 1\n    y = 2\n    z = 3\n    return x + y + z\n"
+    merged = merge_code(original, patch)
+    ast.parse(merged)
+    assert merged.startswith("import re\n")
+    assert _functions(merged)["b"] == ast.unparse(ast.parse(patch).body[1])
+    assert "c" in _functions(merged)
+
+
+ORIGINAL = "import os\n\n\ndef a():\n    x = 1\n    return x\n\n\ndef b():\n    return 2\n\n\ndef c():\n    return 3\n"
+
+
+@pytest.mark.parametrize("body", ["    return 0", "    a = 1\n    b = 2\n    c = 3\n    return a + b + c"])
+def test_replacements_that_change_length_keep_the_rest(body):
+    patch = f"def b():\n{body}\n\n\ndef d():\n    return 4\n"
+    merged = merge_code(ORIGINAL, patch)
+    functions = _functions(merged)
+    assert list(functions) == ["a", "b", "c", "d"]
+    assert functions["b"] == ast.unparse(ast.parse(patch).body[0])
+    assert functions["a"] == "def a():\n    x = 1\n    return x"
+
+
+def test_invalid_merge_falls_back_to_the_patch():
+    patch = "def a():\n    return 1\n"
+    assert merge_code("def a(:\n", patch) == patch
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+import scheduler  # noqa: E402
+from fake_openai_server import DEFAULT_REPLY, FAKE_MODEL, FakeOpenAIServer  # noqa: E402
+from langchain_openai import ChatOpenAI  # noqa: E402
+from scheduler import RateLimit, RequestScheduler  # noqa: E402
+
+PROMPT = "Write a Python function that adds two numbers."
+
+
+def _send(requests: int, scheduler_: RequestScheduler, server: FakeOpenAIServer, concurrency: int) -> list[str]:
+    """Send `requests` chat completions to `server` through the scheduler; returns the replies."""
+    llm = ChatOpenAI(model=FAKE_MODEL, base_url=server.base_url, api_key="fake", max_retries=0, timeout=10)
+
+    def send(_: int) -> str:
+        return scheduler_.run(llm, PROMPT, lambda: llm.invoke(PROMPT).content)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(send, range(requests)))
+
+
+def test_rate_limited_requests_are_retried():
+    limiter = RequestScheduler({FAKE_MODEL: RateLimit(rpm=1000)}, max_retries=20)
+    with FakeOpenAIServer(error_rate=0.3, retry_after=0.05, seed=0) as server:
+        replies = _send(20, limiter, server, concurrency=4)
+
+    assert replies == [DEFAULT_REPLY] * 20
+    assert server.rate_limited > 0
+    assert server.requests == 20 + server.rate_limited
+    assert limiter.stats.rate_limited == server.rate_limited
+    assert limiter.stats.failures == 0
+
+
+def test_rpm_limit_is_respected(monkeypatch):
+    monkeypatch.setattr(scheduler, "WINDOW", 1.0)
+    limiter = RequestScheduler({FAKE_MODEL: RateLimit(rpm=3)}, max_retries=0)
+    # The server enforces the same limit over a slightly shorter window, to absorb network jitter.
+    with FakeOpenAIServer(rpm=3, window=0.8) as server:
+        replies = _send(9, limiter, server, concurrency=9)
+
+    assert replies == [DEFAULT_REPLY] * 9
+    assert server.rate_limited == 0
+    assert limiter.stats.throttled >= 6  # only the first 3 requests fit the first window
@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from streaming import GenerationAborted, StreamMonitor  # noqa: E402
+
+DECORATED = '''```python
+import functools
+from dataclasses import dataclass
+
+
+def trace(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@dataclass
+class Point:
+    x: int
+    y: int
+
+    @staticmethod
+    def origin() -> "Point":
+        return Point(0, 0)
+
+
+# Adds two numbers
+@trace
+@functools.lru_cache(maxsize=None)
+def add(a: int, b: int) -> int:
+    return a + b
+
+
+@dataclass(frozen=True)
+class Size:
+    width: int
+```
+'''
+
+
+def _stream(text: str, chunk_size: int) -> StreamMonitor:
+    monitor = StreamMonitor()
+    for start in range(0, len(text), chunk_size):
+        if monitor.feed(text[start:start + chunk_size]):
+            return monitor
+    raise AssertionError("closing fence never detected")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 20])
+def test_decorated_definitions_stream_to_completion(chunk_size):
+    monitor = _stream(DECORATED, chunk_size)
+    assert "class Size" in monitor.text
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 20])
+def test_syntax_error_before_decorator_aborts(chunk_size):
+    broken = "```python\ndef add(a, b)\n    return a + b\n\n\n@dataclass\nclass Point:\n    x: int\n```\n"
+    with pytest.raises(GenerationAborted):
+        _stream(broken, chunk_size)
@@ -0,0 +1,261 @@
+import argparse
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Where finished spans are appended as JSON lines (set to "" to keep them in memory only)
+TRACE_PATH = os.getenv("TRACE_PATH", ".cache/traces.jsonl")
+
+# Finished spans kept in memory for summaries (older ones are only in TRACE_PATH)
+MAX_FINISHED_SPANS = int(os.getenv("MAX_FINISHED_SPANS", "10000"))
+
+
+@dataclass
+class Span:
+    """One timed pipeline stage (generate_code, run_pytest, repair_code, ...)."""
+
+    stage: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None = None
+    start: float = 0.0  # wall-clock time (epoch seconds)
+    duration: float = 0.0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    llm_calls: int = 0
+    cache_hits: int = 0
+    retries: int = 0
+    status: str = "ok"  # "ok" or "error"
+    error: str = ""
+    attrs: dict[str, Any] = field(default_factory=dict)
+
+
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+_finished: deque[Span] = deque(maxlen=MAX_FINISHED_SPANS)
+_finished_count = 0  # including spans dropped from _finished
+_lock = threading.Lock()
+_trace_file = None
+
+
+def current_span() -> Span | None:
+    """The innermost open span of this thread/task (None outside any span)."""
+    return _current.get()
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def _export(finished: Span) -> None:
+    global _trace_file, _finished_count
+    with _lock:
+        _finished.append(finished)
+        _finished_count += 1
+        if not TRACE_PATH:
+            return
+        if _trace_file is None:
+            dirpath = os.path.dirname(TRACE_PATH)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+            _trace_file = open(TRACE_PATH, "a", encoding="utf-8")
+        _trace_file.write(json.dumps(asdict(finished), default=str) + "\n")
+        _trace_file.flush()
+
+
+@contextlib.contextmanager
+def span(stage: str, **attrs: Any):
+    """Time a stage; LLM tokens, cache hits and retries recorded meanwhile are attributed to it.
+
+    Spans nest: a span opened inside another one shares its trace id, so all
+    stages of one task can be grouped. Works in both threads and asyncio tasks.
+    """
+    parent = _current.get()
+    current = Span(
+        stage=stage,
+        trace_id=parent.trace_id if parent else _new_id(),
+        span_id=_new_id(),
+        parent_id=parent.span_id if parent else None,
+        start=time.time(),
+        attrs=attrs,
+    )
+    token = _current.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current.reset(token)
+        _export(current)
+
+
+def traced(stage: str):
+    """Decorator running each call of a (sync or async) function inside `span(stage)`."""
+
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# ---------- Recording ----------
+
+def record_tokens(tokens_in: int, tokens_out: int, model: str | None = None) -> None:
+    """Add the usage of one LLM call to the current span."""
+    current = _current.get()
+    if current is None:
+        return
+    with _lock:
+        current.tokens_in += tokens_in
+        current.tokens_out += tokens_out
+        current.llm_calls += 1
+        if model:
+            current.attrs.setdefault("model", model)
+
+
+def record_cache_hit() -> None:
+    """Count a cache hit (LLM response or embedding) in the current span."""
+    current = _current.get()
+    if current is not None:
+        with _lock:
+            current.cache_hits += 1
+
+
+def record_retry() -> None:
+    """Count a retried attempt in the current span."""
+    current = _current.get()
+    if current is not None:
+        with _lock:
+            current.retries += 1
+
+
+def _usage(response) -> tuple[int, int, str | None]:
+    """(input tokens, output tokens, model) of an LLMResult, from whichever field the provider fills."""
+    llm_output = response.llm_output or {}
+    usage = llm_output.get("token_usage") or {}
+    model = llm_output.get("model_name")
+    if usage:
+        return usage.get("prompt_tokens", 0) or 0, usage.get("completion_tokens", 0) or 0, model
+    tokens_in = tokens_out = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            tokens_in += metadata.get("input_tokens", 0)
+            tokens_out += metadata.get("output_tokens", 0)
+    return tokens_in, tokens_out, model
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """LangChain callback adding token usage and retries of every LLM call to the current span."""
+
+    # Run in the caller's context even for async calls, so current_span() is right.
+    run_inline = True
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        tokens_in, tokens_out, model = _usage(response)
+        record_tokens(tokens_in, tokens_out, model)
+
+    def on_retry(self, retry_state, **kwargs: Any) -> None:
+        record_retry()
+
+
+_handler = TokenUsageHandler()
+
+
+def trace_config() -> dict[str, Any]:
+    """RunnableConfig that reports token usage to the current span (pass as `config=`)."""
+    return {"callbacks": [_handler]}
+
+
+# ---------- Summary ----------
+
+def finished_span_count() -> int:
+    """Number of spans finished so far in this process (pass to finished_spans as `since`)."""
+    with _lock:
+        return _finished_count
+
+
+def finished_spans(since: int = 0) -> list[Span]:
+    """Spans finished in this process after the first `since`; only the last MAX_FINISHED_SPANS are kept."""
+    with _lock:
+        dropped = _finished_count - len(_finished)
+        return list(itertools.islice(_finished, max(0, since - dropped), None))
+
+
+def load_spans(path: str = TRACE_PATH) -> list[Span]:
+    """Read spans back from a JSONL trace file."""
+    with open(path, encoding="utf-8") as f:
+        return [Span(**json.loads(line)) for line in f if line.strip()]
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile (`q` in 0..1) of `values`, 0.0 when empty."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def format_summary(spans: Iterable[Span]) -> str:
+    """Per-stage table: calls, wall-clock time, tokens, cache hits, retries and errors.
+
+    Times are inclusive: a stage that contains another (generate_code calls
+    retrieve_style) also counts the inner stage's time.
+    """
+    stages: dict[str, list[Span]] = {}
+    for s in spans:
+        stages.setdefault(s.stage, []).append(s)
+    header = (f"{'stage':<18}{'calls':>6}{'total s':>10}{'mean s':>9}{'p95 s':>9}"
+              f"{'tok in':>10}{'tok out':>10}{'cache':>7}{'retries':>9}{'errors':>8}")
+    lines = [header, "-" * len(header)]
+    for stage, group in sorted(stages.items(), key=lambda item: -sum(s.duration for s in item[1])):
+        durations = [s.duration for s in group]
+        lines.append(
+            f"{stage:<18}{len(group):>6}{sum(durations):>10.2f}{sum(durations) / len(group):>9.2f}"
+            f"{percentile(durations, 0.95):>9.2f}{sum(s.tokens_in for s in group):>10}"
+            f"{sum(s.tokens_out for s in group):>10}{sum(s.cache_hits for s in group):>7}"
+            f"{sum(s.retries for s in group):>9}{sum(s.status == 'error' for s in group):>8}"
+        )
+    return "\n".join(lines)
+
+
+def print_summary(spans: Iterable[Span] | None = None) -> None:
+    """Print the per-stage table for `spans` (default: this process's spans)."""
+    spans = finished_spans() if spans is None else list(spans)
+    if spans:
+        print("\n⏱️ Time and tokens per stage:")
+        print(format_summary(spans))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a pipeline trace file per stage.")
+    parser.add_argument("path", nargs="?", default=TRACE_PATH, help="JSONL file written by the pipelines")
+    args = parser.parse_args()
+    print_summary(load_spans(args.path))
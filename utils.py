@@ -1,5 +1,7 @@
 import os
 import getpass
+import hashlib
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,3 +16,17 @@ def get_pass_api_key(key: str) -> None:
 
 def reset_api_key(key: str) -> None:
     os.environ[key] = ''
+
+
+def content_hash(*parts: str) -> str:
+    """Return a stable sha256 hex digest for the given text parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def model_slug(model_name: str) -> str:
+    """Filesystem-safe short form of a model name ("sentence-transformers/all-MiniLM-L6-v2" -> "all-MiniLM-L6-v2")."""
+    return re.sub(r"[^\w.-]+", "-", model_name.rsplit("/", 1)[-1]).strip("-.") or "model"
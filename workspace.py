@@ -0,0 +1,94 @@
+import atexit
+import os
+import shutil
+import tempfile
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+from preflight import run_checked
+from pytest_service import DEFAULT_ARGS, DEFAULT_TIMEOUT, RunResult
+
+# Parent directory for task workspaces (default: tmpfs when available, else the system temp dir)
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", "")
+_TMPFS = "/dev/shm"
+
+
+def workspace_root() -> str | None:
+    """Directory new workspaces are created in (None means the system temp dir)."""
+    if WORKSPACE_ROOT:
+        os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+        return WORKSPACE_ROOT
+    if os.path.isdir(_TMPFS) and os.access(_TMPFS, os.W_OK):
+        return _TMPFS
+    return None
+
+
+def _write(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+@dataclass
+class Workspace:
+    """A private directory holding one generated module and its test file.
+
+    Each task writes and tests inside its own workspace, so concurrent runs
+    never overwrite each other's files and pytest only collects this task's
+    tests. The layout mirrors the repo (`<module>.py`, `tests/test_<module>.py`)
+    so `publish` can copy the result back.
+    """
+
+    path: str
+    module_name: str
+
+    @property
+    def code_file(self) -> str:
+        return f"{self.module_name}.py"
+
+    @property
+    def test_file(self) -> str:
+        return os.path.join("tests", f"test_{self.module_name}.py")
+
+    def write_code(self, code: str) -> None:
+        _write(os.path.join(self.path, self.code_file), code)
+
+    def write_tests(self, tests: str) -> None:
+        _write(os.path.join(self.path, self.test_file), tests)
+
+    def run_tests(self, args=DEFAULT_ARGS, timeout: float = DEFAULT_TIMEOUT, select: Sequence[str] = ()) -> RunResult:
+        """Run pytest on this workspace's test file only (or the `select`ed tests in it).
+
+        Static pre-flight checks run first and answer without pytest when they find problems.
+        """
+        return run_checked(self.test_file, cwd=self.path, args=args, timeout=timeout, select=select)
+
+    def publish(self, dest_dir: str = ".") -> list[str]:
+        """Copy the module and its tests into `dest_dir`; returns the written paths."""
+        written = []
+        for name in (self.code_file, self.test_file):
+            source = os.path.join(self.path, name)
+            if os.path.exists(source):
+                target = os.path.join(dest_dir, name)
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                shutil.copyfile(source, target)
+                written.append(target)
+        return written
+
+    def cleanup(self) -> None:
+        """Delete the workspace directory."""
+        atexit.unregister(self.cleanup)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+
+def create_workspace(module_name: str = "generated_code", prefix: str = "task-") -> Workspace:
+    """Create an empty workspace; it is removed on cleanup() or at interpreter exit."""
+    workspace = Workspace(tempfile.mkdtemp(prefix=prefix, dir=workspace_root()), module_name)
+    atexit.register(workspace.cleanup)
+    return workspace